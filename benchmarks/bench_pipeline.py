@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmark, offline (no model download, no GPU)
+- Generates synthetic multi-page PDFs (scanned-looking pages)
+- Runs a processor's process_directory() with the fake OCR backend
+- Reports pages/sec, time per stage (render, resize, template, processor, generate,
+  decode, boundary, write) and peak RSS, to catch regressions in the non-model
+  parts of the pipeline
+
+Needs poppler (pdftoppm/pdfinfo) like the real pipeline. Run from the repository root:
+    python3 benchmarks/bench_pipeline.py --pdfs 3 --pages 12 --latency 0.05 --batch-size 2
+"""
+
+import importlib
+import json
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from bench_png_roundtrip import make_page
+from metrics import STAGES
+from ocr_engine import FakeBackend, OCREngine
+from page_source import DEFAULT_PREFETCH_DEPTH
+
+
+PROCESSORS = {
+    "basic": "ocr_processor",
+    "cpu-offload": "ocr_nanonets_cpu_offload",
+    "pausable": "ocr_nanonets_pausable",
+}
+
+
+def make_pdf(pdf_path: Path, num_pages: int, dpi: int, seed: int = 0) -> None:
+    """Write a synthetic PDF of A4 pages meant to be rendered back at `dpi`"""
+    # A4 height at the render DPI, so poppler output matches a real scan
+    height = int(11.69 * dpi)
+    pages = [make_page(height, seed=seed * 1000 + i) for i in range(num_pages)]
+    pages[0].save(pdf_path, "PDF", resolution=dpi, save_all=True, append_images=pages[1:])
+
+
+def peak_rss_mb(who: int) -> float:
+    """Peak resident set size in MB (ru_maxrss is in KB on Linux, bytes on macOS)"""
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the OCR pipeline")
+    parser.add_argument("--processor", choices=sorted(PROCESSORS), default="pausable",
+                       help="Entry point to benchmark (default: pausable)")
+    parser.add_argument("--pdfs", type=int, default=2, help="Number of synthetic PDFs (default: 2)")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per PDF (default: 10)")
+    parser.add_argument("--dpi", type=int, default=150, help="Render DPI (default: 150)")
+    parser.add_argument("--max-dimension", type=int, default=1400,
+                       help="Longest side of the page before OCR (default: 1400)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                       help="Simulated generate time per page in seconds (default: 0)")
+    parser.add_argument("--output-chars", type=int, default=2000,
+                       help="Characters of text per page returned by the fake backend (default: 2000)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Pages per generate call (default: 1)")
+    parser.add_argument("--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                       help=f"Pages rendered ahead of OCR (default: {DEFAULT_PREFETCH_DEPTH})")
+    parser.add_argument("--json", type=str, default=None,
+                       help="Also write the results to this JSON file (for comparisons in CI)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary PDFs and outputs")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    input_dir = work_dir / "input"
+    output_dir = work_dir / "ocr_results"
+    input_dir.mkdir()
+
+    try:
+        print(f"Generating {args.pdfs} PDF(s) of {args.pages} pages in {work_dir}...")
+        for i in range(args.pdfs):
+            make_pdf(input_dir / f"synthetic_{i + 1:02d}.pdf", args.pages, args.dpi, seed=i)
+
+        engine = OCREngine(
+            FakeBackend(latency_s=args.latency, output_chars=args.output_chars),
+            max_dimension=args.max_dimension,
+            batch_size=args.batch_size
+        )
+        module = importlib.import_module(PROCESSORS[args.processor])
+        processor = module.NanonetsOCRProcessor(
+            output_base_dir=str(output_dir),
+            prefetch_depth=args.prefetch_depth,
+            engine=engine
+        )
+
+        start = time.perf_counter()
+        processor.process_directory(str(input_dir))
+        elapsed = time.perf_counter() - start
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    total_pages = args.pdfs * args.pages
+    stages = engine.timer.snapshot()
+    results = {
+        "processor": args.processor,
+        "pdfs": args.pdfs,
+        "pages": total_pages,
+        "batch_size": args.batch_size,
+        "prefetch_depth": args.prefetch_depth,
+        "latency_s": args.latency,
+        "elapsed_s": round(elapsed, 3),
+        "pages_per_sec": round(total_pages / elapsed, 3),
+        "stages": stages,
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_rss_children_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+    print(f"\n{'='*60}")
+    print(f"Processor: {args.processor}, {total_pages} pages, batch size {args.batch_size}, "
+          f"prefetch depth {args.prefetch_depth}, fake latency {args.latency}s/page")
+    print(f"  wall time:  {elapsed:8.2f} s")
+    print(f"  throughput: {results['pages_per_sec']:8.2f} pages/s")
+    print("  stages (total / per page; render and resize overlap with OCR when prefetching):")
+    for stage in STAGES + sorted(set(stages) - set(STAGES)):
+        if stage in stages:
+            total = stages[stage]["total_s"]
+            print(f"    {stage:<11} {total:8.2f} s  {total / total_pages * 1000:8.1f} ms/page")
+    print(f"  peak RSS:   {results['peak_rss_mb']:8.1f} MB (pdftoppm: {results['peak_rss_children_mb']:.1f} MB)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: cost of the temporary PNG round-trip formerly done in ocr_image
+The old path saved the resized page to a NamedTemporaryFile PNG, referenced it by
+file:// URL in the chat template, then deleted it. The template never reads the
+file and the processor call is unchanged, so the PNG encode, write and removal is
+exactly the per-page cost that was removed; only that is timed here.
+
+Run from the repository root:
+    python3 benchmarks/bench_png_roundtrip.py --pages 50 --max-dimension 1400
+"""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+from PIL import Image, ImageDraw
+
+
+def make_page(max_dimension: int, seed: int = 0) -> Image.Image:
+    """Build a synthetic scanned-looking page (A4 ratio, text-like strokes, noise)"""
+    rng = random.Random(seed)
+    width = int(max_dimension / 1.414)
+    height = max_dimension
+    image = Image.new("RGB", (width, height), (245, 242, 235))
+    draw = ImageDraw.Draw(image)
+
+    y = 60
+    while y < height - 60:
+        x = 50
+        while x < width - 80:
+            word = rng.randint(15, 70)
+            draw.rectangle([x, y, x + word, y + 14], fill=(30, 30, 30))
+            x += word + rng.randint(8, 16)
+        y += rng.randint(24, 36)
+
+    # Scanner noise makes PNG compression behave like on real archive pages
+    noise = Image.effect_noise((width, height), 18).convert("RGB")
+    return Image.blend(image, noise, 0.08)
+
+
+def time_tempfile_roundtrip(image: Image.Image) -> float:
+    """Time the former per-page path: PNG encode to a temp file, then remove it"""
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
+        tmp_path = tmp_file.name
+        image.save(tmp_path)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return time.perf_counter() - start
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the temp PNG round-trip per OCR page")
+    parser.add_argument("--pages", type=int, default=30, help="Number of pages to time")
+    parser.add_argument("--max-dimension", type=int, default=1400,
+                       help="Longest side of the page, as resized before OCR (default: 1400)")
+    args = parser.parse_args()
+
+    pages = [make_page(args.max_dimension, seed=i) for i in range(min(args.pages, 5))]
+
+    tempfile_times = []
+    for i in range(args.pages):
+        image = pages[i % len(pages)]
+        tempfile_times.append(time_tempfile_roundtrip(image))
+
+    tempfile_ms = statistics.median(tempfile_times) * 1000
+
+    print(f"Page size: {pages[0].size[0]}x{pages[0].size[1]}, {args.pages} pages")
+    print(f"  removed PNG round-trip: {tempfile_ms:8.2f} ms/page (median)")
+    print(f"  on 1000 pages:          {tempfile_ms:8.1f} s")
+
+
+if __name__ == "__main__":
+    main()
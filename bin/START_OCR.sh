@@ -43,12 +43,23 @@ echo ""
 echo "Appuyez sur Ctrl+C dans les 3 secondes pour annuler..."
 sleep 3
 
+# Démon OCR lancé (start_daemon.sh): modèle déjà chargé, on lui confie le lot
+if python3 ../src/ocr_daemon.py status > /dev/null 2>&1; then
+    python3 ../src/ocr_daemon.py submit directory --input-dir ../data/input --ocr-timeout 180 || exit 1
+    echo ""
+    echo "✅ Traitement soumis au démon OCR"
+    echo "   Log: logs/ocr_daemon.log"
+    echo "   Suivi: python3 ../src/ocr_daemon.py status"
+    exit 0
+fi
+
 # Lancement en arrière-plan
 nohup python3 ../src/ocr_nanonets_pausable.py \
     --input-dir ../data/input \
     --output-dir ../data/output/ocr_results \
     --dpi 150 \
     --ocr-timeout 180 \
+    --metrics-port 9108 \
     > ../logs/ocr_production.log 2>&1 &
 
 PID=$!
@@ -63,6 +74,7 @@ echo "📊 Monitoring:"
 echo "   tail -f logs/ocr_production.log     # Logs en temps réel"
 echo "   watch -n 5 nvidia-smi                # GPU usage"
 echo "   bin/monitor_ocr.sh                   # Dashboard complet"
+echo "   curl -s localhost:9108/metrics       # Compteurs live (Prometheus)"
 echo ""
 echo "⏹️  Arrêter:"
 echo "   kill $PID"
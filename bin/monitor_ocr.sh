@@ -33,10 +33,28 @@ else
     exit 1
 fi
 
+# Compteurs live exposés par le processus (--metrics-port), sinon analyse des logs
+METRICS_URL="http://127.0.0.1:${OCR_METRICS_PORT:-9108}/metrics"
+METRICS=$(curl -s --max-time 2 "$METRICS_URL" 2>/dev/null)
+
+# Valeur d'une métrique, ex: metric 'ocr_pages_total{status="timeout"}'
+metric() {
+    echo "$METRICS" | grep -v '^#' | grep -F "$1" | head -1 | awk '{print $NF}'
+}
+
+# Compteurs de l'index du corpus (pdfs_done, pages, skipped_pages, documents,
+# output_bytes...) : une requête au lieu de relire chaque _summary.json
+eval "$(python3 ../src/corpus_index.py --output-dir ../data/output/ocr_results --shell 2>/dev/null)"
+
 # 2. Progression PDFs
 section "📁 PROGRESSION PDFs"
-total=$(ls ../data/input/*.pdf 2>/dev/null | wc -l)
-completed=$(ls -d ../data/output/ocr_results/*/ 2>/dev/null | wc -l)
+if [ ! -z "$METRICS" ]; then
+    total=$(metric "ocr_pdfs_total ")
+    completed=$(metric "ocr_pdfs_completed ")
+else
+    total=$(ls ../data/input/*.pdf 2>/dev/null | wc -l)
+    completed=${pdfs_done:-$(ls -d ../data/output/ocr_results/*/ 2>/dev/null | wc -l)}
+fi
 remaining=$((total - completed))
 percent=$((completed * 100 / total))
 
@@ -57,17 +75,31 @@ if [ $completed -gt 0 ]; then
     fi
 fi
 
+if [ ! -z "$METRICS" ]; then
+    echo "   Débit:      $(metric ocr_pages_per_second) pages/s (60 dernières secondes)"
+    hit_ratio=$(metric "ocr_cache_hit_ratio ")
+    echo "   Cache OCR:  $(awk -v r="$hit_ratio" 'BEGIN {printf "%.0f", r * 100}')% de hits"
+    echo "   RAM:        $(($(metric ocr_process_resident_memory_bytes) / 1048576)) MB"
+fi
+
 # 3. PDF en cours
 section "📄 PDF EN COURS"
-current_pdf=$(tail -100 ../logs/ocr_production.log 2>/dev/null | grep "Processing:" | tail -1 | sed 's/.*Processing: //')
-if [ ! -z "$current_pdf" ]; then
-    echo "   Fichier: $current_pdf"
+if [ ! -z "$METRICS" ]; then
+    current_pdf=$(echo "$METRICS" | grep '^ocr_current_pdf_pages{' | sed 's/.*pdf="\(.*\)"}.*/\1/')
+    page_current=$(metric "ocr_current_pdf_pages_done{")
+    page_total=$(metric "ocr_current_pdf_pages{")
+else
+    current_pdf=$(tail -100 ../logs/ocr_production.log 2>/dev/null | grep "Processing:" | tail -1 | sed 's/.*Processing: //')
 
     # Progression pages
     page_current=$(tail -100 ../logs/ocr_production.log 2>/dev/null | grep "Processing page" | tail -1 | sed 's/.*Processing page //' | cut -d'/' -f1)
     page_total=$(tail -100 ../logs/ocr_production.log 2>/dev/null | grep "Processing page" | tail -1 | sed 's/.*Processing page //' | cut -d'/' -f2 | cut -d'.' -f1)
+fi
+
+if [ ! -z "$current_pdf" ]; then
+    echo "   Fichier: $current_pdf"
 
-    if [ ! -z "$page_current" ] && [ ! -z "$page_total" ]; then
+    if [ ! -z "$page_current" ] && [ ! -z "$page_total" ] && [ "$page_total" -gt 0 ]; then
         page_percent=$((page_current * 100 / page_total))
         echo "   Pages:   $page_current / $page_total [$page_percent%]"
     fi
@@ -104,13 +136,23 @@ done
 
 # 6. Erreurs/Timeouts
 section "⚠️  ERREURS & TIMEOUTS"
-timeouts=$(grep -c "TIMEOUT" ../logs/ocr_production.log 2>/dev/null || echo 0)
-errors=$(grep -c "ERROR" ../logs/ocr_production.log 2>/dev/null || echo 0)
+if [ ! -z "$METRICS" ]; then
+    timeouts=$(metric 'ocr_pages_total{status="timeout"}')
+    errors=$(metric 'ocr_pages_total{status="error"}')
+    pages_done=$((timeouts + errors + $(metric 'ocr_pages_total{status="ok"}')))
+else
+    timeouts=$(grep -c "TIMEOUT" ../logs/ocr_production.log 2>/dev/null || echo 0)
+    errors=$(grep -c "ERROR" ../logs/ocr_production.log 2>/dev/null || echo 0)
+    pages_done=${pages:-$((completed * 50))}  # Sans index : approximation 50 pages/PDF
+fi
 echo "   Timeouts: $timeouts pages"
 echo "   Erreurs:  $errors"
+if [ ! -z "$skipped_pages" ]; then
+    echo "   Pages encore avortées (index): $skipped_pages dans $pdfs_with_skipped PDFs"
+fi
 
-if [ $timeouts -gt 0 ]; then
-    timeout_percent=$((timeouts * 100 / (completed * 50)))  # Approximation 50 pages/PDF
+if [ $timeouts -gt 0 ] && [ $pages_done -gt 0 ]; then
+    timeout_percent=$((timeouts * 100 / pages_done))
     if [ $timeout_percent -gt 20 ]; then
         echo "   ⚠️  Taux élevé de timeouts (>${timeout_percent}%)"
     fi
@@ -118,9 +160,15 @@ fi
 
 # 7. Statistiques Output
 section "💾 FICHIERS GÉNÉRÉS"
-md_files=$(find ../data/output/ocr_results -name "*.md" -not -name "_*" 2>/dev/null | wc -l)
-json_files=$(find ../data/output/ocr_results -name "_summary.json" 2>/dev/null | wc -l)
-output_size=$(du -sh ../data/output/ocr_results 2>/dev/null | cut -f1)
+if [ ! -z "$pdfs_done" ]; then
+    md_files=$documents
+    json_files=$pdfs_done
+    output_size="$((output_bytes / 1048576)) MB (markdown)"
+else
+    md_files=$(find ../data/output/ocr_results -name "*.md" -not -name "_*" 2>/dev/null | wc -l)
+    json_files=$(find ../data/output/ocr_results -name "_summary.json" 2>/dev/null | wc -l)
+    output_size=$(du -sh ../data/output/ocr_results 2>/dev/null | cut -f1)
+fi
 echo "   Documents:  $md_files fichiers .md"
 echo "   Summaries:  $json_files fichiers .json"
 echo "   Taille:     $output_size"
@@ -36,6 +36,13 @@ echo ""
 echo "Reprise du traitement..."
 echo ""
 
+# Démon OCR lancé (start_daemon.sh): modèle déjà chargé, on lui confie la reprise
+if python3 ../src/ocr_daemon.py status > /dev/null 2>&1; then
+    echo "Démon OCR actif: travail soumis (suivi: python3 ../src/ocr_daemon.py status)"
+    python3 ../src/ocr_daemon.py submit directory --input-dir ../data/input
+    exit $?
+fi
+
 mkdir -p ../data/output/ocr_results offload
 
 python3 ../src/ocr_nanonets_pausable.py \
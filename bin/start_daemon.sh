@@ -0,0 +1,43 @@
+#!/bin/bash
+# Démon OCR résident: le modèle est chargé une seule fois, les traitements
+# (lot complet, PDF isolé, pages, retraitement des pages avortées) lui sont
+# soumis avec ocr_daemon.py submit
+
+PORT=${OCR_DAEMON_PORT:-9110}
+
+if python3 ../src/ocr_daemon.py status --url "http://127.0.0.1:$PORT" > /dev/null 2>&1; then
+    echo "✅ Démon OCR déjà lancé sur le port $PORT"
+    exit 0
+fi
+
+mkdir -p ../data/output/ocr_results ../logs offload
+
+nohup python3 ../src/ocr_daemon.py serve \
+    --port "$PORT" \
+    --input-dir ../data/input \
+    --output-dir ../data/output/ocr_results \
+    --dpi 150 \
+    --ocr-timeout 180 \
+    > ../logs/ocr_daemon.log 2>&1 &
+
+PID=$!
+echo "=================================================="
+echo "✅ Démon OCR lancé (chargement du modèle en cours)"
+echo "=================================================="
+echo "   PID: $PID"
+echo "   Log: logs/ocr_daemon.log"
+echo ""
+echo "📤 Soumettre un travail:"
+echo "   python3 ../src/ocr_daemon.py submit directory            # PDFs restants"
+echo "   python3 ../src/ocr_daemon.py submit pdf FICHIER.pdf --wait"
+echo "   python3 ../src/ocr_daemon.py submit pages FICHIER.pdf --first 3 --last 5 --wait"
+echo "   python3 ../src/ocr_daemon.py submit retry --timeout 300  # pages avortées"
+echo ""
+echo "📊 Suivi:"
+echo "   python3 ../src/ocr_daemon.py status"
+echo "   python3 ../src/ocr_daemon.py jobs"
+echo "   curl -s localhost:$PORT/metrics"
+echo ""
+echo "⏹️  Arrêter (un travail en cours reprendra à sa prochaine soumission):"
+echo "   kill $PID"
+echo "=================================================="
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Corpus-level index of the OCR output (SQLite, _corpus_index.sqlite in the output directory)
+- One row per PDF: status, page counts, skipped / repetition / blank pages,
+  timings and output files, taken from its _summary.json
+- One row per skipped page, with its _summary.json entry
+- The processors and the retry script update it whenever they write a
+  _summary.json, so reports (count_aborted_pages, the retry schedule,
+  monitor_ocr.sh) are queries instead of a walk over every summary
+- sync() catches up with summaries written or changed behind its back (older
+  runs, deleted index, hand edits): a stat per PDF, summaries only read when new
+"""
+
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+
+INDEX_NAME = "_corpus_index.sqlite"
+SUMMARY_NAME = "_summary.json"
+
+
+def output_files(pdf_dir: Path) -> List[Dict]:
+    """Markdown documents of a PDF output folder, with their sizes"""
+    files = []
+    for entry in sorted(os.scandir(pdf_dir), key=lambda entry: entry.name):
+        if entry.name.endswith(".md") and not entry.name.startswith(("_", ".")):
+            files.append({"file": entry.name, "bytes": entry.stat().st_size})
+    return files
+
+
+class CorpusIndex:
+    def __init__(self, output_dir: str, db_path: str = None):
+        """Open (or create) the index of an output directory (one sub-folder per PDF)"""
+        self.output_dir = Path(output_dir)
+        self.db_path = Path(db_path) if db_path else self.output_dir / INDEX_NAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Workers (and hosts, with --queue-dir) update it concurrently, and the
+        # output tree may be an NFS mount: rollback journal, not WAL (its -shm
+        # index only works between processes of one host). Writers wait their
+        # turn up to the busy timeout
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self.conn.execute("PRAGMA busy_timeout = 30000")
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pdfs (
+                pdf_name TEXT PRIMARY KEY,
+                dir_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total_pages INTEGER,
+                documents INTEGER,
+                skipped_pages INTEGER NOT NULL DEFAULT 0,
+                truncated_pages INTEGER NOT NULL DEFAULT 0,
+                repetition_pages INTEGER NOT NULL DEFAULT 0,
+                blank_pages INTEGER NOT NULL DEFAULT 0,
+                generate_s REAL,
+                latency_mean_s REAL,
+                output_files TEXT,
+                output_bytes INTEGER NOT NULL DEFAULT 0,
+                summary_mtime_ns INTEGER,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pdfs_dir ON pdfs(dir_name);
+            CREATE TABLE IF NOT EXISTS skipped_pages (
+                pdf_name TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                entry TEXT NOT NULL,
+                PRIMARY KEY (pdf_name, page)
+            );
+        """)
+        self.conn.commit()
+
+    def mark_started(self, pdf_name: str, total_pages: int, dir_name: str = None) -> None:
+        """A PDF is being processed (its summary replaces this row when written)"""
+        try:
+            self.conn.execute(
+                "INSERT INTO pdfs (pdf_name, dir_name, status, total_pages, updated) VALUES (?, ?, 'processing', ?, ?) "
+                "ON CONFLICT(pdf_name) DO UPDATE SET status = 'processing', total_pages = excluded.total_pages, "
+                "updated = excluded.updated",
+                (pdf_name, dir_name or pdf_name, total_pages, time.time())
+            )
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not update {self.db_path.name}: {e}")
+
+    def record_summary(self, pdf_dir: Path, summary: Dict) -> None:
+        """Index the _summary.json just written to pdf_dir (summary: its content)"""
+        pdf_dir = Path(pdf_dir)
+        try:
+            mtime_ns = (pdf_dir / SUMMARY_NAME).stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        skipped = summary.get("skipped_pages", [])
+        stages = summary.get("timings", {}).get("stages_s", {})
+        files = output_files(pdf_dir)
+        pdf_name = summary.get("pdf_name", pdf_dir.name)
+
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO pdfs (pdf_name, dir_name, status, total_pages, documents, "
+                    "skipped_pages, truncated_pages, repetition_pages, blank_pages, generate_s, latency_mean_s, "
+                    "output_files, output_bytes, summary_mtime_ns, updated) "
+                    "VALUES (?, ?, 'done', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (pdf_name, pdf_dir.name, summary.get("total_pages"), summary.get("documents_found"),
+                     len(skipped), sum(1 for entry in skipped if entry.get("truncated")),
+                     len(summary.get("repetition_pages", [])), summary.get("blank_pages", {}).get("count", 0),
+                     stages.get("generate"), summary.get("timings", {}).get("page_latency", {}).get("mean_s"),
+                     json.dumps([f["file"] for f in files]), sum(f["bytes"] for f in files),
+                     mtime_ns, time.time())
+                )
+                self.conn.execute("DELETE FROM skipped_pages WHERE pdf_name = ?", (pdf_name,))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO skipped_pages (pdf_name, page, entry) VALUES (?, ?, ?)",
+                    [(pdf_name, entry["page"], json.dumps(entry, ensure_ascii=False)) for entry in skipped]
+                )
+        except sqlite3.Error as e:
+            # The index can always be rebuilt from the summaries (sync)
+            print(f"Warning: Could not update {self.db_path.name}: {e}")
+
+    def sync(self) -> int:
+        """
+        Bring the index in line with the summaries on disk: one stat per output
+        folder, and only new or changed summaries are read (written by older
+        runs, or edited by hand); folders without a summary are dropped
+        Returns the number of summaries read
+        """
+        known = dict(self.conn.execute(
+            "SELECT dir_name, summary_mtime_ns FROM pdfs WHERE status = 'done'").fetchall())
+        current = set()
+        refreshed = 0
+        for entry in os.scandir(self.output_dir):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            summary_file = Path(entry.path) / SUMMARY_NAME
+            try:
+                mtime_ns = summary_file.stat().st_mtime_ns
+            except OSError:
+                continue
+            current.add(entry.name)
+            if known.get(entry.name) == mtime_ns:
+                continue
+            try:
+                with open(summary_file, 'r', encoding='utf-8') as f:
+                    summary = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read {summary_file}: {e}")
+                continue
+            self.record_summary(Path(entry.path), summary)
+            refreshed += 1
+
+        # Summaries deleted (e.g. to process a PDF again)
+        with self.conn:
+            for dir_name in set(known) - current:
+                self.conn.execute("DELETE FROM skipped_pages WHERE pdf_name IN "
+                                  "(SELECT pdf_name FROM pdfs WHERE dir_name = ?)", (dir_name,))
+                self.conn.execute("DELETE FROM pdfs WHERE dir_name = ?", (dir_name,))
+        return refreshed
+
+    def processed(self) -> Set[str]:
+        """Output folder names of the PDFs with a summary"""
+        return {row[0] for row in self.conn.execute("SELECT dir_name FROM pdfs WHERE status = 'done'")}
+
+    def aborted(self) -> List[Dict]:
+        """
+        PDFs with skipped pages, fewest first: pdf_name, pdf_dir, summary_file,
+        skipped_pages (their _summary.json entries), count, total_pages
+        """
+        rows = self.conn.execute(
+            "SELECT p.pdf_name, p.dir_name, p.total_pages, s.entry FROM pdfs p "
+            "JOIN skipped_pages s ON s.pdf_name = p.pdf_name WHERE p.status = 'done' "
+            "ORDER BY p.skipped_pages, p.pdf_name, s.page"
+        ).fetchall()
+        aborted = {}
+        for pdf_name, dir_name, total_pages, entry in rows:
+            if pdf_name not in aborted:
+                pdf_dir = self.output_dir / dir_name
+                aborted[pdf_name] = {"pdf_name": pdf_name, "pdf_dir": pdf_dir,
+                                     "summary_file": pdf_dir / SUMMARY_NAME, "skipped_pages": [],
+                                     "count": 0, "total_pages": total_pages}
+            aborted[pdf_name]["skipped_pages"].append(json.loads(entry))
+            aborted[pdf_name]["count"] += 1
+        return list(aborted.values())
+
+    def totals(self) -> Dict:
+        """Corpus-wide counters"""
+        row = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(total_pages), 0), COALESCE(SUM(documents), 0), "
+            "COALESCE(SUM(skipped_pages), 0), COALESCE(SUM(truncated_pages), 0), "
+            "COALESCE(SUM(repetition_pages), 0), COALESCE(SUM(blank_pages), 0), "
+            "COALESCE(SUM(skipped_pages > 0), 0), COALESCE(SUM(output_bytes), 0), "
+            "COALESCE(SUM(generate_s), 0) FROM pdfs WHERE status = 'done'"
+        ).fetchone()
+        processing = self.conn.execute("SELECT COUNT(*) FROM pdfs WHERE status = 'processing'").fetchone()[0]
+        keys = ["pdfs_done", "pages", "documents", "skipped_pages", "truncated_pages", "repetition_pages",
+                "blank_pages", "pdfs_with_skipped", "output_bytes", "generate_s"]
+        return {**dict(zip(keys, row)), "pdfs_processing": processing}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Corpus index of the OCR output")
+    parser.add_argument("--output-dir", default="../data/output/ocr_results")
+    parser.add_argument("--shell", action="store_true",
+                        help="Print the counters as shell variables (monitor_ocr.sh)")
+    args = parser.parse_args()
+
+    if not Path(args.output_dir).is_dir():
+        parser.error(f"{args.output_dir} does not exist")
+
+    index = CorpusIndex(args.output_dir)
+    refreshed = index.sync()
+    totals = index.totals()
+    index.close()
+
+    if args.shell:
+        for key, value in totals.items():
+            print(f"{key}={int(value)}")
+        return
+
+    print(f"Index: {index.db_path} ({refreshed} summaries read)")
+    for key, value in totals.items():
+        print(f"  {key:<18} {value:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 #!/usr/bin/env python3
 """
-Script pour compter les pages avortées (skipped) dans tous les fichiers _summary.json
+Script pour compter les pages avortées (skipped) de tous les PDFs traités
+Lit l'index du corpus (_corpus_index.sqlite) au lieu de parcourir chaque
+_summary.json
 """
 
-import json
 from pathlib import Path
 from typing import Dict, List
 
+from corpus_index import CorpusIndex
+
+
 def count_aborted_pages(ocr_output_dir: str = "../data/output/ocr_results") -> Dict:
     """
-    Parcourt tous les dossiers d'output OCR et compte les pages avortées
+    Compte les pages avortées de tous les PDFs de l'index du corpus
 
     Returns:
         Dict avec les statistiques et détails
@@ -20,48 +24,25 @@ def count_aborted_pages(ocr_output_dir: str = "../data/output/ocr_results") -> D
         print(f"❌ Le dossier {ocr_output_dir} n'existe pas")
         return {}
 
-    total_aborted = 0
-    total_pdfs = 0
-    pdfs_with_aborted = 0
-    details = []
-
-    # Parcourir tous les sous-dossiers
-    for pdf_dir in sorted(ocr_path.iterdir()):
-        if not pdf_dir.is_dir():
-            continue
-
-        summary_file = pdf_dir / "_summary.json"
-
-        if not summary_file.exists():
-            continue
-
-        total_pdfs += 1
-
-        try:
-            with open(summary_file, 'r', encoding='utf-8') as f:
-                summary = json.load(f)
-
-            # Vérifier s'il y a des pages ignorées
-            if "skipped_pages" in summary and summary["skipped_pages"]:
-                skipped = summary["skipped_pages"]
-                num_skipped = len(skipped)
-                total_aborted += num_skipped
-                pdfs_with_aborted += 1
-
-                details.append({
-                    "pdf_name": summary.get("pdf_name", pdf_dir.name),
-                    "total_pages": summary.get("total_pages", 0),
-                    "skipped_count": num_skipped,
-                    "skipped_pages": skipped
-                })
-
-        except Exception as e:
-            print(f"⚠️ Erreur lors de la lecture de {summary_file}: {e}")
+    index = CorpusIndex(ocr_path)
+    # Relire les summaries que l'index ne connaît pas encore (anciens traitements)
+    index.sync()
+    totals = index.totals()
+    details = [{
+        "pdf_name": data["pdf_name"],
+        "total_pages": data["total_pages"] or 0,
+        "skipped_count": data["count"],
+        "skipped_pages": data["skipped_pages"]
+    } for data in index.aborted()]
+    index.close()
 
     return {
-        "total_pdfs": total_pdfs,
-        "pdfs_with_aborted": pdfs_with_aborted,
-        "total_aborted_pages": total_aborted,
+        "total_pdfs": totals["pdfs_done"],
+        "pdfs_with_aborted": totals["pdfs_with_skipped"],
+        "total_aborted_pages": totals["skipped_pages"],
+        # Pages arrêtées sur une boucle de répétition (texte conservé mais à vérifier)
+        "total_repetition_pages": totals["repetition_pages"],
+        "total_blank_pages": totals["blank_pages"],
         "details": details
     }
 
@@ -75,6 +56,8 @@ def display_results(results: Dict):
     print(f"\n📁 Total de PDFs traités: {results['total_pdfs']}")
     print(f"⚠️  PDFs avec pages avortées: {results['pdfs_with_aborted']}")
     print(f"❌ Total de pages avortées: {results['total_aborted_pages']}")
+    print(f"🔁 Pages coupées sur une répétition: {results['total_repetition_pages']}")
+    print(f"⬜ Pages blanches (non OCRisées): {results['total_blank_pages']}")
 
     if results['details']:
         print("\n" + "-"*70)
@@ -87,7 +70,8 @@ def display_results(results: Dict):
             print(f"   Pages avortées: {detail['skipped_count']}")
             print(f"   Détails:")
             for skipped in detail['skipped_pages']:
-                print(f"      - Page {skipped['page']}: {skipped['reason']}")
+                partial = f" (tronquée, {skipped['partial_chars']} caractères conservés)" if skipped.get('truncated') else ""
+                print(f"      - Page {skipped['page']}: {skipped['reason']}{partial}")
     else:
         print("\n✅ Aucune page avortée trouvée!")
 
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Markdown documents written page by page
+- Each page section is appended to <doc>.md.part as soon as it is OCR'd,
+  then journaled: a crash loses at most the page being processed
+- Closing the document writes the header (page range, page count) followed
+  by the body to a temp file, renamed over <doc>.md: readers only ever see
+  complete documents
+- Orphaned .part files (interrupted run) are cut back to their journaled
+  pages and finalized on resume
+- Pages of finished documents can be replaced later (retries), one atomic
+  rewrite per document whatever the number of pages
+"""
+
+import os
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+from page_journal import PageJournal, JOURNAL_NAME, doc_number, page_file_index, page_sections, text_status
+
+
+PART_SUFFIX = ".part"
+PAGE_END = "\n\n---\n\n"
+REPETITION_REASON = "repetition loop"
+
+
+def markdown_header(document_num: int, first_page: int, last_page: int, num_pages: int) -> str:
+    """Document title and page range, page numbers being 0-indexed"""
+    parts = [f"# Document {document_num}\n\n", f"Pages: {first_page + 1}"]
+    if num_pages > 1:
+        parts.append(f" - {last_page + 1}")
+    parts.append(f" ({num_pages} page{'s' if num_pages > 1 else ''})\n\n")
+    parts.append("---\n\n")
+    return "".join(parts)
+
+
+def markdown_page(page_num: int, text: str) -> str:
+    """Section of one page, page_num being 0-indexed"""
+    return f"## Page {page_num + 1}\n\n{text}{PAGE_END}"
+
+
+def timeout_page_text(timeout_s: float, partial: str = None) -> str:
+    """
+    Page text of a timed-out page: the text generated before the cut, under a
+    [TRUNCATED] marker, or a [SKIPPED] marker when nothing was generated
+    The partial is kept as generated: a retry continues right after it
+    """
+    if partial and partial.strip():
+        return f"[TRUNCATED: OCR timeout after {timeout_s:g}s]\n\n{partial}"
+    return f"[SKIPPED: OCR timeout after {timeout_s:g}s]"
+
+
+def skipped_page_entry(page: int, timeout_s: float, partial: str = None) -> Dict:
+    """_summary.json entry of a timed-out page (page 1-indexed)"""
+    entry = {"page": page, "reason": f"OCR timeout after {timeout_s:g} seconds"}
+    if partial and partial.strip():
+        entry.update({"truncated": True, "partial_chars": len(partial)})
+    return entry
+
+
+def repetition_page_text(text: str) -> str:
+    """
+    Page text of a page stopped early on a repetition loop: everything
+    generated up to the cut, under a [TRUNCATED] marker (retried like timeouts)
+    """
+    return f"[TRUNCATED: {REPETITION_REASON}]\n\n{text.strip()}"
+
+
+def repetition_page_entry(page: int, text: str) -> Dict:
+    """_summary.json entry of a page stopped on a repetition loop (page 1-indexed)"""
+    return {"page": page, "reason": REPETITION_REASON, "truncated": True, "partial_chars": len(text.strip())}
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write a file through a temp file renamed over it: readers see the old or the new content"""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'wb') as out:
+        out.write(data)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+
+
+def patch_pages(pdf_output_dir: Path, texts: Dict[int, str], index: Dict[int, str] = None) -> List[int]:
+    """
+    Replace the sections of written pages that are not ok (skipped, truncated,
+    error) with new texts (1-indexed page -> text)
+    Each affected document is read once, rewritten atomically once and journaled
+    index: page -> markdown file name (default: page_file_index)
+    Returns the pages actually replaced
+    """
+    pdf_output_dir = Path(pdf_output_dir)
+    if index is None:
+        index = page_file_index(pdf_output_dir)
+    by_file = defaultdict(dict)
+    for page, text in texts.items():
+        if page in index:
+            by_file[index[page]][page] = text
+
+    journal = PageJournal(pdf_output_dir / JOURNAL_NAME)
+    patched = []
+    for file_name, pages in sorted(by_file.items()):
+        md_file = pdf_output_dir / file_name
+        data = md_file.read_bytes()
+
+        # Sections are located in the content just read: offsets stay right even
+        # if the file changed since the index was built
+        chunks = []
+        end = 0
+        for section in page_sections(data):
+            text = pages.get(section["page"])
+            if text is None or section["status"] == "ok":
+                continue
+            chunks.append(data[end:section["offset"]])
+            chunks.append(markdown_page(section["page"] - 1, text).encode('utf-8'))
+            end = section["offset"] + section["length"]
+            patched.append(section["page"])
+        if not chunks:
+            continue
+        chunks.append(data[end:])
+        content = b"".join(chunks)
+
+        write_atomic(md_file, content)
+        if journal.exists():
+            journal.record_document(doc_number(file_name), file_name, content)
+    journal.close()
+    return sorted(patched)
+
+
+class DocumentWriter:
+    def __init__(self, output_file: Path, doc_num: int, journal: PageJournal = None,
+                 records: List[Dict] = None):
+        """
+        Open a document for appending pages
+        records: journal records of an orphaned .part file to pick up (resume)
+        """
+        self.output_file = Path(output_file)
+        self.part_path = self.output_file.with_name(self.output_file.name + PART_SUFFIX)
+        self.doc_num = doc_num
+        self.journal = journal
+        self.records = []
+
+        if records is None:
+            self.part = open(self.part_path, 'wb')
+            return
+
+        # Pages are appended in page order: their .part offsets are cumulative
+        # lengths. Keep the journaled pages fully on disk, drop anything after them
+        size = self.part_path.stat().st_size
+        end = 0
+        for record in sorted(records, key=lambda record: record["page"]):
+            if end + record["length"] > size:
+                break
+            self.records.append({**record, "offset": end, "part": True})
+            end += record["length"]
+        self.part = open(self.part_path, 'r+b')
+        self.part.truncate(end)
+        self.part.seek(end)
+
+    @property
+    def pages(self) -> List[int]:
+        """0-indexed page numbers written so far"""
+        return [record["page"] - 1 for record in self.records]
+
+    def add_page(self, page_num: int, text: str, extra: Dict = None) -> None:
+        """Append the section of a page and journal it (extra: additional journal fields)"""
+        data = markdown_page(page_num, text).encode('utf-8')
+        offset = self.part.tell()
+        self.part.write(data)
+        self.part.flush()
+
+        record = {"doc": self.doc_num, "file": self.output_file.name, "page": page_num + 1,
+                  "offset": offset, "length": len(data), **text_status(text.strip()), **(extra or {}),
+                  "part": True}
+        self.records.append(record)
+        if self.journal is not None:
+            self.journal.append(record)
+
+    def close(self) -> Path:
+        """Write the final document (header + pages) atomically and remove the .part file"""
+        self.part.close()
+        pages = self.pages
+        header = markdown_header(self.doc_num, pages[0], pages[-1], len(pages)).encode('utf-8')
+
+        tmp_path = self.output_file.with_name(f".{self.output_file.name}.tmp")
+        with open(tmp_path, 'wb') as out:
+            out.write(header)
+            with open(self.part_path, 'rb') as body:
+                shutil.copyfileobj(body, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.output_file)
+
+        if self.journal is not None:
+            for record in self.records:
+                final = {key: value for key, value in record.items() if key != "part"}
+                final["offset"] += len(header)
+                self.journal.append(final)
+            self.journal.sync()
+        os.remove(self.part_path)
+        return self.output_file
+
+
+def recover_part_documents(pdf_output_dir: Path, journal: PageJournal, progress: List[Dict]) -> List[Dict]:
+    """
+    Finalize the documents an interrupted run left as .part files
+    Returns the journal records of the pages that are really on disk
+    """
+    pdf_output_dir = Path(pdf_output_dir)
+    for tmp_path in pdf_output_dir.glob(".*.md.tmp"):
+        tmp_path.unlink()
+
+    for part_path in sorted(pdf_output_dir.glob(f"*.md{PART_SUFFIX}")):
+        # The .part file is only removed once its document is final and journaled:
+        # finalize it again from every journaled page of this document
+        output_file = part_path.with_name(part_path.name[:-len(PART_SUFFIX)])
+        records = [record for record in progress if record["file"] == output_file.name]
+        kept = []
+        if records:
+            document = DocumentWriter(output_file, records[0]["doc"], journal, records=records)
+            kept = list(document.records)
+            if kept:
+                document.close()
+                print(f"  ⚡ Recovered {output_file.name} ({len(kept)} page(s)) from an interrupted run")
+            else:
+                document.part.close()
+        if not kept:
+            part_path.unlink()
+
+        # Pages lost with the end of the .part file are done again
+        lost = {record["page"] for record in records} - {record["page"] for record in kept}
+        progress = [record for record in progress
+                    if not (record["file"] == output_file.name and record["page"] in lost)]
+    return progress
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Page-granular work queue on a shared filesystem (NFS-friendly, no server)
+- One lease file per (pdf, page), created with O_EXCL: a single owner at a time
+- Owners refresh their leases' mtime (heartbeat); leases older than the TTL
+  are taken over, so pages of a crashed worker are picked up again
+- Page results are written atomically, one file per page: a page leased
+  twice after an expiry still ends up once in the output
+- The worker that completes the last page of a PDF assembles its documents
+
+Layout:
+    ocr_queue/<pdf_name>/pages.json         number of pages of the PDF
+    ocr_queue/<pdf_name>/leases/p0001.lease page being OCR'd (owner + acquire time)
+    ocr_queue/<pdf_name>/leases/assemble.lease
+    ocr_queue/<pdf_name>/results/p0001.json page result (status, text, timings)
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# A lease not refreshed for this long is considered abandoned. Expiry compares
+# the file mtime (set by the file server) with the local clock: keep a large
+# margin over the heartbeat period to absorb clock skew between hosts
+LEASE_TTL_S = 600
+HEARTBEAT_S = 60
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """Write JSON to a temporary file then rename it over `path`"""
+    tmp_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class LeaseQueue:
+    def __init__(self, queue_dir: str, worker_name: str = None, ttl_s: int = LEASE_TTL_S):
+        """Open (or create) the queue directory shared by every worker"""
+        self.queue_dir = Path(queue_dir)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_name = worker_name or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl_s = ttl_s
+
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def pdf_dir(self, pdf_name: str) -> Path:
+        return self.queue_dir / pdf_name
+
+    def register_pdf(self, pdf_name: str, num_pages: int) -> None:
+        """Record the page count of a PDF (first worker to see it)"""
+        pdf_dir = self.pdf_dir(pdf_name)
+        (pdf_dir / "leases").mkdir(parents=True, exist_ok=True)
+        (pdf_dir / "results").mkdir(exist_ok=True)
+        if not (pdf_dir / "pages.json").exists():
+            write_json_atomic(pdf_dir / "pages.json", {"pages": num_pages})
+
+    def registered_pages(self, pdf_name: str) -> Optional[int]:
+        """Page count recorded by register_pdf(), None if the PDF is not registered yet"""
+        try:
+            with open(self.pdf_dir(pdf_name) / "pages.json", 'r', encoding='utf-8') as f:
+                return json.load(f)["pages"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _lease_path(self, pdf_name: str, key: str) -> Path:
+        return self.pdf_dir(pdf_name) / "leases" / f"{key}.lease"
+
+    def _result_path(self, pdf_name: str, page_num: int) -> Path:
+        return self.pdf_dir(pdf_name) / "results" / f"p{page_num + 1:04d}.json"
+
+    def _expired(self, path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime > self.ttl_s
+        except FileNotFoundError:
+            return True
+
+    def try_acquire(self, pdf_name: str, key: str) -> bool:
+        """Take the lease `key` of a PDF if it is free or expired"""
+        path = self._lease_path(pdf_name, key)
+
+        for _ in range(3):
+            try:
+                fd = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._expired(path):
+                    return False
+
+                # Take over an abandoned lease: only one contender wins the rename
+                stale = path.with_name(f"{path.name}.stale.{self.worker_name.replace(':', '_')}")
+                try:
+                    os.rename(path, stale)
+                except FileNotFoundError:
+                    continue
+                if not self._expired(stale):
+                    # Raced with a worker that had just re-created it: hand it back
+                    try:
+                        os.link(stale, path)
+                    except OSError:
+                        pass
+                    os.remove(stale)
+                    return False
+                os.remove(stale)
+                print(f"  Lease {pdf_name}/{key} expired, taking it over")
+                continue
+
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"worker": self.worker_name, "acquired": time.time()}, f)
+            with self._lock:
+                self.held.add(path)
+            return True
+
+        return False
+
+    def release(self, pdf_name: str, key: str) -> None:
+        path = self._lease_path(pdf_name, key)
+        with self._lock:
+            self.held.discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def is_page_done(self, pdf_name: str, page_num: int) -> bool:
+        return self._result_path(pdf_name, page_num).exists()
+
+    def claim_pages(self, pdf_name: str, num_pages: int, max_pages: int) -> List[int]:
+        """Lease up to max_pages pages not done yet, in page order (0-indexed)"""
+        claimed = []
+        for page_num in range(num_pages):
+            if len(claimed) >= max_pages:
+                break
+            if self.is_page_done(pdf_name, page_num):
+                continue
+            if self.try_acquire(pdf_name, f"p{page_num + 1:04d}"):
+                # Finished by someone else between the check and the lease
+                if self.is_page_done(pdf_name, page_num):
+                    self.release(pdf_name, f"p{page_num + 1:04d}")
+                    continue
+                claimed.append(page_num)
+        return claimed
+
+    def complete_page(self, pdf_name: str, page_num: int, record: Dict) -> None:
+        """Store a page result, then give its lease back"""
+        write_json_atomic(self._result_path(pdf_name, page_num), record)
+        self.release(pdf_name, f"p{page_num + 1:04d}")
+
+    def pages_done(self, pdf_name: str) -> int:
+        results_dir = self.pdf_dir(pdf_name) / "results"
+        if not results_dir.exists():
+            return 0
+        return sum(1 for _ in results_dir.glob("p*.json"))
+
+    def page_results(self, pdf_name: str, num_pages: int) -> List[Dict]:
+        """Results of every page, in page order (all pages must be done)"""
+        results = []
+        for page_num in range(num_pages):
+            with open(self._result_path(pdf_name, page_num), 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+        return results
+
+    def heartbeat(self) -> None:
+        """Refresh the mtime of every lease held by this worker"""
+        with self._lock:
+            held = list(self.held)
+        for path in held:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                print(f"  Warning: lease {path.parent.parent.name}/{path.stem} was taken over")
+                with self._lock:
+                    self.held.discard(path)
+
+    def start_heartbeat(self, period_s: int = HEARTBEAT_S) -> None:
+        """Refresh held leases from a background thread (OCR calls last minutes)"""
+        def beat():
+            while not self._stop.wait(period_s):
+                self.heartbeat()
+
+        self._stop.clear()
+        self._heartbeat_thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop(self) -> None:
+        """Stop the heartbeat and release every lease still held"""
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join(timeout=5)
+        with self._lock:
+            held = list(self.held)
+            self.held.clear()
+        for path in held:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
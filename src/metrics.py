@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Pipeline instrumentation
+- Wall time accumulated per stage (render, resize, template, processor,
+  generate, decode, boundary, write)
+- Thread-safe: the prefetch thread and the OCR loop report into the same timer
+- Per-page records as JSON lines and per-PDF latency histogram for _summary.json
+"""
+
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+
+STAGES = ["render", "resize", "template", "processor", "generate", "decode", "boundary", "write"]
+
+# Upper bounds of the page latency histogram buckets, in seconds
+LATENCY_BUCKETS_S = (1, 2, 5, 10, 20, 30, 60, 120, 180, 300)
+
+
+class StageTimer:
+    def __init__(self):
+        """Empty timer; stages are created on first use"""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, stage: str, seconds: float, count: int = 1) -> None:
+        """Record `seconds` spent in a stage for `count` items (pages)"""
+        with self._lock:
+            self.totals[stage] += seconds
+            self.counts[stage] += count
+
+        for captured in getattr(self._local, "captures", ()):
+            captured[stage] = captured.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str, count: int = 1):
+        """Time the enclosed block as one occurrence of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, count)
+
+    @contextmanager
+    def capture(self):
+        """Collect {stage: seconds} recorded by the current thread inside the block"""
+        captures = self._local.__dict__.setdefault("captures", [])
+        captured = {}
+        captures.append(captured)
+        try:
+            yield captured
+        finally:
+            captures.pop()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Totals per stage: {"generate": {"total_s": 12.3, "count": 40}, ...}"""
+        with self._lock:
+            return {
+                stage: {"total_s": round(self.totals[stage], 4), "count": self.counts[stage]}
+                for stage in self.totals
+            }
+
+    def totals_since(self, snapshot: Dict[str, Dict]) -> Dict[str, float]:
+        """Seconds per stage recorded since an earlier snapshot()"""
+        current = self.snapshot()
+        totals = {}
+        for stage, values in current.items():
+            seconds = values["total_s"] - snapshot.get(stage, {}).get("total_s", 0.0)
+            if seconds > 0:
+                totals[stage] = round(seconds, 4)
+        return totals
+
+    def reset(self) -> None:
+        with self._lock:
+            self.totals.clear()
+            self.counts.clear()
+
+
+def page_stage_times(image, batch_stages: Dict[str, float], batch_size: int) -> Dict[str, float]:
+    """
+    Stage times of one page: its own render/resize times (carried in image.info)
+    plus an even share of the stages of the batch it was OCR'd in
+    """
+    stages = {}
+    for stage in ("render", "resize"):
+        seconds = image.info.get(f"{stage}_s") if image is not None else None
+        if seconds is not None:
+            stages[stage] = seconds
+
+    for stage, seconds in batch_stages.items():
+        stages[stage] = stages.get(stage, 0.0) + seconds / batch_size
+
+    return {stage: round(seconds, 4) for stage, seconds in stages.items()}
+
+
+def page_record(pdf_name: str, page_num: int, stages: Dict[str, float], status: str = "ok",
+                chars: int = 0, extra: Dict = None) -> Dict:
+    """Metrics record of one page, page_num being 0-indexed (extra: additional fields)"""
+    stages = {stage: round(seconds, 4) for stage, seconds in stages.items()}
+    record = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "pdf": pdf_name,
+        "page": page_num + 1,
+        "status": status,
+        "chars": chars,
+        "latency_s": round(sum(stages.values()), 4),
+        "stages": stages,
+    }
+    if extra:
+        record.update(extra)
+    return record
+
+
+def latency_histogram(latencies: List[float], buckets=LATENCY_BUCKETS_S) -> Dict:
+    """Percentiles and bucket counts of per-page latencies"""
+    if not latencies:
+        return {"pages": 0}
+
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        # Nearest-rank percentile
+        index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        return round(ordered[index], 3)
+
+    counts = {f"<={bound}s": 0 for bound in buckets}
+    counts[f">{buckets[-1]}s"] = 0
+    for latency in ordered:
+        for bound in buckets:
+            if latency <= bound:
+                counts[f"<={bound}s"] += 1
+                break
+        else:
+            counts[f">{buckets[-1]}s"] += 1
+
+    return {
+        "pages": len(ordered),
+        "mean_s": round(sum(ordered) / len(ordered), 3),
+        "p50_s": percentile(50),
+        "p90_s": percentile(90),
+        "p99_s": percentile(99),
+        "max_s": round(ordered[-1], 3),
+        "buckets": counts,
+    }
+
+
+class PageMetricsLog:
+    def __init__(self, path: Path, pdf_name: str, live=None):
+        """
+        Append per-page records to a JSON lines file (kept across resumes)
+        live: optional PipelineMetrics (metrics_server) also fed with each page
+        """
+        self.path = Path(path)
+        self.pdf_name = pdf_name
+        self.live = live
+        self.latencies = []
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def record_page(self, page_num: int, stages: Dict[str, float], status: str = "ok",
+                    chars: int = 0, extra: Dict = None) -> None:
+        """Write the record of one page, page_num being 0-indexed"""
+        record = page_record(self.pdf_name, page_num, stages, status, chars, extra)
+        self.latencies.append(record["latency_s"])
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+        if self.live is not None:
+            self.live.page_done(status, record["latency_s"])
+
+    def latency_summary(self) -> Dict:
+        """Latency histogram of the pages recorded by this run"""
+        return latency_histogram(self.latencies)
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Live counters of a running OCR job, served over HTTP (Prometheus text format)
+- Pages processed / timed out / failed, pages/sec over the last minute
+- Work queue: PDFs and pages remaining, current PDF and page
+- OCR cache hit rate, stage timings, page latency histogram, memory use
+- Local only by default (127.0.0.1), served from a daemon thread
+"""
+
+import os
+import resource
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from metrics import LATENCY_BUCKETS_S
+
+
+DEFAULT_METRICS_PORT = 9108
+
+# Window of the pages/sec gauge
+RATE_WINDOW_S = 60
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs: fall back to the peak (KB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PipelineMetrics:
+    def __init__(self, engine=None):
+        """Counters updated by the processor, read by the HTTP handler"""
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+        self.pdfs_total = 0
+        self.pdfs_completed = 0
+        self.current_pdf = ""
+        self.current_pdf_pages = 0
+        self.current_pdf_done = 0
+
+        self.pages = {"ok": 0, "timeout": 0, "error": 0}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_S) + 1)
+        self.latency_sum = 0.0
+        self.recent_pages = deque()
+
+    def start_run(self, pdfs_total: int, pdfs_completed: int = 0) -> None:
+        with self._lock:
+            self.pdfs_total = pdfs_total
+            self.pdfs_completed = pdfs_completed
+
+    def start_pdf(self, pdf_name: str, num_pages: int, pages_done: int = 0) -> None:
+        with self._lock:
+            self.current_pdf = pdf_name
+            self.current_pdf_pages = num_pages
+            self.current_pdf_done = pages_done
+
+    def page_done(self, status: str, latency_s: float) -> None:
+        """Count one page; status is ok, blank (not OCR'd), timeout or error"""
+        now = time.time()
+        with self._lock:
+            self.pages[status] = self.pages.get(status, 0) + 1
+            self.current_pdf_done += 1
+
+            self.latency_sum += latency_s
+            for i, bound in enumerate(LATENCY_BUCKETS_S):
+                if latency_s <= bound:
+                    self.latency_buckets[i] += 1
+                    break
+            else:
+                self.latency_buckets[-1] += 1
+
+            self.recent_pages.append(now)
+            while self.recent_pages and self.recent_pages[0] < now - RATE_WINDOW_S:
+                self.recent_pages.popleft()
+
+    def pdf_done(self) -> None:
+        with self._lock:
+            self.pdfs_completed += 1
+            self.current_pdf = ""
+
+    def pages_per_second(self) -> float:
+        """Throughput over the last RATE_WINDOW_S seconds"""
+        now = time.time()
+        with self._lock:
+            while self.recent_pages and self.recent_pages[0] < now - RATE_WINDOW_S:
+                self.recent_pages.popleft()
+            window = min(RATE_WINDOW_S, now - self.started)
+            return len(self.recent_pages) / window if window > 0 else 0.0
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        rate = self.pages_per_second()
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: Dict[str, float]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples.items():
+                lines.append(f"{name}{labels} {value}")
+
+        with self._lock:
+            pdf_label = self.current_pdf.replace('\\', '\\\\').replace('"', '\\"')
+            metric("ocr_pages_total", "counter", "Pages OCR'd by this process, by outcome",
+                   {f'{{status="{status}"}}': count for status, count in self.pages.items()})
+            metric("ocr_pdfs_total", "gauge", "PDFs in the input directory", {"": self.pdfs_total})
+            metric("ocr_pdfs_completed", "gauge", "PDFs with a _summary.json", {"": self.pdfs_completed})
+            metric("ocr_queue_pdfs", "gauge", "PDFs left to process",
+                   {"": max(0, self.pdfs_total - self.pdfs_completed)})
+            metric("ocr_queue_pages", "gauge", "Pages left in the current PDF",
+                   {"": max(0, self.current_pdf_pages - self.current_pdf_done)})
+            metric("ocr_current_pdf_pages", "gauge", "Pages of the PDF being processed",
+                   {f'{{pdf="{pdf_label}"}}': self.current_pdf_pages})
+            metric("ocr_current_pdf_pages_done", "gauge", "Pages of the current PDF already done",
+                   {f'{{pdf="{pdf_label}"}}': self.current_pdf_done})
+
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(LATENCY_BUCKETS_S, self.latency_buckets):
+                cumulative += count
+                buckets[f'_bucket{{le="{bound}"}}'] = cumulative
+            buckets['_bucket{le="+Inf"}'] = cumulative + self.latency_buckets[-1]
+            buckets["_sum"] = round(self.latency_sum, 3)
+            buckets["_count"] = cumulative + self.latency_buckets[-1]
+            metric("ocr_page_latency_seconds", "histogram", "Per-page latency (sum of stage times)", buckets)
+
+        metric("ocr_pages_per_second", "gauge", f"Pages per second over the last {RATE_WINDOW_S}s",
+               {"": round(rate, 4)})
+        metric("ocr_uptime_seconds", "gauge", "Seconds since the job started",
+               {"": round(time.time() - self.started, 1)})
+        metric("ocr_process_resident_memory_bytes", "gauge", "Resident memory of the OCR process",
+               {"": process_rss_bytes()})
+
+        if self.engine is not None:
+            cache = self.engine.cache_stats()
+            lookups = cache["hits"] + cache["misses"]
+            metric("ocr_cache_lookups_total", "counter", "OCR result cache lookups",
+                   {'{result="hit"}': cache["hits"], '{result="miss"}': cache["misses"]})
+            metric("ocr_cache_hit_ratio", "gauge", "OCR result cache hit rate",
+                   {"": round(cache["hits"] / lookups, 4) if lookups else 0})
+            metric("ocr_stage_seconds_total", "counter", "Wall time spent per pipeline stage",
+                   {f'{{stage="{stage}"}}': values["total_s"]
+                    for stage, values in self.engine.timer.snapshot().items()})
+            metric("ocr_device_memory_free_bytes", "gauge", "Free memory on the OCR device",
+                   {f'{{device="{self.engine.backend.device}"}}': self.engine.backend.available_memory_bytes()})
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    def __init__(self, metrics: PipelineMetrics, port: int = DEFAULT_METRICS_PORT, host: str = "127.0.0.1"):
+        """HTTP server exposing GET /metrics, started in a daemon thread"""
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                # Keep scrapes out of the processing log
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        print(f"Metrics endpoint: http://{host}:{port}/metrics")
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
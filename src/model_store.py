@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Prepared local copy of the model, for fast starts
+- One-time step: load the model the slow way (hub checkpoint, device map
+  search, offloading), then save what that load produced to a local folder:
+  safetensors shards in the working dtype, the resolved device map, the
+  processor files and a manifest (prepared.json)
+- Later starts load that folder with the recorded device map: no device-map
+  search, no dtype conversion, no re-sharding of the state dict; shards are
+  memory-mapped and disk-offloaded weights are read in place from them
+  instead of being copied to an offload folder again
+- One layout per device and offload mode (../models/prepared/cuda-offload,
+  cuda, cpu); a layout made on other hardware (GPU model or memory, host
+  memory) is ignored and the model is loaded normally
+
+Usage:
+    python model_store.py --offload    # ocr_nanonets_pausable, cpu_offload, retry
+    python model_store.py              # ocr_processor (fp16 on GPU)
+"""
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+
+PREPARED_DIR = "../models/prepared"
+MANIFEST_NAME = "prepared.json"
+DEFAULT_MAX_SHARD_SIZE = "1GB"
+
+
+def layout_name(device: str, offload: bool) -> str:
+    """Sub-folder of a prepared layout"""
+    return f"{device}-offload" if offload else device
+
+
+def host_total_memory_bytes() -> int:
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def hardware_signature(device: str) -> Dict:
+    """What a device map depends on: GPUs and their memory, host memory"""
+    signature = {"device": device, "host_memory_gb": round(host_total_memory_bytes() / 1024**3)}
+    if device == "cuda":
+        import torch
+        gpus = [torch.cuda.get_device_properties(i) for i in range(torch.cuda.device_count())]
+        signature["gpus"] = [{"name": gpu.name, "memory_gb": round(gpu.total_memory / 1024**3, 1)}
+                             for gpu in gpus]
+    return signature
+
+
+def find_prepared(prepared_dir: str, device: str, offload: bool) -> Optional[Dict]:
+    """Manifest of the prepared layout for this device and offload mode, None if missing or made elsewhere"""
+    layout_dir = Path(prepared_dir) / layout_name(device, offload)
+    manifest_path = layout_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read {manifest_path}: {e}")
+        return None
+
+    if manifest.get("hardware") != hardware_signature(device):
+        print(f"Prepared model in {layout_dir} was made for other hardware, loading {manifest.get('source')} normally "
+              f"(run model_store.py again to prepare it for this machine)")
+        return None
+
+    manifest["path"] = str(layout_dir)
+    return manifest
+
+
+def prepared_load_kwargs(manifest: Dict) -> Dict:
+    """from_pretrained arguments that reproduce the recorded load"""
+    import torch
+    # Shards are in the working dtype: disk-offloaded weights are used straight
+    # from the safetensors files (no offload_folder, no offload_state_dict)
+    return {"torch_dtype": getattr(torch, manifest["dtype"]), "device_map": manifest["device_map"]}
+
+
+def save_prepared(model, processor, prepared_dir: str, device: str, offload: bool, source: str,
+                  model_revision: str, max_shard_size: str = DEFAULT_MAX_SHARD_SIZE) -> Path:
+    """
+    Save a loaded model as a prepared layout
+    Written to a temp folder renamed into place: a layout with a manifest is always complete
+    """
+    layout_dir = Path(prepared_dir) / layout_name(device, offload)
+    tmp_dir = layout_dir.with_name(f".{layout_dir.name}.tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    layout_dir.parent.mkdir(parents=True, exist_ok=True)
+
+    model.save_pretrained(tmp_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    processor.save_pretrained(tmp_dir)
+
+    device_map = getattr(model, "hf_device_map", None) or {"": device}
+    manifest = {
+        "source": source,
+        # Kept as the engine's model revision: OCR cache entries stay valid
+        "model_revision": model_revision,
+        "device": device,
+        "offload": offload,
+        "dtype": str(model.dtype).replace("torch.", ""),
+        "device_map": device_map,
+        "hardware": hardware_signature(device),
+        "prepared_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(tmp_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    if layout_dir.exists():
+        shutil.rmtree(layout_dir)
+    os.replace(tmp_dir, layout_dir)
+    return layout_dir
+
+
+def main():
+    import argparse
+    from ocr_engine import MODEL_PATH, TransformersBackend
+
+    parser = argparse.ArgumentParser(description="Prepare a local model layout for fast starts")
+    parser.add_argument("--model", default=MODEL_PATH,
+                       help=f"Model to prepare (default: {MODEL_PATH})")
+    parser.add_argument("--output-dir", default=PREPARED_DIR,
+                       help=f"Folder of the prepared layouts (default: {PREPARED_DIR})")
+    parser.add_argument("--offload", action="store_true",
+                       help="Layout for the CPU-offloading scripts (device_map=balanced)")
+    parser.add_argument("--device", choices=["cuda", "cpu"], default=None,
+                       help="Device (default: cuda if available)")
+    parser.add_argument("--max-shard-size", default=DEFAULT_MAX_SHARD_SIZE,
+                       help=f"Size of the safetensors shards (default: {DEFAULT_MAX_SHARD_SIZE})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    backend = TransformersBackend(args.model, device=args.device, offload=args.offload, prepared_dir=None)
+    load_s = time.perf_counter() - start
+
+    print(f"Saving prepared layout (model loaded in {load_s:.0f}s)...")
+    layout_dir = save_prepared(backend.model, backend.processor, args.output_dir, backend.device, args.offload,
+                               args.model, backend.model_revision, args.max_shard_size)
+    print(f"Prepared model saved to {layout_dir}")
+    print("The OCR scripts load it automatically (--prepared-model to use another folder)")
+
+
+if __name__ == "__main__":
+    main()
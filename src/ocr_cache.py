@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of OCR results (SQLite)
+- Keyed by a hash of the page pixels plus DPI, max_dimension, prompt and model revision
+- Size cap with least-recently-used eviction
+- Hit/miss counters reported in _summary.json
+- Host-local by default (~/.cache): WAL mode, which needs a local filesystem,
+  never put it on a mount shared between hosts (NFS)
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from PIL import Image
+
+
+DEFAULT_CACHE_MAX_MB = 1024
+
+
+def default_cache_path() -> str:
+    """Per-user cache database of this host ($XDG_CACHE_HOME, default ~/.cache)"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "ocr-nanonets", "ocr_cache.sqlite")
+
+
+class OCRResultCache:
+    def __init__(self, db_path: str, max_bytes: int = DEFAULT_CACHE_MAX_MB * 1024**2):
+        """Open (or create) the cache database"""
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30)
+        # Worker processes of this host share the cache: readers don't block the
+        # writer (WAL's shared-memory index is host-local, hence default_cache_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_results_access ON ocr_results(last_access)")
+        self.conn.commit()
+
+        row = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()
+        self.total_bytes = row[0]
+
+    @staticmethod
+    def make_key(image: Image.Image, dpi: int, max_dimension: int, prompt: str, model_revision: str) -> str:
+        """Hash of the page pixels and every setting that changes the OCR output"""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}|{image.size[0]}x{image.size[1]}|".encode())
+        digest.update(image.tobytes())
+        digest.update(f"|dpi={dpi}|max_dim={max_dimension}|model={model_revision}|".encode())
+        digest.update(prompt.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached text for a key, or None; refreshes its LRU position"""
+        row = self.conn.execute("SELECT text FROM ocr_results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute("UPDATE ocr_results SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        """Store a result, then evict least recently used entries above the size cap"""
+        size = len(text.encode("utf-8"))
+        old = self.conn.execute("SELECT size FROM ocr_results WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self.total_bytes -= old[0]
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ocr_results (key, text, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, text, size, time.time())
+        )
+        self.total_bytes += size
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self) -> None:
+        """Drop oldest entries until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM ocr_results ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                self.conn.execute("DELETE FROM ocr_results WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    return
+
+    def stats(self) -> Dict:
+        """Hit/miss counters since the cache was opened"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def cached_ocr(cache: Optional[OCRResultCache], images: List[Image.Image], keys: List[str],
+               run_ocr: Callable[[List[Image.Image]], List[Optional[str]]],
+               store: Callable[[Image.Image], bool] = None) -> List[Optional[str]]:
+    """
+    Serve pages from the cache and run OCR only on the misses, in one batch
+    Fresh results are stored under their key (None results, e.g. pages cut
+    off by a timeout, are passed through without being cached)
+    store: whether a fresh result of this image may be cached (default: all)
+    """
+    if cache is None:
+        return run_ocr(images)
+
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    if missing:
+        generated = run_ocr([images[i] for i in missing])
+        for i, text in zip(missing, generated):
+            results[i] = text
+            if text is not None and (store is None or store(images[i])):
+                cache.put(keys[i], text)
+
+    return results
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Resident OCR daemon: the model is loaded once and stays warm between runs
+- Jobs are queued over a local HTTP API (127.0.0.1 only) and run one at a
+  time on the same engine: a bulk run of the input directory, one PDF, a page
+  range of a PDF (text returned with the job) or a retry of aborted pages
+- Job status, the queue, stage timings and cache counters can be read while
+  a job runs; GET /metrics serves the usual live counters
+- Jobs write the same output as the scripts (journal, _summary.json, corpus
+  index): a job cut short by stopping the daemon resumes like an interrupted run
+- The same script is the client (submit, status, jobs, wait, cancel)
+
+Usage:
+    python ocr_daemon.py serve                      # load the model, wait for jobs
+    python ocr_daemon.py submit directory           # OCR the pending PDFs of ../data/input
+    python ocr_daemon.py submit pdf FILE.pdf --wait
+    python ocr_daemon.py submit pages FILE.pdf --first 3 --last 5 --wait
+    python ocr_daemon.py submit retry --timeout 300 [--pdf NAME ...]
+    python ocr_daemon.py status
+
+API:
+    POST   /jobs        {"type": "directory"|"pdf"|"pages"|"retry", ...}  -> 202, the job
+    GET    /jobs        all jobs (without page texts)
+    GET    /jobs/<id>   one job, with its result
+    DELETE /jobs/<id>   cancel a queued job
+    GET    /status      engine, uptime, current job, queue, stage timings, cache
+    GET    /metrics     Prometheus counters (see metrics_server.py)
+"""
+
+import itertools
+import json
+import queue
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ocr_engine import OCREngine, OCRTimeout, add_engine_arguments, engine_from_args
+from page_source import iter_pdf_pages, iter_batches, get_pdf_page_count, DEFAULT_PREFETCH_DEPTH
+from document_writer import timeout_page_text
+from metrics_server import PipelineMetrics
+from page_budget import DEFAULT_BLANK_THRESHOLD, SUGGESTED_BLANK_THRESHOLD
+from ocr_nanonets_pausable import NanonetsOCRProcessor
+from retry_aborted_pages import AbortedPagesRetry, build_retry_schedule, DEFAULT_GROUP_SIZE
+
+
+DEFAULT_DAEMON_PORT = 9110
+DEFAULT_DAEMON_URL = f"http://127.0.0.1:{DEFAULT_DAEMON_PORT}"
+
+JOB_TYPES = ("directory", "pdf", "pages", "retry")
+FINISHED = ("done", "failed", "cancelled")
+
+
+def now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class OCRDaemon:
+    def __init__(self, make_engine: Callable[[], OCREngine], input_dir: str, output_dir: str, dpi: int = 150,
+                 ocr_timeout: int = 120, processor_kwargs: Dict = None):
+        """
+        Job queue on top of one engine, loaded once by the job thread
+        make_engine: builds the engine (model load)
+        dpi, ocr_timeout: defaults of the jobs that don't set them
+        processor_kwargs: extra NanonetsOCRProcessor options (budget, blank pages, prefetch)
+        """
+        self.make_engine = make_engine
+        self.engine = None
+        self.load_error = None
+        self.input_dir = str(Path(input_dir).resolve())
+        self.output_dir = str(Path(output_dir).resolve())
+        self.dpi = dpi
+        self.ocr_timeout = ocr_timeout
+        self.processor_kwargs = processor_kwargs or {}
+        self.metrics = PipelineMetrics()
+        self.started = time.time()
+
+        self.jobs: Dict[int, Dict] = {}
+        self.queue = queue.Queue()
+        self.current = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # The engine (result cache) and the processors (corpus index) hold SQLite
+        # connections: they are created and used by the job thread only
+        self.processor = None
+        self.thread = threading.Thread(target=self.run_jobs, name="ocr-jobs", daemon=True)
+
+    def submit(self, spec: Dict) -> Dict:
+        """Validate and queue a job (ValueError on a bad request)"""
+        if self.load_error:
+            raise ValueError(f"the OCR engine failed to load: {self.load_error}")
+        job_type = spec.get("type")
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"type must be one of {', '.join(JOB_TYPES)}")
+        params = {key: value for key, value in spec.items() if key != "type"}
+
+        if job_type in ("pdf", "pages"):
+            if not params.get("pdf") or not Path(params["pdf"]).is_file():
+                raise ValueError(f"pdf: no such file {params.get('pdf')!r} (paths are read by the daemon)")
+        if job_type == "pages":
+            first, last = params.get("first_page"), params.get("last_page", params.get("first_page"))
+            if not isinstance(first, int) or not isinstance(last, int) or not 1 <= first <= last:
+                raise ValueError("pages: first_page and last_page must be page numbers (1-indexed), first <= last")
+            params["last_page"] = last
+        if "input_dir" in params and not Path(params["input_dir"]).is_dir():
+            raise ValueError(f"input_dir: no such directory {params['input_dir']!r}")
+
+        with self._lock:
+            job = {"id": next(self._ids), "type": job_type, "params": params, "status": "queued",
+                   "submitted": now_iso(), "started": None, "finished": None, "error": None, "result": None}
+            self.jobs[job["id"]] = job
+            view = self.job_view(job)
+        self.queue.put(job["id"])
+        print(f"Job {job['id']} queued: {job_type} {json.dumps(params, ensure_ascii=False)}")
+        return view
+
+    def cancel(self, job_id: int) -> Dict:
+        """Cancel a queued job (a running job can't be cancelled: stop the daemon, it resumes)"""
+        with self._lock:
+            job = self.jobs[job_id]
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["finished"] = now_iso()
+            return self.job_view(job)
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """Snapshot of a job (None if there is no such job): the job thread updates it under the lock"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return self.job_view(job) if job is not None else None
+
+    def job_view(self, job: Dict, with_result: bool = True) -> Dict:
+        view = dict(job)
+        if not with_result and isinstance(job.get("result"), dict):
+            # Page texts only come with GET /jobs/<id>
+            view["result"] = {key: value for key, value in job["result"].items() if key != "pages"}
+        return view
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            return [self.job_view(job, with_result=False) for job in self.jobs.values()]
+
+    def status(self) -> Dict:
+        with self._lock:
+            queued = [job["id"] for job in self.jobs.values() if job["status"] == "queued"]
+            current = self.job_view(self.current, with_result=False) if self.current else None
+        if self.engine is None:
+            # Jobs can be queued while the model loads
+            return {"ready": False, "error": self.load_error, "uptime_s": round(time.time() - self.started, 1), "queued_jobs": queued}
+        return {
+            "ready": True,
+            "backend": self.engine.backend.name,
+            "device": self.engine.backend.device,
+            "batch_size": self.engine.batch_size,
+            "input_dir": self.input_dir,
+            "output_dir": self.output_dir,
+            "uptime_s": round(time.time() - self.started, 1),
+            "current_job": current,
+            "current_pdf": self.metrics.current_pdf,
+            "current_pdf_pages": self.metrics.current_pdf_pages,
+            "current_pdf_done": self.metrics.current_pdf_done,
+            "queued_jobs": queued,
+            "pages": dict(self.metrics.pages),
+            "pages_per_second": round(self.metrics.pages_per_second(), 4),
+            "stages_s": {stage: values["total_s"] for stage, values in self.engine.timer.snapshot().items()},
+            "cache": self.engine.cache_stats(),
+        }
+
+    def run_jobs(self) -> None:
+        """Job thread: load the engine, then run queued jobs one at a time for the life of the daemon"""
+        try:
+            engine = self.make_engine()
+        except Exception as e:
+            traceback.print_exc()
+            self.load_error = f"{type(e).__name__}: {e}"
+            print(f"OCR engine failed to load, jobs are refused: {self.load_error}")
+            return
+        self.metrics.engine = engine
+        self.engine = engine
+        print("OCR engine ready, waiting for jobs")
+        self.processor = NanonetsOCRProcessor(output_base_dir=self.output_dir, engine=self.engine,
+                                              metrics=self.metrics, **self.processor_kwargs)
+        while True:
+            job_id = self.queue.get()
+            with self._lock:
+                job = self.jobs[job_id]
+                if job["status"] != "queued":
+                    continue
+                job["status"] = "running"
+                job["started"] = now_iso()
+                self.current = job
+
+            print(f"\n{'='*60}\nJob {job_id}: {job['type']}\n{'='*60}")
+            start = time.perf_counter()
+            try:
+                result = getattr(self, f"run_{job['type']}")(job["params"])
+                status, error = "done", None
+            except Exception as e:
+                traceback.print_exc()
+                result, status, error = None, "failed", f"{type(e).__name__}: {e}"
+            finally:
+                self.engine.release_memory()
+
+            with self._lock:
+                job.update({"status": status, "error": error, "result": result, "finished": now_iso(),
+                            "elapsed_s": round(time.perf_counter() - start, 1)})
+                self.current = None
+            print(f"Job {job_id} {status} in {job['elapsed_s']:.0f}s" + (f": {error}" if error else ""))
+
+    def run_directory(self, params: Dict) -> Dict:
+        """Bulk run: every pending PDF of the input directory"""
+        input_dir = params.get("input_dir", self.input_dir)
+        self.processor.process_directory(input_dir, ocr_timeout=params.get("ocr_timeout", self.ocr_timeout))
+        self.processor.index.sync()
+        return {"input_dir": input_dir, **self.processor.index.totals()}
+
+    def run_pdf(self, params: Dict) -> Dict:
+        """One PDF, resumed from its journal like a --single-pdf run"""
+        pdf_path = Path(params["pdf"])
+        self.metrics.start_run(1)
+        self.processor.process_pdf(str(pdf_path), dpi=params.get("dpi", self.dpi),
+                                   ocr_timeout=params.get("ocr_timeout", self.ocr_timeout))
+        pdf_dir = Path(self.output_dir) / pdf_path.stem
+        return {"pdf": str(pdf_path), "output": str(pdf_dir),
+                "files": sorted(path.name for path in pdf_dir.glob("*.md"))}
+
+    def run_pages(self, params: Dict) -> Dict:
+        """OCR a page range and return the texts (nothing is written to the output directory)"""
+        pdf_path = params["pdf"]
+        ocr_timeout = params.get("ocr_timeout", self.ocr_timeout)
+        num_pages = get_pdf_page_count(pdf_path)
+        last_page = min(params["last_page"], num_pages)
+        page_nums = list(range(params["first_page"] - 1, last_page))
+        self.metrics.start_pdf(Path(pdf_path).name, len(page_nums))
+
+        pages = []
+        rendered = iter_pdf_pages(pdf_path, dpi=params.get("dpi", self.dpi), num_pages=num_pages,
+                                  timer=self.engine.timer, pages=page_nums)
+        for batch in iter_batches(rendered, self.engine.batch_size):
+            start = time.perf_counter()
+            try:
+                # The batch shares one deadline: no page runs longer than ocr_timeout
+                texts = self.engine.ocr_batch([image for _, image in batch], timeout_s=ocr_timeout)
+            except OCRTimeout as e:
+                texts = [text if text is not None else timeout_page_text(ocr_timeout, partial)
+                         for text, partial in zip(e.results, e.partial)]
+            latency = (time.perf_counter() - start) / len(batch)
+            for (page_num, _), text, stop in zip(batch, texts, self.engine.last_stop_reasons):
+                status = "timeout" if stop == "deadline" else "ok"
+                self.metrics.page_done(status, latency)
+                pages.append({"page": page_num + 1, "status": status, "stop": stop, "text": text.strip()})
+        self.metrics.start_pdf("", 0)
+        return {"pdf": str(pdf_path), "total_pages": num_pages, "pages": pages}
+
+    def run_retry(self, params: Dict) -> Dict:
+        """
+        Aborted pages, in retry priority order: all of them, or only those of the
+        PDFs in "pdfs" (names without .pdf) and of the pages in "pages" ({pdf: [pages]})
+        """
+        timeout = params.get("timeout", 300)
+        retry = AbortedPagesRetry(ocr_output_dir=self.output_dir,
+                                  original_pdfs_dir=params.get("input_dir", self.input_dir), engine=self.engine)
+        try:
+            aborted_data = retry.get_aborted_pages_list()
+            wanted_pdfs = set(params.get("pdfs") or []) | set(params.get("pages") or {})
+            wanted_pages = {pdf: set(pages) for pdf, pages in (params.get("pages") or {}).items()}
+            if wanted_pdfs:
+                aborted_data = [data for data in aborted_data if data["pdf_name"] in wanted_pdfs]
+            for data in aborted_data:
+                if data["pdf_name"] in wanted_pages:
+                    data["skipped_pages"] = [entry for entry in data["skipped_pages"]
+                                             if entry["page"] in wanted_pages[data["pdf_name"]]]
+                    data["count"] = len(data["skipped_pages"])
+            aborted_data = [data for data in aborted_data if data["count"]]
+
+            tasks = build_retry_schedule(aborted_data, timeout,
+                                         params.get("group_size") or self.engine.batch_size or DEFAULT_GROUP_SIZE)
+            succeeded = 0
+            for task in tasks:
+                succeeded += sum(retry.retry_task(task, timeout))
+        finally:
+            retry.index.close()
+        total = sum(data["count"] for data in aborted_data)
+        return {"pdfs": len(aborted_data), "retried_pages": total, "succeeded": succeeded, "failed": total - succeeded}
+
+
+class DaemonServer:
+    def __init__(self, daemon: OCRDaemon, port: int = DEFAULT_DAEMON_PORT, host: str = "127.0.0.1"):
+        """HTTP job API of a daemon (see the module docstring)"""
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(handler, code: int, payload) -> None:
+                body = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+                handler.send_response(code)
+                handler.send_header("Content-Type", "application/json; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def job_id(handler):
+                parts = handler.path.split("?")[0].strip("/").split("/")
+                if len(parts) != 2 or parts[0] != "jobs" or not parts[1].isdigit():
+                    return None
+                return int(parts[1])
+
+            def do_GET(handler):
+                path = handler.path.split("?")[0].rstrip("/")
+                if path == "/metrics":
+                    body = daemon.metrics.render().encode("utf-8")
+                    handler.send_response(200)
+                    handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    handler.send_header("Content-Length", str(len(body)))
+                    handler.end_headers()
+                    handler.wfile.write(body)
+                elif path == "/status":
+                    handler.send_json(200, daemon.status())
+                elif path == "/jobs":
+                    handler.send_json(200, daemon.list_jobs())
+                else:
+                    job = daemon.get_job(handler.job_id())
+                    if job is None:
+                        handler.send_json(404, {"error": f"not found: {path}"})
+                    else:
+                        handler.send_json(200, job)
+
+            def do_POST(handler):
+                if handler.path.split("?")[0].rstrip("/") != "/jobs":
+                    handler.send_json(404, {"error": f"not found: {handler.path}"})
+                    return
+                try:
+                    length = int(handler.headers.get("Content-Length", 0))
+                    spec = json.loads(handler.rfile.read(length) or b"{}")
+                    if not isinstance(spec, dict):
+                        raise ValueError("the job must be a JSON object")
+                    job = daemon.submit(spec)
+                except ValueError as e:
+                    handler.send_json(400, {"error": str(e)})
+                    return
+                handler.send_json(202, job)
+
+            def do_DELETE(handler):
+                job_id = handler.job_id()
+                if daemon.get_job(job_id) is None:
+                    handler.send_json(404, {"error": f"not found: {handler.path}"})
+                    return
+                job = daemon.cancel(job_id)
+                handler.send_json(200 if job["status"] == "cancelled" else 409, job)
+
+            def log_message(handler, format, *args):
+                # Keep status polling out of the processing log
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    def serve_forever(self) -> None:
+        host, port = self.server.server_address[:2]
+        print(f"OCR daemon listening on http://{host}:{port} (jobs, status, metrics)")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+
+def api_request(url: str, method: str = "GET", payload: Dict = None, timeout: float = 10):
+    """JSON request to a daemon; the error payload is returned for 4xx answers"""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b"{}")
+
+
+def wait_for_job(url: str, job_id: int, poll_s: float = 2.0) -> Dict:
+    """Poll a job until it is done, failed or cancelled"""
+    while True:
+        job = api_request(f"{url}/jobs/{job_id}")
+        # Unknown job: the 404 payload has no status
+        if job.get("status", "failed") in FINISHED:
+            return job
+        time.sleep(poll_s)
+
+
+def serve(args) -> None:
+    daemon = OCRDaemon(
+        lambda: engine_from_args(args, max_dimension=1400, offload=True),
+        input_dir=args.input_dir,
+        output_dir=args.output_dir,
+        dpi=args.dpi,
+        ocr_timeout=args.ocr_timeout,
+        processor_kwargs={"prefetch_depth": args.prefetch_depth, "adaptive_budget": args.adaptive_budget,
+                          "max_ocr_timeout": args.max_ocr_timeout, "blank_threshold": args.blank_threshold}
+    )
+    # Port taken (another daemon): fail before loading the model
+    server = DaemonServer(daemon, port=args.port)
+    daemon.thread.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nOCR daemon stopped (a running job resumes on its next submission)")
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Resident OCR daemon with a local job API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Load the model and run submitted jobs")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_DAEMON_PORT,
+                              help=f"Port of the job API on 127.0.0.1 (default: {DEFAULT_DAEMON_PORT})")
+    serve_parser.add_argument("--input-dir", default="../data/input")
+    serve_parser.add_argument("--output-dir", default="../data/output/ocr_results")
+    serve_parser.add_argument("--dpi", type=int, default=150,
+                              help="Default DPI of the jobs (default: 150)")
+    serve_parser.add_argument("--ocr-timeout", type=int, default=120,
+                              help="Default page timeout of the jobs in seconds (default: 120s)")
+    serve_parser.add_argument("--adaptive-budget", action="store_true",
+                              help="Adaptive page timeout and max_new_tokens (see ocr_nanonets_pausable.py)")
+    serve_parser.add_argument("--max-ocr-timeout", type=int, default=300,
+                              help="Upper bound of an adaptive page timeout in seconds (default: 300s)")
+    serve_parser.add_argument("--blank-threshold", type=float, default=DEFAULT_BLANK_THRESHOLD,
+                              help=f"Ink ratio under which a page is blank and not OCR'd "
+                                   f"(default: 0 = OCR every page; e.g. {SUGGESTED_BLANK_THRESHOLD})")
+    serve_parser.add_argument("--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                              help=f"Pages rendered ahead of OCR in background (default: {DEFAULT_PREFETCH_DEPTH})")
+    add_engine_arguments(serve_parser)
+
+    client = argparse.ArgumentParser(add_help=False)
+    client.add_argument("--url", default=DEFAULT_DAEMON_URL, help=f"Daemon address (default: {DEFAULT_DAEMON_URL})")
+
+    submit_parser = commands.add_parser("submit", parents=[client], help="Queue a job")
+    submit_parser.add_argument("type", choices=JOB_TYPES)
+    submit_parser.add_argument("pdf", nargs="?", help="PDF file (pdf and pages jobs)")
+    submit_parser.add_argument("--first", type=int, help="pages: first page (1-indexed)")
+    submit_parser.add_argument("--last", type=int, help="pages: last page (default: --first)")
+    submit_parser.add_argument("--input-dir", help="directory and retry: PDF folder (default: the daemon's)")
+    submit_parser.add_argument("--dpi", type=int, help="Rendering DPI (default: the daemon's)")
+    submit_parser.add_argument("--ocr-timeout", type=int, help="Page timeout in seconds (default: the daemon's)")
+    submit_parser.add_argument("--timeout", type=int, help="retry: page timeout in seconds (default: 300)")
+    submit_parser.add_argument("--group-size", type=int, help="retry: pages per task (default: batch size)")
+    submit_parser.add_argument("--pdf", dest="pdfs", action="append", default=[],
+                               help="retry: only this PDF (name without .pdf, repeatable)")
+    submit_parser.add_argument("--wait", action="store_true", help="Wait for the job and print it")
+
+    commands.add_parser("status", parents=[client], help="Daemon status")
+    commands.add_parser("jobs", parents=[client], help="List the jobs")
+    for name, help_text in (("wait", "Wait for a job and print it"), ("cancel", "Cancel a queued job")):
+        command = commands.add_parser(name, parents=[client], help=help_text)
+        command.add_argument("job_id", type=int)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+        return
+
+    url = args.url.rstrip("/")
+    try:
+        if args.command == "submit":
+            spec = {"type": args.type}
+            if args.type in ("pdf", "pages"):
+                if not args.pdf:
+                    parser.error(f"submit {args.type}: a PDF file is required")
+                # The daemon runs in its own directory: send absolute paths
+                spec["pdf"] = str(Path(args.pdf).resolve())
+            if args.type == "pages":
+                if args.first is None:
+                    parser.error("submit pages: --first is required")
+                spec.update({"first_page": args.first, "last_page": args.last or args.first})
+            if args.input_dir:
+                spec["input_dir"] = str(Path(args.input_dir).resolve())
+            options = {"dpi": args.dpi, "ocr_timeout": args.ocr_timeout, "timeout": args.timeout,
+                       "group_size": args.group_size, "pdfs": args.pdfs}
+            spec.update({key: value for key, value in options.items() if value})
+            result = api_request(f"{url}/jobs", "POST", spec)
+            if args.wait and "id" in result:
+                result = wait_for_job(url, result["id"])
+        elif args.command == "status":
+            result = api_request(f"{url}/status")
+        elif args.command == "jobs":
+            result = api_request(f"{url}/jobs")
+        elif args.command == "wait":
+            result = wait_for_job(url, args.job_id)
+        else:
+            result = api_request(f"{url}/jobs/{args.job_id}", "DELETE")
+    except (urllib.error.URLError, ConnectionError) as e:
+        print(f"OCR daemon not reachable at {url} ({e}): start it with `python ocr_daemon.py serve`",
+              file=sys.stderr)
+        sys.exit(2)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if isinstance(result, dict) and (result.get("status") == "failed" or "status" not in result and result.get("error")):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,720 @@
+#!/usr/bin/env python3
+"""
+Shared OCR engine used by every entry point
+- Pluggable backends: HF transformers, CPU int8-quantized, deterministic fake
+- Page preparation (resize), result cache and batching implemented once
+- Batched multi-page generation with a batch size chosen from free memory
+- Chat template and prompt token IDs computed once per processor
+- Per-call time budgets enforced between generated tokens (no signals,
+  usable from any thread or worker process)
+"""
+
+import gc
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+
+from ocr_cache import OCRResultCache, cached_ocr, default_cache_path, DEFAULT_CACHE_MAX_MB
+from metrics import StageTimer
+from model_store import PREPARED_DIR, find_prepared, prepared_load_kwargs
+
+try:
+    import torch
+    from transformers import (AutoModelForImageTextToText, AutoProcessor, BatchFeature,
+                              StoppingCriteria, StoppingCriteriaList)
+except ImportError:
+    # Only the fake backend is usable without the ML stack
+    torch = None
+    StoppingCriteria = object
+
+
+MODEL_PATH = 'nanonets/Nanonets-OCR2-3B'
+
+OCR_PROMPT = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format if present. Return the equations in LaTeX representation if present."""
+
+# Rough peak memory per page in flight: vision encoder activations for a
+# ~1400-1600px page plus the KV cache of the prompt and 2048 new tokens
+# (fp16 on GPU, fp32 on CPU)
+PAGE_MEMORY_BYTES = {"cuda": 1_500 * 1024**2, "cpu": 3_000 * 1024**2}
+MAX_BATCH_SIZE = 8
+
+
+def host_available_memory_bytes() -> int:
+    """Memory the host can still hand out without swapping"""
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def auto_batch_size(device: str, available_bytes: int, max_batch_size: int = MAX_BATCH_SIZE) -> int:
+    """Pick how many pages fit in one generate call, keeping 20% headroom"""
+    per_page = PAGE_MEMORY_BYTES["cuda" if device == "cuda" else "cpu"]
+    usable = int(available_bytes * 0.8)
+    return max(1, min(max_batch_size, usable // per_page))
+
+
+class OCRTimeout(Exception):
+    """
+    Some pages of an OCR call ran out of time budget
+    results: text of every page, None for the pages cut off by the deadline
+    partial: text generated before the cut for those pages (None for the others),
+    to be saved and passed back as a prefix to continue from
+    """
+
+    def __init__(self, timeout_s: float, results: List[Optional[str]], partial: List[Optional[str]] = None):
+        super().__init__(f"OCR timed out after {timeout_s:g} seconds")
+        self.timeout_s = timeout_s
+        self.results = results
+        self.partial = partial if partial is not None else [None] * len(results)
+
+
+# Degeneration guard: a page whose last REPEAT_SPAN generated tokens (and at
+# least REPEAT_MIN_COPIES copies of the unit) repeat a unit of at most
+# REPEAT_MAX_PERIOD tokens is looping and stops early. Legitimately repetitive
+# pages (empty table rows, dot leaders, ruled forms) stay well under that
+REPEAT_SPAN = 1024
+REPEAT_MIN_COPIES = 8
+REPEAT_MAX_PERIOD = 128
+REPEAT_CHECK_EVERY = 16
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stop generate() at the first token step past a deadline (time.monotonic())
+    Checked between decoding steps: precise to one forward pass, and unlike
+    SIGALRM it works outside the main thread and never interrupts C code
+    """
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.fired = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if time.monotonic() >= self.deadline:
+            self.fired = True
+        return torch.full((input_ids.shape[0],), self.fired, dtype=torch.bool, device=input_ids.device)
+
+
+class RepetitionCriteria(StoppingCriteria):
+    """
+    Stop rows that degenerate into a loop: their last `span` generated tokens
+    (and at least `min_copies` copies) are one unit of at most `max_period`
+    tokens (a line, a word, a single token for a stalled stream) repeated
+    over and over
+    Checked every `check_every` steps; `keep` maps each stopped row to the
+    number of tokens it generated before the cut (the padding that follows
+    is not part of it). Nothing is removed: the caller marks the page
+    """
+
+    def __init__(self, prompt_length: int, eos_ids, span: int = REPEAT_SPAN,
+                 max_period: int = REPEAT_MAX_PERIOD, check_every: int = REPEAT_CHECK_EVERY,
+                 min_copies: int = REPEAT_MIN_COPIES):
+        self.prompt_length = prompt_length
+        self.eos_ids = eos_ids
+        self.span = span
+        self.max_period = max_period
+        self.min_copies = min_copies
+        self.check_every = check_every
+        self.keep = {}
+
+    def __call__(self, input_ids, scores, **kwargs):
+        looping = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        generated = input_ids.shape[1] - self.prompt_length
+        if generated <= self.span or generated % self.check_every:
+            return looping
+
+        # Rows already stopped by EOS keep receiving padding: not a loop
+        candidates = ~torch.isin(input_ids[:, self.prompt_length:], self.eos_ids).any(dim=1)
+        for row in self.keep:
+            candidates[row] = False
+
+        for period in range(1, self.max_period + 1):
+            # The tail equals itself shifted by one unit: `window` tokens periodic
+            window = max(self.span, (self.min_copies - 1) * period)
+            if generated < window + period:
+                break
+            repeating = ((input_ids[:, -window:] == input_ids[:, -window - period:-period]).all(dim=1)
+                         & candidates & ~looping)
+            for row in repeating.nonzero().flatten().tolist():
+                self.keep[row] = generated
+            looping |= repeating
+        return looping
+
+
+def build_messages(image: Image.Image) -> List[Dict]:
+    """Chat messages for one page"""
+    # The image stays in memory: the chat template only emits the vision
+    # placeholder tokens, the pixels are passed to the processor separately
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": [
+            {"type": "image", "image": image},
+            {"type": "text", "text": OCR_PROMPT},
+        ]},
+    ]
+
+
+class PromptCache:
+    """
+    Templated prompt text and token IDs, computed once per processor instance
+
+    The chat template renders the same text for every page; only the number
+    of image placeholder tokens changes with the page size. The text around
+    the placeholder is tokenized once, and per batch only the image processor
+    runs. Processors without the Qwen2-VL layout (image_token + merge_size)
+    fall back to the regular processor call with the cached template text.
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.text = processor.apply_chat_template(
+            build_messages(None),
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+        self.image_token_id = None
+        self.verified = False
+        image_token = getattr(processor, "image_token", None)
+        self.merge_size = getattr(getattr(processor, "image_processor", None), "merge_size", None)
+
+        if image_token and self.merge_size and self.text.count(image_token) == 1:
+            tokenizer = processor.tokenizer
+            prefix, suffix = self.text.split(image_token)
+            self.prefix_ids = tokenizer(prefix, add_special_tokens=False)["input_ids"]
+            self.suffix_ids = tokenizer(suffix, add_special_tokens=False)["input_ids"]
+            self.image_token_id = tokenizer.convert_tokens_to_ids(image_token)
+
+    def _processor_inputs(self, images: List[Image.Image], prefixes: List[str]) -> "BatchFeature":
+        """Reference path: let the processor expand and tokenize the template"""
+        self.processor.tokenizer.padding_side = "left"
+        return self.processor(
+            text=[self.text + prefix for prefix in prefixes],
+            images=list(images),
+            padding=True,
+            return_tensors="pt"
+        )
+
+    def build_inputs(self, images: List[Image.Image], timer: StageTimer = None,
+                     prefixes: List[str] = None) -> "BatchFeature":
+        """
+        Left-padded model inputs for a batch of pages
+        prefixes: answer text already generated per page, that generation continues from
+        Times the image processor ("processor") and the token layout ("template")
+        """
+        if timer is None:
+            timer = StageTimer()
+        if prefixes is None:
+            prefixes = [""] * len(images)
+
+        if self.image_token_id is None:
+            with timer.stage("processor", count=len(images)):
+                return self._processor_inputs(images, prefixes)
+
+        with timer.stage("processor", count=len(images)):
+            image_inputs = self.processor.image_processor(images=list(images), return_tensors="pt")
+
+        with timer.stage("template", count=len(images)):
+            rows = []
+            for grid_thw, prefix in zip(image_inputs["image_grid_thw"], prefixes):
+                num_image_tokens = int(grid_thw.prod()) // (self.merge_size ** 2)
+                answer_ids = self.processor.tokenizer(prefix, add_special_tokens=False)["input_ids"] if prefix else []
+                rows.append(self.prefix_ids + [self.image_token_id] * num_image_tokens + self.suffix_ids + answer_ids)
+
+            max_length = max(len(row) for row in rows)
+            pad_id = self.processor.tokenizer.pad_token_id
+            input_ids = torch.full((len(rows), max_length), pad_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(rows), max_length), dtype=torch.long)
+            for i, row in enumerate(rows):
+                input_ids[i, max_length - len(row):] = torch.tensor(row, dtype=torch.long)
+                attention_mask[i, max_length - len(row):] = 1
+
+            inputs = BatchFeature(data={
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                **image_inputs,
+            })
+
+        # Check once against the processor that the cached token layout is exact
+        if not self.verified:
+            reference = self._processor_inputs(images, prefixes)
+            if set(reference.keys()) == set(inputs.keys()) and torch.equal(reference["input_ids"], input_ids):
+                self.verified = True
+            else:
+                print("  Warning: cached prompt tokens differ from processor output, cache disabled")
+                self.image_token_id = None
+                return reference
+
+        return inputs
+
+
+def generate_batch(model, prompt_cache: PromptCache, images: List[Image.Image],
+                   max_new_tokens: int = 2048, device=None, timer: StageTimer = None,
+                   deadline: float = None, prefixes: List[str] = None) -> List[Tuple[str, str]]:
+    """
+    Run OCR on several pages in a single generate call
+    Returns (text, stop_reason) per page, stop_reason being "eos", "length"
+    (max_new_tokens reached), "deadline" (stopped at time.monotonic() >= deadline)
+    or "repetition" (looping output stopped early, text kept up to the cut)
+    prefixes: text already generated for each page (e.g. before a timeout); the
+    model continues after it and the returned text includes it
+
+    Prompts are left-padded so that every row ends where generation starts;
+    with greedy decoding and the attention mask, each row decodes exactly as
+    it would in a batch of one. Pages of the same PDF usually share their
+    size, in which case no padding is needed at all.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    if prefixes is None:
+        prefixes = [""] * len(images)
+    inputs = prompt_cache.build_inputs(images, timer=timer, prefixes=prefixes)
+    if device is not None:
+        # Host-to-device copy is part of input preparation (pages already counted)
+        with timer.stage("processor", count=0):
+            inputs = inputs.to(device)
+
+    # All rows share the padded prompt length, new tokens follow it
+    prompt_length = inputs['input_ids'].shape[1]
+    eos_ids = model.generation_config.eos_token_id
+    eos_ids = [eos_id for eos_id in (eos_ids if isinstance(eos_ids, list) else [eos_ids]) if eos_id is not None]
+    eos_ids = torch.tensor(eos_ids, dtype=inputs['input_ids'].dtype, device=inputs['input_ids'].device)
+
+    repetition_criteria = RepetitionCriteria(prompt_length, eos_ids)
+    stopping_criteria = StoppingCriteriaList([repetition_criteria])
+    deadline_criteria = None
+    if deadline is not None:
+        deadline_criteria = DeadlineCriteria(deadline)
+        stopping_criteria.append(deadline_criteria)
+
+    with timer.stage("generate", count=len(images)):
+        output_ids = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            num_beams=1,
+            stopping_criteria=stopping_criteria,
+        )
+
+    with timer.stage("decode", count=len(images)):
+        generated_ids = output_ids[:, prompt_length:]
+
+        # Rows stopped by a criterion: only what they generated, not the padding after it
+        rows = [row[:repetition_criteria.keep.get(i, len(row))] for i, row in enumerate(generated_ids.tolist())]
+        texts = prompt_cache.processor.batch_decode(
+            rows,
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=True
+        )
+        texts = [prefix + text for prefix, text in zip(prefixes, texts)]
+
+        stop_reasons = stop_reasons_of(rows, eos_ids.tolist(), repetition_criteria.keep,
+                                       deadline_criteria is not None and deadline_criteria.fired)
+        return list(zip(texts, stop_reasons))
+
+
+def stop_reasons_of(rows: List[List[int]], eos_ids: List[int], repetition_keep: Dict[int, int],
+                    deadline_fired: bool) -> List[str]:
+    """
+    Why generation stopped for each row of a batch (rows: generated token IDs,
+    looping rows already cut to repetition_keep)
+    In a batch, a row stopped early by a criterion is padded with pad_token_id
+    until the others finish, and for Qwen2-VL that pad is an EOS id: the
+    criteria are checked first, EOS only counts in rows no criterion stopped
+    """
+    eos_ids = set(eos_ids)
+    stop_reasons = []
+    for i, row in enumerate(rows):
+        if i in repetition_keep:
+            stop_reasons.append("repetition")
+        elif any(token in eos_ids for token in row):
+            stop_reasons.append("eos")
+        elif deadline_fired:
+            stop_reasons.append("deadline")
+        else:
+            stop_reasons.append("length")
+    return stop_reasons
+
+
+class OCRBackend:
+    """
+    Backend interface: turns prepared page images into text
+    Subclasses set name, device and model_revision, and implement generate()
+    The engine replaces `timer` with its own so stage timings end up in one place
+    """
+    name = "base"
+    device = "cpu"
+    model_revision = "unknown"
+    timer = StageTimer()
+
+    def generate(self, images: List[Image.Image], max_new_tokens: int = 2048,
+                 deadline: float = None, prefixes: List[str] = None) -> List[Tuple[str, str]]:
+        """
+        OCR a batch of prepared pages: (text, stop_reason) per page
+        stop_reason: "eos", "length", "deadline" (time.monotonic() reached `deadline`)
+        or "repetition" (output looping, stopped early; the caller marks the page)
+        prefixes: text already generated per page, to continue from (kept in the result)
+        """
+        raise NotImplementedError
+
+    def available_memory_bytes(self) -> int:
+        """Free memory on the device that will hold the activations"""
+        return host_available_memory_bytes()
+
+    def release_memory(self) -> None:
+        """Give back cached memory between batches"""
+        gc.collect()
+
+
+class TransformersBackend(OCRBackend):
+    name = "transformers"
+
+    def __init__(self, model_path: str = MODEL_PATH, device: str = None, offload: bool = False,
+                 prepared_dir: str = PREPARED_DIR):
+        """
+        Load Nanonets-OCR2-3B with HF transformers
+        offload=True spreads the model over GPU, CPU and disk (device_map="balanced")
+        for 8GB GPUs; otherwise FP16 on GPU or FP32 on CPU
+        prepared_dir: layouts saved by model_store.py; the one matching this device,
+        offload mode and machine is loaded instead of model_path (None = never)
+        """
+        if torch is None:
+            raise ImportError("The transformers backend needs torch and transformers installed")
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        self.offload = offload
+
+        prepared = find_prepared(prepared_dir, device, offload) if prepared_dir else None
+        load_path = model_path
+        if prepared is not None:
+            print(f"Loading prepared Nanonets-OCR2-3B from {prepared['path']} ({prepared['dtype']}, "
+                  f"device map of {prepared['prepared_at']})...")
+            load_path = prepared["path"]
+            load_kwargs = prepared_load_kwargs(prepared)
+        elif offload:
+            print("Loading Nanonets-OCR2-3B model with CPU offloading...")
+            print("This may be slow but will work with 8GB GPU")
+            Path("offload").mkdir(exist_ok=True)
+            load_kwargs = {
+                "torch_dtype": torch.float16,
+                "device_map": "balanced",  # Balanced distribution between GPU and CPU
+                "offload_folder": "offload",  # Use disk for extreme offloading if needed
+                "offload_state_dict": True,
+            }
+        else:
+            print(f"Loading Nanonets-OCR2-3B model on {device}...")
+            load_kwargs = {
+                "torch_dtype": torch.float16 if device == "cuda" else torch.float32,
+                "device_map": "auto" if device == "cuda" else device,
+            }
+
+        self.model = AutoModelForImageTextToText.from_pretrained(
+            load_path,
+            trust_remote_code=True,
+            low_cpu_mem_usage=True,
+            **load_kwargs
+        )
+        self.processor = AutoProcessor.from_pretrained(load_path)
+        self.model.eval()
+
+        # Chat template and prompt tokens are the same for every page
+        self.prompt_cache = PromptCache(self.processor)
+        if prepared is not None:
+            # Same weights as the source checkpoint: same cache keys
+            self.model_revision = prepared["model_revision"]
+        else:
+            self.model_revision = getattr(self.model.config, "_commit_hash", None) or model_path
+
+        self.release_memory()
+        print("Model loaded successfully!")
+
+    def generate(self, images: List[Image.Image], max_new_tokens: int = 2048,
+                 deadline: float = None, prefixes: List[str] = None) -> List[Tuple[str, str]]:
+        with torch.no_grad():
+            return generate_batch(
+                self.model,
+                self.prompt_cache,
+                images,
+                max_new_tokens=max_new_tokens,
+                # With offloading, accelerate hooks move inputs to the right device
+                device=None if self.offload else self.model.device,
+                timer=self.timer,
+                deadline=deadline,
+                prefixes=prefixes
+            )
+
+    def available_memory_bytes(self) -> int:
+        if self.device == "cuda" and torch.cuda.is_available():
+            free, _total = torch.cuda.mem_get_info()
+            return free
+        return host_available_memory_bytes()
+
+    def release_memory(self) -> None:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        gc.collect()
+
+
+class CPUQuantizedBackend(TransformersBackend):
+    name = "cpu-int8"
+
+    def __init__(self, model_path: str = MODEL_PATH, num_threads: int = None, prepared_dir: str = PREPARED_DIR):
+        """CPU inference with int8 dynamic quantization of the Linear layers"""
+        if torch is not None and num_threads:
+            torch.set_num_threads(num_threads)
+
+        super().__init__(model_path, device="cpu", prepared_dir=prepared_dir)
+
+        print("Quantizing Linear layers to int8 (dynamic quantization)...")
+        self.model = torch.ao.quantization.quantize_dynamic(
+            self.model,
+            {torch.nn.Linear},
+            dtype=torch.qint8
+        )
+        self.model_revision = f"{self.model_revision}+int8"
+
+
+class FakeBackend(OCRBackend):
+    name = "fake"
+    model_revision = "fake"
+    chars_per_token = 4
+
+    def __init__(self, latency_s: float = 0.0, output_chars: int = 0):
+        """
+        Stand-in for the model, to exercise the rest of the pipeline offline
+        latency_s: simulated generate time per page (a batch sleeps for all its pages)
+        output_chars: pad each page's text to about this many characters
+        Pages longer than max_new_tokens * chars_per_token are cut ("length")
+        """
+        self.latency_s = latency_s
+        self.output_chars = output_chars
+
+    def generate(self, images: List[Image.Image], max_new_tokens: int = 2048,
+                 deadline: float = None, prefixes: List[str] = None) -> List[Tuple[str, str]]:
+        """Deterministic text derived from the page pixels, no model involved"""
+        if prefixes is None:
+            prefixes = [""] * len(images)
+
+        with self.timer.stage("processor", count=len(images)):
+            digests = [hashlib.sha256(image.tobytes()).hexdigest() for image in images]
+
+        with self.timer.stage("decode", count=len(images)):
+            texts = []
+            for image, digest in zip(images, digests):
+                text = (
+                    f"FAKE OCR {digest[:12]}\n\n"
+                    f"Page image of {image.size[0]}x{image.size[1]} pixels\n"
+                )
+                if len(text) < self.output_chars:
+                    filler = f"Lorem ipsum {digest[:8]} dolor sit amet.\n"
+                    text += (filler * (self.output_chars // len(filler) + 1))[:self.output_chars - len(text)]
+                texts.append(text)
+
+        # Generation time is proportional to the text left to produce; rows of a
+        # batch progress together, so a deadline cuts every page at the same point
+        remaining = [1 - min(len(prefix), len(text)) / len(text) for prefix, text in zip(prefixes, texts)]
+        completed = 1.0
+        with self.timer.stage("generate", count=len(images)):
+            if self.latency_s > 0:
+                needed = self.latency_s * len(images) * max(remaining)
+                if deadline is not None and time.monotonic() + needed > deadline:
+                    allowed = max(0.0, deadline - time.monotonic())
+                    completed = allowed / needed
+                    needed = allowed
+                time.sleep(needed)
+
+        results = []
+        for prefix, text in zip(prefixes, texts):
+            budget_end = len(prefix) + max_new_tokens * self.chars_per_token
+            if completed < 1.0:
+                cut = len(prefix) + int((len(text) - len(prefix)) * completed)
+                results.append((text[:min(cut, budget_end)], "deadline"))
+            elif len(text) > budget_end:
+                results.append((text[:budget_end], "length"))
+            else:
+                results.append((text, "eos"))
+        return results
+
+
+BACKENDS = {
+    TransformersBackend.name: TransformersBackend,
+    CPUQuantizedBackend.name: CPUQuantizedBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+
+def create_backend(name: str, **kwargs) -> OCRBackend:
+    """Instantiate a backend by name (see BACKENDS)"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{name}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name](**kwargs)
+
+
+class OCREngine:
+    def __init__(self, backend: OCRBackend, max_dimension: int = 1400, batch_size: int = 0,
+                 cache_db: str = None, cache_max_mb: int = DEFAULT_CACHE_MAX_MB):
+        """
+        Page preparation, result cache and batching on top of a backend
+        batch_size 0 = auto from the memory left after loading the model
+        cache_db None = result cache disabled
+        """
+        self.backend = backend
+        self.max_dimension = max_dimension
+
+        # Wall time per pipeline stage, shared with the backend
+        self.timer = StageTimer()
+        backend.timer = self.timer
+
+        # Pages per generate call, sized from the memory left after loading
+        if batch_size > 0:
+            self.batch_size = batch_size
+        else:
+            self.batch_size = auto_batch_size(backend.device, backend.available_memory_bytes())
+        print(f"OCR backend: {backend.name}, batch size: {self.batch_size}")
+
+        # Persistent cache of OCR results keyed by page pixels and settings
+        self.cache = OCRResultCache(cache_db, max_bytes=cache_max_mb * 1024**2) if cache_db else None
+
+        # Why generation stopped for each page of the last ocr_batch call:
+        # "eos", "length" (max_new_tokens), "deadline", "repetition" (looping
+        # output cut early) or "cache" (not generated)
+        self.last_stop_reasons = []
+
+    def prepare_image(self, image: Image.Image) -> Image.Image:
+        """Resize large pages to the OCR working size (no-op on already prepared images)"""
+        if max(image.size) > self.max_dimension:
+            start = time.perf_counter()
+            ratio = self.max_dimension / max(image.size)
+            new_size = tuple(int(dim * ratio) for dim in image.size)
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+            elapsed = time.perf_counter() - start
+            self.timer.add("resize", elapsed)
+            # Kept with the page for its per-page metrics record
+            image.info["resize_s"] = elapsed
+        return image
+
+    def cache_key(self, image: Image.Image) -> str:
+        """Cache key of a prepared page image"""
+        return OCRResultCache.make_key(
+            image,
+            image.info.get("render_dpi", 0),
+            self.max_dimension,
+            OCR_PROMPT,
+            self.backend.model_revision
+        )
+
+    def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048, timeout_s: float = None,
+                  prefix: str = None) -> str:
+        """Perform OCR on a single image"""
+        return self.ocr_batch([image], max_new_tokens=max_new_tokens, timeout_s=timeout_s,
+                              prefixes=[prefix] if prefix else None)[0]
+
+    def ocr_batch(self, images: List[Image.Image], max_new_tokens: int = 2048,
+                  timeout_s: float = None, prefixes: List[Optional[str]] = None) -> List[str]:
+        """
+        Perform OCR on several images in one generate call, one result per image
+        timeout_s: wall-time budget of the call; pages still generating when it
+        runs out are cut off and reported by an OCRTimeout (the others are kept)
+        prefixes: partial text of earlier cut-off attempts, generation resumes after it
+        """
+        deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+        images = [self.prepare_image(image) for image in images]
+        prefix_of = {id(image): prefix or "" for image, prefix in zip(images, prefixes or [])}
+        partial = {}
+        stop_reasons = {}
+
+        def run_ocr(pending: List[Image.Image]) -> List[Optional[str]]:
+            outputs = self.backend.generate(
+                pending,
+                max_new_tokens=max_new_tokens,
+                deadline=deadline,
+                prefixes=[prefix_of.get(id(image), "") for image in pending]
+            )
+            # Cut-off pages are not results (and must not be cached): keep what they got
+            results = []
+            for image, (text, stop_reason) in zip(pending, outputs):
+                stop_reasons[id(image)] = stop_reason
+                if stop_reason == "deadline":
+                    partial[id(image)] = text
+                    text = None
+                results.append(text)
+            return results
+
+        # Pages already OCR'd with identical pixels and settings come from the cache
+        keys = [self.cache_key(image) for image in images] if self.cache else []
+        # Only final outputs are cached: a page cut by its token budget may
+        # be continued with a larger one, a looping page is retried
+        results = cached_ocr(self.cache, images, keys, run_ocr,
+                             store=lambda image: stop_reasons[id(image)] == "eos")
+        self.last_stop_reasons = [stop_reasons.get(id(image), "cache") for image in images]
+
+        self.backend.release_memory()
+        if any(result is None for result in results):
+            raise OCRTimeout(timeout_s, results, [partial.get(id(image)) for image in images])
+        return results
+
+    def release_memory(self) -> None:
+        self.backend.release_memory()
+
+    def cache_stats(self) -> Dict:
+        """Current hit/miss counters of the result cache (zeros when disabled)"""
+        if self.cache is None:
+            return {"hits": 0, "misses": 0}
+        return {"hits": self.cache.hits, "misses": self.cache.misses}
+
+
+def add_engine_arguments(parser, default_backend: str = TransformersBackend.name) -> None:
+    """CLI options shared by the entry points"""
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=default_backend,
+                       help=f"OCR backend (default: {default_backend})")
+    parser.add_argument("--batch-size", type=int, default=0,
+                       help="Pages per generate call (default: 0 = auto from available memory)")
+    parser.add_argument("--cache-db", type=str, default=None,
+                       help=f"OCR result cache database, on a local disk, not NFS (default: {default_cache_path()})")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB,
+                       help=f"Size cap of the OCR result cache, LRU eviction (default: {DEFAULT_CACHE_MAX_MB} MB)")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Disable the OCR result cache")
+    parser.add_argument("--prepared-model", type=str, default=PREPARED_DIR,
+                       help=f"Prepared model layouts from model_store.py (default: {PREPARED_DIR}, "
+                            "used when present; 'none' = always load the hub checkpoint)")
+    parser.add_argument("--fake-latency", type=float, default=0.0,
+                       help="fake backend only: simulated generate time per page in seconds (default: 0)")
+    parser.add_argument("--fake-output-chars", type=int, default=0,
+                       help="fake backend only: characters of text per page (default: 0 = short header)")
+
+
+def engine_from_args(args, max_dimension: int = 1400, offload: bool = False) -> OCREngine:
+    """Build the engine described by add_engine_arguments() options"""
+    prepared_dir = None if args.prepared_model.lower() == "none" else args.prepared_model
+    if args.backend == TransformersBackend.name:
+        backend = create_backend(args.backend, offload=offload, prepared_dir=prepared_dir)
+    elif args.backend == FakeBackend.name:
+        backend = create_backend(args.backend, latency_s=args.fake_latency,
+                                 output_chars=args.fake_output_chars)
+    else:
+        backend = create_backend(args.backend, prepared_dir=prepared_dir)
+
+    cache_db = None
+    if not args.no_cache:
+        cache_db = args.cache_db or default_cache_path()
+
+    return OCREngine(
+        backend,
+        max_dimension=max_dimension,
+        batch_size=args.batch_size,
+        cache_db=cache_db,
+        cache_max_mb=args.cache_max_mb
+    )
@@ -5,130 +5,74 @@ WITH AGGRESSIVE CPU OFFLOADING for 8GB GPU
 This will be SLOWER but should work without OOM errors
 """
 
-import os
 import json
-import torch
 from pathlib import Path
-from pdf2image import convert_from_path
 from PIL import Image
-from transformers import AutoModelForImageTextToText, AutoTokenizer, AutoProcessor
 import gc
-from typing import List, Tuple
+from typing import List, Dict, Tuple, Iterator, Optional
 import re
-import tempfile
+
+from page_source import iter_pdf_pages, get_pdf_page_count, prefetch_pages, iter_batches, DEFAULT_PREFETCH_DEPTH
+from ocr_engine import OCREngine, TransformersBackend, add_engine_arguments, engine_from_args
+from metrics import PageMetricsLog, page_stage_times
+from document_writer import markdown_header, markdown_page
+from corpus_index import CorpusIndex
 
 
 class NanonetsOCRProcessor:
-    def __init__(self, output_base_dir: str = "../data/output/ocr_results"):
-        """Initialize the OCR processor with Nanonets model"""
+    def __init__(self, output_base_dir: str = "../data/output/ocr_results",
+                 prefetch_depth: int = DEFAULT_PREFETCH_DEPTH, engine: OCREngine = None):
+        """Initialize the OCR processor (Nanonets model unless another engine is given)"""
         self.output_base_dir = Path(output_base_dir)
         self.output_base_dir.mkdir(exist_ok=True)
+        self.prefetch_depth = prefetch_depth
 
-        print("Loading Nanonets-OCR2-3B model with CPU offloading...")
-        print("This may be slow but will work with 8GB GPU")
-        model_path = 'nanonets/Nanonets-OCR2-3B'
-
-        # Aggressive CPU offloading - only keep essential layers on GPU
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="balanced",  # Balanced distribution between GPU and CPU
-            low_cpu_mem_usage=True,
-            offload_folder="offload",  # Use disk for extreme offloading if needed
-            offload_state_dict=True,
-        )
-
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.processor = AutoProcessor.from_pretrained(model_path)
-
-        self.model.eval()
+        # Corpus-wide status of the output, updated with every _summary.json
+        self.index = CorpusIndex(self.output_base_dir)
 
-        # Clear cache
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        # Model, page preparation, result cache and batching live in the shared engine
+        if engine is None:
+            # CPU offloading for 8GB GPU, pages resized to 1400px
+            engine = OCREngine(TransformersBackend(offload=True), max_dimension=1400)
+        self.engine = engine
 
-        print("Model loaded successfully with CPU offloading!")
         print(f"Output directory: {self.output_base_dir}")
 
-    def pdf_to_images(self, pdf_path: str, dpi: int = 150) -> List[Image.Image]:
-        """Convert PDF to images"""
+    def pdf_to_images(self, pdf_path: str, dpi: int = 150,
+                      num_pages: int = None) -> Iterator[Tuple[int, Image.Image]]:
+        """Lazily convert PDF pages to images, a few pages at a time"""
         print(f"Converting PDF to images: {Path(pdf_path).name}")
-        images = convert_from_path(pdf_path, dpi=dpi)
-        print(f"Converted {len(images)} pages")
-        return images
+        return iter_pdf_pages(pdf_path, dpi=dpi, num_pages=num_pages, timer=self.engine.timer)
 
     def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048) -> str:
-        """Perform OCR on a single image with aggressive memory management"""
-        with torch.no_grad():
-            # Resize to reduce memory
-            max_dimension = 1400
-            if max(image.size) > max_dimension:
-                ratio = max_dimension / max(image.size)
-                new_size = tuple(int(dim * ratio) for dim in image.size)
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-                print(f"  Resized image to {new_size}")
-
-            # Save temporarily
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                image.save(tmp_path)
-
+        """Perform OCR on a single image"""
+        return self.engine.ocr_image(image, max_new_tokens=max_new_tokens)
+
+    def ocr_batch(self, images: List[Image.Image], max_new_tokens: int = 2048) -> List[str]:
+        """Perform OCR on several images in one generate call, one result per image"""
+        return self.engine.ocr_batch(images, max_new_tokens=max_new_tokens)
+
+    def ocr_pages(self, batch: List[Tuple[int, Image.Image]]) -> List[Tuple[int, Optional[str], Optional[Exception]]]:
+        """
+        OCR a batch of (page_num, image) pairs
+        Returns (page_num, result, error) per page; if the batched call fails,
+        pages are retried one by one so a single bad page does not sink the others
+        """
+        try:
+            results = self.ocr_batch([image for _, image in batch])
+            return [(page_num, result, None) for (page_num, _), result in zip(batch, results)]
+        except Exception as e:
+            if len(batch) == 1:
+                return [(batch[0][0], None, e)]
+            print(f"  Batch of {len(batch)} pages failed ({e}), retrying one page at a time")
+
+        outcomes = []
+        for page_num, image in batch:
             try:
-                prompt = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format if present. Return the equations in LaTeX representation if present."""
-
-                messages = [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": [
-                        {"type": "image", "image": f"file://{tmp_path}"},
-                        {"type": "text", "text": prompt},
-                    ]},
-                ]
-
-                text = self.processor.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-
-                inputs = self.processor(
-                    text=[text],
-                    images=[image],
-                    padding=True,
-                    return_tensors="pt"
-                )
-
-                # Generate with reduced batch size and tokens
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    do_sample=False,
-                    num_beams=1,  # Greedy decoding to save memory
-                )
-
-                generated_ids = [
-                    output_ids[len(input_ids):]
-                    for input_ids, output_ids in zip(inputs['input_ids'], output_ids)
-                ]
-
-                output_text = self.processor.batch_decode(
-                    generated_ids,
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True
-                )
-
-                result = output_text[0]
-
-            finally:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-
-            # Aggressive cleanup
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            gc.collect()
-
-            return result
+                outcomes.append((page_num, self.ocr_image(image), None))
+            except Exception as e:
+                outcomes.append((page_num, None, e))
+        return outcomes
 
     def detect_document_boundary(self, current_result: str, previous_result: str = None) -> bool:
         """Detect if current page starts a new document"""
@@ -160,19 +104,9 @@ class NanonetsOCRProcessor:
 
     def format_as_markdown(self, pages_data: List[Tuple[int, str]], document_num: int) -> str:
         """Format OCR results as markdown"""
-        md_content = f"# Document {document_num}\n\n"
-        md_content += f"Pages: {pages_data[0][0] + 1}"
-        if len(pages_data) > 1:
-            md_content += f" - {pages_data[-1][0] + 1}"
-        md_content += f" ({len(pages_data)} page{'s' if len(pages_data) > 1 else ''})\n\n"
-        md_content += "---\n\n"
-
-        for page_num, result in pages_data:
-            md_content += f"## Page {page_num + 1}\n\n"
-            md_content += result + "\n\n"
-            md_content += "---\n\n"
-
-        return md_content
+        parts = [markdown_header(document_num, pages_data[0][0], pages_data[-1][0], len(pages_data))]
+        parts.extend(markdown_page(page_num, result) for page_num, result in pages_data)
+        return "".join(parts)
 
     def process_pdf(self, pdf_path: str, dpi: int = 150) -> None:
         """Process a single PDF file"""
@@ -184,40 +118,66 @@ class NanonetsOCRProcessor:
         pdf_output_dir = self.output_base_dir / pdf_path.stem
         pdf_output_dir.mkdir(exist_ok=True)
 
-        images = self.pdf_to_images(str(pdf_path), dpi=dpi)
+        # OCR cache counters for this PDF only
+        cache_start = self.engine.cache_stats()
+
+        # Stage timings of this PDF, one JSON record per page in _metrics.jsonl
+        timings_start = self.engine.timer.snapshot()
+        metrics = PageMetricsLog(pdf_output_dir / "_metrics.jsonl", pdf_path.stem)
+
+        num_pages = get_pdf_page_count(str(pdf_path))
+        print(f"PDF has {num_pages} pages")
+        pages = prefetch_pages(
+            self.pdf_to_images(str(pdf_path), dpi=dpi, num_pages=num_pages),
+            depth=self.prefetch_depth,
+            transform=self.engine.prepare_image
+        )
 
         current_document_pages = []
         document_num = 1
         previous_result = None
 
-        for page_num, image in enumerate(images):
-            print(f"\nProcessing page {page_num + 1}/{len(images)}...")
+        for batch in iter_batches(pages, self.engine.batch_size):
+            for page_num, _ in batch:
+                print(f"\nProcessing page {page_num + 1}/{num_pages}...")
+
+            with self.engine.timer.capture() as batch_stages:
+                outcomes = self.ocr_pages(batch)
+            images = dict(batch)
+
+            for page_num, result, error in outcomes:
+                page_stages = page_stage_times(images[page_num], batch_stages, len(batch))
+
+                if error is not None:
+                    print(f"  ERROR on page {page_num + 1}: {error}")
+                    metrics.record_page(page_num, page_stages, status="error")
+                    # Save empty result to continue
+                    current_document_pages.append((page_num, f"[ERROR: {error}]"))
+                    continue
 
-            try:
-                result = self.ocr_image(image)
                 print(f"  Extracted {len(result)} characters")
 
-                is_new_doc = self.detect_document_boundary(result, previous_result)
+                with self.engine.timer.capture() as own_stages:
+                    with self.engine.timer.stage("boundary"):
+                        is_new_doc = self.detect_document_boundary(result, previous_result)
+
+                    if is_new_doc and current_document_pages:
+                        self.save_document(
+                            pdf_output_dir,
+                            current_document_pages,
+                            document_num,
+                            pdf_path.stem
+                        )
+                        document_num += 1
+                        current_document_pages = []
 
-                if is_new_doc and current_document_pages:
-                    self.save_document(
-                        pdf_output_dir,
-                        current_document_pages,
-                        document_num,
-                        pdf_path.stem
-                    )
-                    document_num += 1
-                    current_document_pages = []
+                page_stages.update(own_stages)
+                metrics.record_page(page_num, page_stages, chars=len(result))
 
                 current_document_pages.append((page_num, result))
                 previous_result = result
 
-            except Exception as e:
-                print(f"  ERROR on page {page_num + 1}: {e}")
-                # Save empty result to continue
-                current_document_pages.append((page_num, f"[ERROR: {e}]"))
-
-            del image
+            del batch
             gc.collect()
 
         # Save last document
@@ -229,24 +189,35 @@ class NanonetsOCRProcessor:
                 pdf_path.stem
             )
 
-        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, len(images))
+        cache_stats = None
+        if self.engine.cache:
+            cache_end = self.engine.cache_stats()
+            cache_stats = {key: cache_end[key] - cache_start[key] for key in cache_end}
+        timings = {
+            "stages_s": self.engine.timer.totals_since(timings_start),
+            "page_latency": metrics.latency_summary(),
+        }
+        metrics.close()
+        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, num_pages, cache_stats, timings)
 
-        print(f"\nCompleted! Found {document_num} document(s) in {len(images)} pages")
+        print(f"\nCompleted! Found {document_num} document(s) in {num_pages} pages")
         print(f"Output saved to: {pdf_output_dir}")
 
     def save_document(self, output_dir: Path, pages_data: List[Tuple[int, str]],
                      doc_num: int, pdf_name: str) -> None:
         """Save a single document as markdown"""
-        md_content = self.format_as_markdown(pages_data, doc_num)
-        output_file = output_dir / f"{pdf_name}_doc{doc_num:02d}.md"
+        with self.engine.timer.stage("write", count=len(pages_data)):
+            md_content = self.format_as_markdown(pages_data, doc_num)
+            output_file = output_dir / f"{pdf_name}_doc{doc_num:02d}.md"
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(md_content)
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(md_content)
 
         print(f"  → Saved document {doc_num} ({len(pages_data)} pages) to {output_file.name}")
 
     def save_summary(self, output_dir: Path, pdf_name: str,
-                    num_docs: int, num_pages: int) -> None:
+                    num_docs: int, num_pages: int, cache_stats: Dict = None,
+                    timings: Dict = None) -> None:
         """Save processing summary"""
         summary = {
             "pdf_name": pdf_name,
@@ -255,8 +226,15 @@ class NanonetsOCRProcessor:
             "output_directory": str(output_dir)
         }
 
+        if cache_stats is not None:
+            summary["ocr_cache"] = cache_stats
+
+        if timings is not None:
+            summary["timings"] = timings
+
         with open(output_dir / "_summary.json", 'w') as f:
             json.dump(summary, f, indent=2)
+        self.index.record_summary(output_dir, summary)
 
     def process_directory(self, input_dir: str) -> None:
         """Process all PDFs in a directory"""
@@ -273,9 +251,7 @@ class NanonetsOCRProcessor:
                 print(f"ERROR processing {pdf_file.name}: {e}")
                 continue
 
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            gc.collect()
+            self.engine.release_memory()
 
         print(f"\n{'='*60}")
         print(f"All complete! Processed {len(pdf_files)} PDFs")
@@ -290,13 +266,17 @@ def main():
     parser.add_argument("--output-dir", default="../data/output/ocr_results")
     parser.add_argument("--dpi", type=int, default=150)
     parser.add_argument("--single-pdf", type=str, default=None)
+    parser.add_argument("--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                       help=f"Pages rendered ahead of OCR in background (default: {DEFAULT_PREFETCH_DEPTH}, 0 = off)")
+    add_engine_arguments(parser)
 
     args = parser.parse_args()
 
-    # Create offload directory
-    Path("offload").mkdir(exist_ok=True)
-
-    processor = NanonetsOCRProcessor(output_base_dir=args.output_dir)
+    processor = NanonetsOCRProcessor(
+        output_base_dir=args.output_dir,
+        prefetch_depth=args.prefetch_depth,
+        engine=engine_from_args(args, max_dimension=1400, offload=True)
+    )
 
     if args.single_pdf:
         processor.process_pdf(args.single_pdf, dpi=args.dpi)
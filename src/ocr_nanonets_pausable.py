@@ -7,150 +7,204 @@ OCR processor with PAUSE capability and RESUME support
 - Logs skipped pages (due to timeout) in _summary.json
 """
 
-import os
 import json
-import torch
 from pathlib import Path
-from pdf2image import convert_from_path
 from PIL import Image
-from transformers import AutoModelForImageTextToText, AutoTokenizer, AutoProcessor
 import gc
-from typing import List, Tuple, Set, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Iterator
 import re
-import tempfile
 import sys
-import signal
-from contextlib import contextmanager
-
-
-class TimeoutException(Exception):
-    """Exception levée quand un timeout se produit"""
-    pass
-
-
-@contextmanager
-def timeout_context(seconds):
-    """Context manager pour ajouter un timeout à une opération"""
-    def timeout_handler(signum, frame):
-        raise TimeoutException(f"Operation timed out after {seconds} seconds")
-
-    # Set the signal handler and a timeout alarm
-    old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(seconds)
-
-    try:
-        yield
-    finally:
-        # Restore the old handler and cancel the alarm
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_handler)
+import time
+
+from page_source import (iter_pdf_pages, get_pdf_page_count, prefetch_pages, iter_batches, page_chunks,
+                         DEFAULT_PREFETCH_DEPTH)
+from ocr_engine import OCREngine, OCRTimeout, TransformersBackend, add_engine_arguments, engine_from_args
+from metrics import PageMetricsLog, page_stage_times, page_record, latency_histogram
+from lease_queue import LeaseQueue, LEASE_TTL_S
+from page_journal import PageJournal, JOURNAL_NAME, scan_markdown_pages
+from document_writer import (DocumentWriter, REPETITION_REASON, markdown_header, markdown_page,
+                             recover_part_documents, repetition_page_entry, repetition_page_text,
+                             skipped_page_entry, timeout_page_text)
+from metrics_server import PipelineMetrics, MetricsServer, DEFAULT_METRICS_PORT
+from page_budget import PageBudget, BUDGET_STATS_NAME, DEFAULT_BLANK_THRESHOLD, SUGGESTED_BLANK_THRESHOLD, ink_ratio
+from corpus_index import CorpusIndex
+from worker_pool import add_worker_arguments, pending_pdfs, run_worker_pool
 
 
 class NanonetsOCRProcessor:
-    def __init__(self, output_base_dir: str = "../data/output/ocr_results", pause_after_each: bool = False):
-        """Initialize the OCR processor with Nanonets model"""
+    def __init__(self, output_base_dir: str = "../data/output/ocr_results", pause_after_each: bool = False,
+                 prefetch_depth: int = DEFAULT_PREFETCH_DEPTH, engine: OCREngine = None,
+                 metrics: PipelineMetrics = None, adaptive_budget: bool = False,
+                 max_ocr_timeout: int = None, blank_threshold: float = DEFAULT_BLANK_THRESHOLD):
+        """
+        Initialize the OCR processor (Nanonets model unless another engine is given)
+        adaptive_budget: set each page's timeout and max_new_tokens from its ink and
+        text lines and from the pages already done (up to max_ocr_timeout)
+        blank_threshold: pages with a lower ink ratio are blank and not OCR'd (0 = off)
+        """
         self.output_base_dir = Path(output_base_dir)
         self.output_base_dir.mkdir(exist_ok=True)
         self.pause_after_each = pause_after_each
+        self.prefetch_depth = prefetch_depth
+        self.adaptive_budget = adaptive_budget
+        self.max_ocr_timeout = max_ocr_timeout
+        self.budget = None
+        self.blank_threshold = blank_threshold
 
-        print("Loading Nanonets-OCR2-3B model with CPU offloading...")
-        print("This may be slow but will work with 8GB GPU")
-        model_path = 'nanonets/Nanonets-OCR2-3B'
-
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="balanced",
-            low_cpu_mem_usage=True,
-            offload_folder="offload",
-            offload_state_dict=True,
-        )
+        # Model, page preparation, result cache and batching live in the shared engine
+        if engine is None:
+            # CPU offloading for 8GB GPU, pages resized to 1400px
+            engine = OCREngine(TransformersBackend(offload=True), max_dimension=1400)
+        self.engine = engine
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.processor = AutoProcessor.from_pretrained(model_path)
-        self.model.eval()
+        # Live counters, served over HTTP when --metrics-port is set
+        self.metrics = metrics if metrics is not None else PipelineMetrics(engine)
 
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        # Corpus-wide status of the output, updated with every _summary.json
+        self.index = CorpusIndex(self.output_base_dir)
 
-        print("Model loaded successfully with CPU offloading!")
         print(f"Output directory: {self.output_base_dir}")
 
-    def pdf_to_images(self, pdf_path: str, dpi: int = 150) -> List[Image.Image]:
-        """Convert PDF to images"""
+    def pdf_to_images(self, pdf_path: str, dpi: int = 150, num_pages: int = None,
+                      pages: List[int] = None) -> Iterator[Tuple[int, Image.Image]]:
+        """Lazily convert PDF pages (all, or only `pages`) to images, a few pages at a time"""
         print(f"Converting PDF to images: {Path(pdf_path).name}")
-        images = convert_from_path(pdf_path, dpi=dpi)
-        print(f"Converted {len(images)} pages")
-        return images
-
-    def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048) -> str:
-        """Perform OCR on a single image"""
-        with torch.no_grad():
-            max_dimension = 1400
-            if max(image.size) > max_dimension:
-                ratio = max_dimension / max(image.size)
-                new_size = tuple(int(dim * ratio) for dim in image.size)
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-                print(f"  Resized image to {new_size}")
-
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                image.save(tmp_path)
-
+        return iter_pdf_pages(pdf_path, dpi=dpi, num_pages=num_pages, timer=self.engine.timer,
+                              pages=pages)
+
+    def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048, timeout_s: float = None,
+                  prefix: str = None) -> str:
+        """
+        Perform OCR on a single image (OCRTimeout if it takes longer than timeout_s)
+        prefix: partial text of an earlier timed-out attempt to continue from
+        """
+        return self.engine.ocr_image(image, max_new_tokens=max_new_tokens, timeout_s=timeout_s, prefix=prefix)
+
+    def ocr_batch(self, images: List[Image.Image], max_new_tokens: int = 2048,
+                  timeout_s: float = None, prefixes: List[Optional[str]] = None) -> List[str]:
+        """Perform OCR on several images in one generate call, one result per image"""
+        return self.engine.ocr_batch(images, max_new_tokens=max_new_tokens, timeout_s=timeout_s,
+                                     prefixes=prefixes)
+
+    def page_budget(self, ocr_timeout: int) -> PageBudget:
+        """Budget controller of the run, learning from every PDF it processes"""
+        if self.budget is None or self.budget.ocr_timeout != ocr_timeout:
+            self.budget = PageBudget(ocr_timeout, self.max_ocr_timeout, adaptive=self.adaptive_budget,
+                                     stats_path=self.output_base_dir / BUDGET_STATS_NAME)
+        return self.budget
+
+    def observe_page(self, budget: PageBudget, details: Dict, result: str, page_stages: Dict) -> None:
+        """Feed a page OCR'd to the end to the budget, if the model generated it"""
+        # A cached page still gets a share of its batch's generate time
+        if details["stop"] == "cache" or not page_stages.get("generate"):
+            return
+        budget.observe(details["budget"], len(result), page_stages["generate"])
+
+    def ocr_pages(self, batch: List[Tuple[int, Image.Image]],
+                  ocr_timeout: int) -> List[Tuple[int, Optional[str], Optional[Exception], Dict]]:
+        """
+        OCR a batch of (page_num, image) pairs, like ocr_page_batch
+        Blank pages (ink ratio under blank_threshold) skip the model: empty
+        result, stop "blank", in milliseconds
+        """
+        blank = {}
+        if self.blank_threshold > 0:
+            with self.engine.timer.stage("blank", count=len(batch)):
+                for page_num, image in batch:
+                    ink = ink_ratio(image)
+                    if ink < self.blank_threshold:
+                        blank[page_num] = ink
+
+        pages = [(page_num, image) for page_num, image in batch if page_num not in blank]
+        outcomes = {outcome[0]: outcome for outcome in self.ocr_page_batch(pages, ocr_timeout)} if pages else {}
+        return [outcomes[page_num] if page_num not in blank
+                else (page_num, "", None, {"stop": "blank", "ink": round(blank[page_num], 5)})
+                for page_num, _ in batch]
+
+    def ocr_page_batch(self, batch: List[Tuple[int, Image.Image]],
+                       ocr_timeout: int) -> List[Tuple[int, Optional[str], Optional[Exception], Dict]]:
+        """
+        OCR a batch of (page_num, image) pairs, each page within its budget
+        Returns (page_num, result, error, details) per page; pages of the batch that
+        fail or run out of time are retried one by one so only the faulty page is
+        skipped (an OCRTimeout error carries the text generated before the cut in
+        .partial). details: the page budget and why generation stopped
+        """
+        budget = self.page_budget(ocr_timeout)
+        if budget.adaptive:
+            with self.engine.timer.stage("budget", count=len(batch)):
+                budgets = [budget.plan(image) for _, image in batch]
+        else:
+            budgets = [budget.plan(image) for _, image in batch]
+        stop_reasons = [None] * len(batch)
+        partial = [None] * len(batch)
+
+        batch_start = time.monotonic()
+        try:
+            # One call for the batch: the largest page timeout and token budget, so
+            # no page of the batch runs longer than its own timeout
+            results = self.ocr_batch([image for _, image in batch],
+                                     max_new_tokens=max(b["max_new_tokens"] for b in budgets),
+                                     timeout_s=max(b["timeout_s"] for b in budgets))
+            stop_reasons = list(self.engine.last_stop_reasons)
+        except OCRTimeout as e:
+            stop_reasons = list(self.engine.last_stop_reasons)
+            if len(batch) == 1:
+                return [(batch[0][0], None, e, {"budget": budgets[0], "stop": "deadline"})]
+            # Pages that finished within the batch budget are kept, the others
+            # continue from what they generated before the cut
+            results, partial = e.results, e.partial
+            print(f"  {results.count(None)} page(s) of the batch ran out of time, retrying them one at a time")
+        except Exception as e:
+            if len(batch) == 1:
+                return [(batch[0][0], None, e, {"budget": budgets[0], "stop": None})]
+            results = [None] * len(batch)
+            print(f"  Batch of {len(batch)} pages failed ({e}), retrying one page at a time")
+
+        # Follow-up calls of a page only get what is left of its timeout
+        batch_s = time.monotonic() - batch_start
+        outcomes = []
+        for (page_num, image), result, prefix, page_budget, stop in zip(batch, results, partial,
+                                                                         budgets, stop_reasons):
+            error = None
+            remaining = page_budget["timeout_s"] - batch_s
             try:
-                prompt = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format if present. Return the equations in LaTeX representation if present."""
-
-                messages = [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": [
-                        {"type": "image", "image": f"file://{tmp_path}"},
-                        {"type": "text", "text": prompt},
-                    ]},
-                ]
-
-                text = self.processor.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-
-                inputs = self.processor(
-                    text=[text],
-                    images=[image],
-                    padding=True,
-                    return_tensors="pt"
-                )
-
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    do_sample=False,
-                    num_beams=1,
-                )
-
-                generated_ids = [
-                    output_ids[len(input_ids):]
-                    for input_ids, output_ids in zip(inputs['input_ids'], output_ids)
-                ]
-
-                output_text = self.processor.batch_decode(
-                    generated_ids,
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True
-                )
-
-                result = output_text[0]
-
-            finally:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            gc.collect()
-
-            return result
+                if result is None:
+                    result, remaining = self.ocr_remaining(image, page_budget, page_budget["max_new_tokens"],
+                                                           remaining, prefix)
+                    stop = self.engine.last_stop_reasons[0]
+
+                # A page with text lines that used up a reduced token budget was
+                # under-estimated: continue it with the rest of the full budget
+                if (stop == "length" and page_budget.get("lines")
+                        and page_budget["max_new_tokens"] < budget.max_new_tokens):
+                    print(f"  Page {page_num + 1} reached its budget of {page_budget['max_new_tokens']} tokens, continuing")
+                    result, remaining = self.ocr_remaining(image, page_budget,
+                                                           budget.max_new_tokens - page_budget["max_new_tokens"],
+                                                           remaining, result)
+                    stop = self.engine.last_stop_reasons[0]
+            except OCRTimeout as e:
+                result, error, stop = None, e, "deadline"
+            except Exception as e:
+                result, error = None, e
+            outcomes.append((page_num, result, error, {"budget": page_budget, "stop": stop}))
+        return outcomes
+
+    def ocr_remaining(self, image: Image.Image, page_budget: Dict, max_new_tokens: int, remaining: float,
+                      prefix: str = None) -> Tuple[str, float]:
+        """
+        OCR a page within what is left of its timeout (remaining, in seconds)
+        Returns (result, time still left); the OCRTimeout of a cut page reports
+        its full page timeout and carries the text generated so far
+        """
+        if remaining <= 0:
+            raise OCRTimeout(page_budget["timeout_s"], [None], [prefix])
+        start = time.monotonic()
+        try:
+            result = self.ocr_image(image, max_new_tokens=max_new_tokens, timeout_s=remaining, prefix=prefix)
+        except OCRTimeout as e:
+            raise OCRTimeout(page_budget["timeout_s"], e.results, e.partial)
+        return result, remaining - (time.monotonic() - start)
 
     def detect_document_boundary(self, current_result: str, previous_result: str = None) -> bool:
         """Detect if current page starts a new document"""
@@ -181,19 +235,9 @@ class NanonetsOCRProcessor:
 
     def format_as_markdown(self, pages_data: List[Tuple[int, str]], document_num: int) -> str:
         """Format OCR results as markdown"""
-        md_content = f"# Document {document_num}\n\n"
-        md_content += f"Pages: {pages_data[0][0] + 1}"
-        if len(pages_data) > 1:
-            md_content += f" - {pages_data[-1][0] + 1}"
-        md_content += f" ({len(pages_data)} page{'s' if len(pages_data) > 1 else ''})\n\n"
-        md_content += "---\n\n"
-
-        for page_num, result in pages_data:
-            md_content += f"## Page {page_num + 1}\n\n"
-            md_content += result + "\n\n"
-            md_content += "---\n\n"
-
-        return md_content
+        parts = [markdown_header(document_num, pages_data[0][0], pages_data[-1][0], len(pages_data))]
+        parts.extend(markdown_page(page_num, result) for page_num, result in pages_data)
+        return "".join(parts)
 
     def is_pdf_processed(self, pdf_path: Path) -> bool:
         """Check if PDF has already been processed"""
@@ -201,48 +245,22 @@ class NanonetsOCRProcessor:
         summary_file = pdf_output_dir / "_summary.json"
         return summary_file.exists()
 
-    def get_processed_pages(self, pdf_output_dir: Path) -> Set[int]:
-        """Extract which pages have already been processed from existing markdown files"""
-        processed_pages = set()
-
-        if not pdf_output_dir.exists():
-            return processed_pages
-
-        # Find all markdown files (except summary)
-        md_files = [f for f in pdf_output_dir.glob("*.md") if not f.name.startswith("_")]
-
-        for md_file in md_files:
-            try:
-                with open(md_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-                # Extract page numbers from "## Page N" markers
-                page_matches = re.findall(r'^## Page (\d+)', content, re.MULTILINE)
-                for match in page_matches:
-                    # Convert to 0-indexed
-                    processed_pages.add(int(match) - 1)
-
-            except Exception as e:
-                print(f"  Warning: Could not read {md_file.name}: {e}")
-
-        return processed_pages
-
-    def get_last_document_number(self, pdf_output_dir: Path) -> int:
-        """Find the highest document number already created"""
-        if not pdf_output_dir.exists():
-            return 0
-
-        md_files = [f for f in pdf_output_dir.glob("*.md") if not f.name.startswith("_")]
-
-        max_doc_num = 0
-        for md_file in md_files:
-            # Extract document number from filename like "name_doc05.md"
-            match = re.search(r'_doc(\d+)\.md$', md_file.name)
-            if match:
-                doc_num = int(match.group(1))
-                max_doc_num = max(max_doc_num, doc_num)
-
-        return max_doc_num
+    def load_progress(self, pdf_output_dir: Path, journal: PageJournal) -> List[Dict]:
+        """
+        Journal records of the pages already written to markdown documents
+        Output written before the journal existed is scanned once and journaled
+        """
+        if journal.exists():
+            # Documents left open by an interrupted run are finalized first
+            return recover_part_documents(pdf_output_dir, journal, journal.read())
+
+        records = scan_markdown_pages(pdf_output_dir)
+        if records:
+            print(f"  No {JOURNAL_NAME} yet, rebuilt it from {len({r['file'] for r in records})} markdown file(s)")
+            for record in records:
+                journal.append(record)
+            journal.sync()
+        return records
 
     def process_pdf(self, pdf_path: str, dpi: int = 150, ocr_timeout: int = 120) -> None:
         """Process a single PDF file with resume capability"""
@@ -254,94 +272,377 @@ class NanonetsOCRProcessor:
         pdf_output_dir = self.output_base_dir / pdf_path.stem
         pdf_output_dir.mkdir(exist_ok=True)
 
-        # Check for existing progress
-        processed_pages = self.get_processed_pages(pdf_output_dir)
-        document_num = self.get_last_document_number(pdf_output_dir) + 1
+        # Check for existing progress (one sequential read of the page journal)
+        journal = PageJournal(pdf_output_dir / JOURNAL_NAME)
+        progress = self.load_progress(pdf_output_dir, journal)
+        processed_pages = {record["page"] - 1 for record in progress}
+        document_num = max((record["doc"] for record in progress), default=0) + 1
 
         if processed_pages:
             print(f"  ⚡ Found existing progress: {len(processed_pages)} pages already processed")
             print(f"  ⚡ Resuming from document number {document_num}")
 
-        images = self.pdf_to_images(str(pdf_path), dpi=dpi)
+        # OCR cache counters for this PDF only
+        cache_start = self.engine.cache_stats()
 
-        current_document_pages = []
-        previous_result = None
-        skipped_pages = []  # Track pages that timed out
-
-        for page_num, image in enumerate(images):
-            # Skip already processed pages
-            if page_num in processed_pages:
-                print(f"\n✓ Skipping page {page_num + 1}/{len(images)} (already processed)")
-                del image
-                gc.collect()
-                continue
+        # Stage timings of this PDF, one JSON record per page in _metrics.jsonl
+        timings_start = self.engine.timer.snapshot()
+        metrics = PageMetricsLog(pdf_output_dir / "_metrics.jsonl", pdf_path.stem, live=self.metrics)
 
-            print(f"\nProcessing page {page_num + 1}/{len(images)}...")
+        num_pages = get_pdf_page_count(str(pdf_path))
+        self.index.mark_started(pdf_path.stem, num_pages)
+        print(f"PDF has {num_pages} pages")
+        self.metrics.start_pdf(pdf_path.stem, num_pages, pages_done=len(processed_pages))
 
-            try:
-                # Try OCR with timeout
-                with timeout_context(ocr_timeout):
-                    result = self.ocr_image(image)
-                    print(f"  Extracted {len(result)} characters")
-
-                is_new_doc = self.detect_document_boundary(result, previous_result)
-
-                if is_new_doc and current_document_pages:
-                    self.save_document(
-                        pdf_output_dir,
-                        current_document_pages,
-                        document_num,
-                        pdf_path.stem
-                    )
-                    document_num += 1
-                    current_document_pages = []
-
-                current_document_pages.append((page_num, result))
-                previous_result = result
-
-            except TimeoutException as e:
-                print(f"  ⏱️ TIMEOUT on page {page_num + 1}: OCR took longer than {ocr_timeout}s - SKIPPING page")
-                skipped_pages.append({
-                    "page": page_num + 1,
-                    "reason": f"OCR timeout after {ocr_timeout} seconds"
-                })
-                current_document_pages.append((page_num, f"[SKIPPED: OCR timeout after {ocr_timeout}s]"))
-
-            except Exception as e:
-                print(f"  ERROR on page {page_num + 1}: {e}")
-                current_document_pages.append((page_num, f"[ERROR: {e}]"))
+        # Only the pages left to do are rasterized, so a resume costs what remains
+        remaining_pages = [page_num for page_num in range(num_pages) if page_num not in processed_pages]
+        if processed_pages:
+            ranges = [f"{first}-{last}" if first != last else str(first)
+                      for first, last in page_chunks(remaining_pages, chunk_size=num_pages)]
+            print(f"  ⚡ Pages left: {len(remaining_pages)} ({', '.join(ranges) or 'none'})")
+        pages = prefetch_pages(
+            self.pdf_to_images(str(pdf_path), dpi=dpi, num_pages=num_pages, pages=remaining_pages),
+            depth=self.prefetch_depth,
+            transform=self.engine.prepare_image
+        )
 
-            del image
+        document = None  # Document being written, one page section at a time
+        previous_result = None
+        budget = self.page_budget(ocr_timeout)
+        # Track pages that timed out, including those of the interrupted run
+        skipped_pages = []
+        for record in progress:
+            if record["status"] == "timeout":
+                entry = {"page": record["page"], "reason": record["reason"]}
+                if record.get("truncated"):
+                    entry.update({"truncated": True, "partial_chars": record["chars"]})
+                skipped_pages.append(entry)
+        # Pages whose output looped and was cut early, to be checked or redone differently
+        repetition_pages = [record["page"] for record in progress if record.get("stop") == "repetition"]
+        blank_pages = [record["page"] for record in progress if record.get("stop") == "blank"]
+
+        for batch in iter_batches(pages, self.engine.batch_size):
+            for page_num, _ in batch:
+                print(f"\nProcessing page {page_num + 1}/{num_pages}...")
+
+            with self.engine.timer.capture() as batch_stages:
+                outcomes = self.ocr_pages(batch, ocr_timeout)
+            images = dict(batch)
+
+            for page_num, result, error, details in outcomes:
+                page_stages = page_stage_times(images[page_num], batch_stages, len(batch))
+
+                with self.engine.timer.capture() as own_stages:
+                    if isinstance(error, OCRTimeout):
+                        partial = error.partial[0]
+                        self.print_timeout(page_num, error.timeout_s, partial)
+                        skipped_pages.append(skipped_page_entry(page_num + 1, error.timeout_s, partial))
+                        status, text = "timeout", timeout_page_text(error.timeout_s, partial)
+
+                    elif error is not None:
+                        print(f"  ERROR on page {page_num + 1}: {error}")
+                        status, text = "error", f"[ERROR: {error}]"
+
+                    elif details["stop"] == "blank":
+                        # Blank versos and separator sheets stay in the current document
+                        print(f"  ⬜ Blank page (ink {details['ink']:.3%}) - not OCR'd")
+                        status, text = "blank", ""
+                        blank_pages.append(page_num + 1)
+
+                    else:
+                        print(f"  Extracted {len(result)} characters")
+                        status, text = "ok", result
+                        if details["stop"] == "repetition":
+                            # Kept up to the cut, marked [TRUNCATED] and listed for the retry
+                            print(f"  🔁 Page {page_num + 1} was looping: stopped early, marked as truncated")
+                            repetition_pages.append(page_num + 1)
+                            skipped_pages.append(repetition_page_entry(page_num + 1, result))
+                            status, text = "repetition", repetition_page_text(result)
+                        else:
+                            self.observe_page(budget, details, result, page_stages)
+
+                        # Check if this page starts a new document
+                        with self.engine.timer.stage("boundary"):
+                            is_new_doc = self.detect_document_boundary(result, previous_result)
+
+                        if is_new_doc and document is not None:
+                            self.save_document(document)
+                            document_num += 1
+                            document = None
+                        previous_result = result
+
+                    # The page is on disk (and journaled) before the next one is OCR'd
+                    if document is None:
+                        document = self.open_document(pdf_output_dir, document_num, pdf_path.stem, journal)
+                    with self.engine.timer.stage("write"):
+                        document.add_page(page_num, text,
+                                          {"stop": details["stop"]} if details["stop"] in ("repetition", "blank") else None)
+
+                page_stages.update(own_stages)
+                metrics.record_page(page_num, page_stages, status=status,
+                                    chars=len(result or ""), extra=details)
+
+            del batch
             gc.collect()
 
-        if current_document_pages:
-            self.save_document(
-                pdf_output_dir,
-                current_document_pages,
-                document_num,
-                pdf_path.stem
-            )
+        if document is not None:
+            self.save_document(document)
+        elif document_num > 1:
+            # Every page had been written before the interruption: no new document
+            document_num -= 1
+        journal.close()
+
+        cache_stats = None
+        if self.engine.cache:
+            cache_end = self.engine.cache_stats()
+            cache_stats = {key: cache_end[key] - cache_start[key] for key in cache_end}
+        timings = {
+            "stages_s": self.engine.timer.totals_since(timings_start),
+            "page_latency": metrics.latency_summary(),
+        }
+        metrics.close()
+        budget.save()
+        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, num_pages, skipped_pages,
+                          cache_stats, timings, budget.summary() if budget.adaptive else None,
+                          sorted(repetition_pages), sorted(blank_pages))
+        self.metrics.pdf_done()
+
+        print(f"\nCompleted! Found {document_num} document(s) in {num_pages} pages")
+        timeouts = [entry for entry in skipped_pages if entry["reason"] != REPETITION_REASON]
+        if timeouts:
+            truncated = sum(1 for entry in timeouts if entry.get("truncated"))
+            print(f"  ⚠️ Skipped {len(timeouts)} page(s) due to timeout"
+                  f"{f' ({truncated} with partial text kept)' if truncated else ''}")
+        if repetition_pages:
+            print(f"  🔁 {len(repetition_pages)} page(s) stopped early on a repetition loop (to retry)")
+        if blank_pages:
+            print(f"  ⬜ {len(blank_pages)} blank page(s) not OCR'd")
+        print(f"Output saved to: {pdf_output_dir}")
+
+    def process_queue(self, input_dir: str, queue_dir: str, dpi: int = 150, ocr_timeout: int = 120,
+                      lease_ttl: int = LEASE_TTL_S, poll_interval: int = 30) -> None:
+        """
+        Drain the PDFs of input_dir page by page together with other workers,
+        possibly on other hosts sharing the output and queue directories
+        Pages are leased from the queue; whoever stores the last page result
+        of a PDF assembles its documents and _summary.json
+        """
+        lease_queue = LeaseQueue(queue_dir, ttl_s=lease_ttl)
+        lease_queue.start_heartbeat(period_s=max(1, lease_ttl // 10))
+        print(f"Work queue: {lease_queue.queue_dir} (worker {lease_queue.worker_name})")
+
+        try:
+            while True:
+                remaining = [pdf for pdf in sorted(Path(input_dir).glob("*.pdf"))
+                             if not self.is_pdf_processed(pdf)]
+                if not remaining:
+                    break
+
+                worked = False
+                for pdf_path in remaining:
+                    num_pages = lease_queue.registered_pages(pdf_path.stem)
+                    if num_pages is None:
+                        num_pages = get_pdf_page_count(str(pdf_path))
+                        lease_queue.register_pdf(pdf_path.stem, num_pages)
+
+                    claimed = lease_queue.claim_pages(pdf_path.stem, num_pages, self.engine.batch_size)
+                    if claimed:
+                        self.ocr_leased_pages(pdf_path, claimed, num_pages, lease_queue, dpi, ocr_timeout)
+                        worked = True
+                        break
+
+                    if lease_queue.pages_done(pdf_path.stem) >= num_pages:
+                        if lease_queue.try_acquire(pdf_path.stem, "assemble"):
+                            try:
+                                if not self.is_pdf_processed(pdf_path):
+                                    self.assemble_from_queue(pdf_path, num_pages, lease_queue)
+                            finally:
+                                lease_queue.release(pdf_path.stem, "assemble")
+                            worked = True
+                            break
+
+                if not worked:
+                    # Every open page is leased by another worker: wait for it
+                    # to finish, or for its lease to expire
+                    print(f"\nWaiting for pages leased by other workers ({len(remaining)} PDF(s) open)...")
+                    time.sleep(poll_interval)
+        finally:
+            lease_queue.stop()
+
+        print("\nWork queue drained: every PDF has a _summary.json")
+
+    def ocr_leased_pages(self, pdf_path: Path, page_nums: List[int], num_pages: int,
+                         lease_queue: LeaseQueue, dpi: int, ocr_timeout: int) -> None:
+        """OCR pages leased from the queue and store each result there"""
+        self.metrics.start_pdf(pdf_path.stem, num_pages, pages_done=lease_queue.pages_done(pdf_path.stem))
+        print(f"\n{pdf_path.name}: leased page(s) {', '.join(str(page_num + 1) for page_num in page_nums)}")
+
+        batch = [
+            (page_num, self.engine.prepare_image(image))
+            for page_num, image in iter_pdf_pages(str(pdf_path), dpi=dpi, timer=self.engine.timer,
+                                                  pages=page_nums)
+        ]
+        for page_num, _ in batch:
+            print(f"\nProcessing page {page_num + 1}/{num_pages}...")
+
+        with self.engine.timer.capture() as batch_stages:
+            outcomes = self.ocr_pages(batch, ocr_timeout)
+        images = dict(batch)
+
+        budget = self.page_budget(ocr_timeout)
+        for page_num, result, error, details in outcomes:
+            page_stages = page_stage_times(images[page_num], batch_stages, len(batch))
+
+            partial = None
+            if isinstance(error, OCRTimeout):
+                partial = error.partial[0]
+                self.print_timeout(page_num, error.timeout_s, partial)
+                status = "timeout"
+            elif error is not None:
+                print(f"  ERROR on page {page_num + 1}: {error}")
+                status = "error"
+            elif details["stop"] == "blank":
+                print(f"  ⬜ Blank page (ink {details['ink']:.3%}) - not OCR'd")
+                status = "blank"
+            else:
+                print(f"  Extracted {len(result)} characters")
+                status = "ok"
+                if details["stop"] == "repetition":
+                    print(f"  🔁 Page {page_num + 1} was looping: stopped early, marked as truncated")
+                    status = "repetition"
+                else:
+                    self.observe_page(budget, details, result, page_stages)
+
+            record = page_record(pdf_path.stem, page_num, page_stages, status, len(result or ""), details)
+            record.update({
+                "text": result,
+                "error": str(error) if error is not None else None,
+                "partial": partial,
+                "ocr_timeout": error.timeout_s if isinstance(error, OCRTimeout) else ocr_timeout,
+                "worker": lease_queue.worker_name,
+            })
+            lease_queue.complete_page(pdf_path.stem, page_num, record)
+            self.metrics.page_done(status, record["latency_s"])
+        budget.save()
+
+        del batch
+        gc.collect()
+
+    def assemble_from_queue(self, pdf_path: Path, num_pages: int, lease_queue: LeaseQueue) -> None:
+        """Build the documents and _summary.json of a PDF from its page results in the queue"""
+        pdf_output_dir = self.output_base_dir / pdf_path.stem
+        pdf_output_dir.mkdir(exist_ok=True)
+        print(f"\nAssembling {pdf_path.name} from {num_pages} page results")
 
-        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, len(images), skipped_pages)
+        timings_start = self.engine.timer.snapshot()
+        records = lease_queue.page_results(pdf_path.stem, num_pages)
 
-        print(f"\nCompleted! Found {document_num} document(s) in {len(images)} pages")
-        if skipped_pages:
-            print(f"  ⚠️ Skipped {len(skipped_pages)} page(s) due to timeout")
+        # Every page is rewritten from the queue: a re-run after a crash mid-assembly
+        # starts over instead of appending duplicate records to the journal
+        for pattern in (JOURNAL_NAME, f"{pdf_path.stem}_doc*.md*", ".*.md.tmp"):
+            for stale_path in pdf_output_dir.glob(pattern):
+                stale_path.unlink()
+        journal = PageJournal(pdf_output_dir / JOURNAL_NAME)
+
+        document = None
+        document_num = 1
+        previous_result = None
+        skipped_pages = []
+        repetition_pages = []
+        blank_pages = []
+        stage_totals = {}
+
+        with open(pdf_output_dir / "_metrics.jsonl", 'w', encoding='utf-8') as metrics_file:
+            for record in records:
+                page_num = record["page"] - 1
+                metrics_file.write(json.dumps(
+                    {key: value for key, value in record.items()
+                     if key not in ("text", "error", "partial", "ocr_timeout")}
+                ) + "\n")
+                for stage, seconds in record["stages"].items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+                if record["status"] == "timeout":
+                    partial = record.get("partial")
+                    skipped_pages.append(skipped_page_entry(page_num + 1, record["ocr_timeout"], partial))
+                    text = timeout_page_text(record["ocr_timeout"], partial)
+                elif record["status"] == "error":
+                    text = f"[ERROR: {record['error']}]"
+                elif record["status"] == "blank":
+                    text = ""
+                    blank_pages.append(page_num + 1)
+                else:
+                    text = record["text"]
+                    with self.engine.timer.stage("boundary"):
+                        is_new_doc = self.detect_document_boundary(text, previous_result)
+
+                    if is_new_doc and document is not None:
+                        self.save_document(document)
+                        document_num += 1
+                        document = None
+                    previous_result = text
+                    if record.get("stop") == "repetition":
+                        repetition_pages.append(page_num + 1)
+                        skipped_pages.append(repetition_page_entry(page_num + 1, text))
+                        text = repetition_page_text(text)
+
+                if document is None:
+                    document = self.open_document(pdf_output_dir, document_num, pdf_path.stem, journal)
+                with self.engine.timer.stage("write"):
+                    document.add_page(page_num, text,
+                                      {"stop": record["stop"]} if record.get("stop") in ("repetition", "blank") else None)
+
+        if document is not None:
+            self.save_document(document)
+        journal.close()
+
+        # OCR stages come from the workers' records, boundary and write from this assembly
+        for stage, seconds in self.engine.timer.totals_since(timings_start).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+        timings = {
+            "stages_s": {stage: round(seconds, 4) for stage, seconds in stage_totals.items()},
+            "page_latency": latency_histogram([record["latency_s"] for record in records]),
+        }
+        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, num_pages, skipped_pages,
+                          None, timings, repetition_pages=repetition_pages, blank_pages=blank_pages)
+        self.metrics.pdf_done()
+
+        print(f"Completed! Found {document_num} document(s) in {num_pages} pages")
+        timeouts = [entry for entry in skipped_pages if entry["reason"] != REPETITION_REASON]
+        if timeouts:
+            truncated = sum(1 for entry in timeouts if entry.get("truncated"))
+            print(f"  ⚠️ Skipped {len(timeouts)} page(s) due to timeout"
+                  f"{f' ({truncated} with partial text kept)' if truncated else ''}")
+        if repetition_pages:
+            print(f"  🔁 {len(repetition_pages)} page(s) stopped early on a repetition loop (to retry)")
+        if blank_pages:
+            print(f"  ⬜ {len(blank_pages)} blank page(s) not OCR'd")
         print(f"Output saved to: {pdf_output_dir}")
 
-    def save_document(self, output_dir: Path, pages_data: List[Tuple[int, str]],
-                     doc_num: int, pdf_name: str) -> None:
-        """Save a single document as markdown"""
-        md_content = self.format_as_markdown(pages_data, doc_num)
-        output_file = output_dir / f"{pdf_name}_doc{doc_num:02d}.md"
+    def print_timeout(self, page_num: int, ocr_timeout: float, partial: str = None) -> None:
+        if partial and partial.strip():
+            print(f"  ⏱️ TIMEOUT on page {page_num + 1}: OCR took longer than {ocr_timeout:g}s - "
+                  f"keeping {len(partial)} characters generated before the cut")
+        else:
+            print(f"  ⏱️ TIMEOUT on page {page_num + 1}: OCR took longer than {ocr_timeout:g}s - SKIPPING page")
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(md_content)
+    def open_document(self, output_dir: Path, doc_num: int, pdf_name: str,
+                      journal: PageJournal = None) -> DocumentWriter:
+        """Start a markdown document, written page by page"""
+        return DocumentWriter(output_dir / f"{pdf_name}_doc{doc_num:02d}.md", doc_num, journal)
 
-        print(f"  → Saved document {doc_num} ({len(pages_data)} pages) to {output_file.name}")
+    def save_document(self, document: DocumentWriter) -> None:
+        """Close a document: header with its page range, then atomic rename to .md"""
+        with self.engine.timer.stage("write", count=0):
+            output_file = document.close()
+
+        num_pages = len(document.pages)
+        print(f"  → Saved document {document.doc_num} ({num_pages} pages) to {output_file.name}")
 
     def save_summary(self, output_dir: Path, pdf_name: str,
-                    num_docs: int, num_pages: int, skipped_pages: List[Dict] = None) -> None:
+                    num_docs: int, num_pages: int, skipped_pages: List[Dict] = None,
+                    cache_stats: Dict = None, timings: Dict = None, budget: Dict = None,
+                    repetition_pages: List[int] = None, blank_pages: List[int] = None) -> None:
         """Save processing summary"""
         summary = {
             "pdf_name": pdf_name,
@@ -353,8 +654,24 @@ class NanonetsOCRProcessor:
         if skipped_pages:
             summary["skipped_pages"] = skipped_pages
 
+        if repetition_pages:
+            summary["repetition_pages"] = repetition_pages
+
+        if blank_pages:
+            summary["blank_pages"] = {"count": len(blank_pages), "pages": blank_pages}
+
+        if cache_stats is not None:
+            summary["ocr_cache"] = cache_stats
+
+        if timings is not None:
+            summary["timings"] = timings
+
+        if budget is not None:
+            summary["page_budget"] = budget
+
         with open(output_dir / "_summary.json", 'w') as f:
             json.dump(summary, f, indent=2)
+        self.index.record_summary(output_dir, summary)
 
     def process_directory(self, input_dir: str, ocr_timeout: int = 120) -> None:
         """Process all PDFs in a directory with pause capability"""
@@ -363,11 +680,13 @@ class NanonetsOCRProcessor:
 
         print(f"Found {len(pdf_files)} PDF files")
 
-        # Check which ones are already processed
+        # Check which ones are already processed (corpus index, no summary reads)
+        self.index.sync()
+        processed = self.index.processed()
         remaining_pdfs = []
         processed_count = 0
         for pdf_file in pdf_files:
-            if self.is_pdf_processed(pdf_file):
+            if pdf_file.stem in processed:
                 print(f"  ✓ Already processed: {pdf_file.name}")
                 processed_count += 1
             else:
@@ -375,6 +694,7 @@ class NanonetsOCRProcessor:
 
         if processed_count > 0:
             print(f"\n{processed_count} PDFs already processed, skipping them.")
+        self.metrics.start_run(len(pdf_files), processed_count)
 
         if not remaining_pdfs:
             print("All PDFs are already processed!")
@@ -393,9 +713,7 @@ class NanonetsOCRProcessor:
                 print(f"ERROR processing {pdf_file.name}: {e}")
                 continue
 
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            gc.collect()
+            self.engine.release_memory()
 
             # PAUSE after each PDF if requested
             if self.pause_after_each and i < len(remaining_pdfs):
@@ -434,18 +752,82 @@ def main():
                        help="Pause after each PDF with option to continue or exit")
     parser.add_argument("--ocr-timeout", type=int, default=120,
                        help="Timeout in seconds for OCR per page (default: 120s)")
+    parser.add_argument("--adaptive-budget", action="store_true",
+                       help="Set each page's timeout and max_new_tokens from its ink density and text lines, "
+                            "learned from the pages already done")
+    parser.add_argument("--max-ocr-timeout", type=int, default=300,
+                       help="Upper bound of an adaptive page timeout in seconds (default: 300s)")
+    parser.add_argument("--blank-threshold", type=float, default=DEFAULT_BLANK_THRESHOLD,
+                       help=f"Pages with a lower ratio of dark pixels are blank and not OCR'd "
+                            f"(default: 0 = OCR every page; e.g. {SUGGESTED_BLANK_THRESHOLD} = 0.1%%)")
+    parser.add_argument("--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                       help=f"Pages rendered ahead of OCR in background (default: {DEFAULT_PREFETCH_DEPTH}, 0 = off)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                       help=f"Serve live metrics on http://127.0.0.1:PORT/metrics (default: off, usual: {DEFAULT_METRICS_PORT})")
+    parser.add_argument("--queue-dir", type=str, default=None,
+                       help="Share the work page by page with other workers/hosts through lease files "
+                            "in this directory (e.g. ../data/output/ocr_queue on a shared mount)")
+    parser.add_argument("--lease-ttl", type=int, default=LEASE_TTL_S,
+                       help=f"Seconds after which a page leased by a silent worker is taken over (default: {LEASE_TTL_S})")
+    add_engine_arguments(parser)
+    add_worker_arguments(parser)
 
     args = parser.parse_args()
-
-    Path("offload").mkdir(exist_ok=True)
+    queue_kwargs = {"queue_dir": args.queue_dir, "dpi": args.dpi, "ocr_timeout": args.ocr_timeout,
+                    "lease_ttl": args.lease_ttl}
+
+    if args.workers > 1 and not args.single_pdf:
+        # One model per worker process, this process only hands out PDFs
+        # (already processed PDFs are skipped, like process_directory does)
+        all_pdfs = pending_pdfs(args.input_dir, args.output_dir, skip_processed=False)
+        pdf_files = pending_pdfs(args.input_dir, args.output_dir)
+        print(f"Found {len(all_pdfs)} PDF files, {len(pdf_files)} remaining, {args.workers} workers")
+
+        metrics = PipelineMetrics()
+        metrics.start_run(len(all_pdfs), len(all_pdfs) - len(pdf_files))
+        if args.metrics_port:
+            MetricsServer(metrics, port=args.metrics_port).start()
+
+        if args.queue_dir:
+            # Every worker drains the shared page queue until all PDFs are assembled
+            tasks, method, process_kwargs = [args.input_dir] * args.workers, "process_queue", queue_kwargs
+        else:
+            tasks, method, process_kwargs = pdf_files, "process_pdf", {"dpi": args.dpi, "ocr_timeout": args.ocr_timeout}
+
+        run_worker_pool(
+            "ocr_nanonets_pausable",
+            tasks,
+            args,
+            args.workers,
+            engine_options={"max_dimension": 1400, "offload": True},
+            processor_kwargs={"output_base_dir": args.output_dir, "prefetch_depth": args.prefetch_depth,
+                              "adaptive_budget": args.adaptive_budget, "max_ocr_timeout": args.max_ocr_timeout,
+                              "blank_threshold": args.blank_threshold},
+            method=method,
+            process_kwargs=process_kwargs,
+            devices=args.devices,
+            threads_per_worker=args.threads_per_worker,
+            metrics=metrics
+        )
+        return
 
     processor = NanonetsOCRProcessor(
         output_base_dir=args.output_dir,
-        pause_after_each=args.pause_after_each
+        pause_after_each=args.pause_after_each,
+        prefetch_depth=args.prefetch_depth,
+        adaptive_budget=args.adaptive_budget,
+        max_ocr_timeout=args.max_ocr_timeout,
+        blank_threshold=args.blank_threshold,
+        engine=engine_from_args(args, max_dimension=1400, offload=True)
     )
 
+    if args.metrics_port:
+        MetricsServer(processor.metrics, port=args.metrics_port).start()
+
     if args.single_pdf:
         processor.process_pdf(args.single_pdf, dpi=args.dpi, ocr_timeout=args.ocr_timeout)
+    elif args.queue_dir:
+        processor.process_queue(args.input_dir, **queue_kwargs)
     else:
         processor.process_directory(args.input_dir, ocr_timeout=args.ocr_timeout)
 
@@ -4,142 +4,56 @@ OCR processor for historical PDF documents using Nanonets-OCR2-3B
 Optimized for 8GB GPU memory
 """
 
-import os
 import json
-import torch
 from pathlib import Path
-from pdf2image import convert_from_path
 from PIL import Image
-from transformers import AutoModelForImageTextToText, AutoTokenizer, AutoProcessor
 import gc
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
 import re
-import tempfile
+
+from page_source import iter_pdf_pages, get_pdf_page_count, prefetch_pages, iter_batches, DEFAULT_PREFETCH_DEPTH
+from ocr_engine import OCREngine, TransformersBackend, add_engine_arguments, engine_from_args
+from metrics import PageMetricsLog, page_stage_times
+from document_writer import markdown_header, markdown_page
+from corpus_index import CorpusIndex
+from worker_pool import add_worker_arguments, pending_pdfs, run_worker_pool
 
 
 class NanonetsOCRProcessor:
-    def __init__(self, output_base_dir: str = "../data/output/ocr_results", device: str = None):
-        """Initialize the OCR processor with Nanonets model"""
+    def __init__(self, output_base_dir: str = "../data/output/ocr_results",
+                 prefetch_depth: int = DEFAULT_PREFETCH_DEPTH, engine: OCREngine = None):
+        """Initialize the OCR processor (Nanonets model unless another engine is given)"""
         self.output_base_dir = Path(output_base_dir)
         self.output_base_dir.mkdir(exist_ok=True)
+        self.prefetch_depth = prefetch_depth
 
-        # Auto-detect device
-        if device is None:
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        else:
-            self.device = device
-
-        print(f"Using device: {self.device}")
-
-        # Load model with memory optimization for 8GB GPU
-        print("Loading Nanonets-OCR2-3B model (FP16 optimized)...")
-        model_path = 'nanonets/Nanonets-OCR2-3B'
-
-        # Use FP16 and aggressive memory management
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            device_map="auto" if self.device == "cuda" else self.device,
-            low_cpu_mem_usage=True,
-        )
-
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.processor = AutoProcessor.from_pretrained(model_path)
+        # Corpus-wide status of the output, updated with every _summary.json
+        self.index = CorpusIndex(self.output_base_dir)
 
-        self.model.eval()  # Set to evaluation mode
+        # Model, page preparation, result cache and batching live in the shared engine
+        if engine is None:
+            # FP16 on GPU, pages resized to 1600px (reduce if still running out of memory)
+            engine = OCREngine(TransformersBackend(), max_dimension=1600)
+        self.engine = engine
 
-        # Enable memory efficient inference
-        if self.device == "cuda":
-            torch.cuda.empty_cache()
-
-        print("Model loaded successfully!")
+        print(f"Output directory: {self.output_base_dir}")
 
-    def pdf_to_images(self, pdf_path: str, dpi: int = 150) -> List[Image.Image]:
-        """Convert PDF to images with memory efficiency"""
+    def pdf_to_images(self, pdf_path: str, dpi: int = 150,
+                      num_pages: int = None) -> Iterator[Tuple[int, Image.Image]]:
+        """Lazily convert PDF pages to images, a few pages at a time"""
         print(f"Converting PDF to images: {pdf_path}")
 
-        # Convert PDF to images
+        # Pages are rendered in small chunks as the OCR loop consumes them
         # Using lower DPI to save memory, can increase if needed
-        images = convert_from_path(pdf_path, dpi=dpi)
-        print(f"Converted {len(images)} pages")
-
-        return images
+        return iter_pdf_pages(pdf_path, dpi=dpi, num_pages=num_pages, timer=self.engine.timer)
 
     def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048) -> str:
         """Perform OCR on a single image"""
-        with torch.no_grad():
-            # Resize large images to save memory
-            max_dimension = 1600  # Reduce if still running out of memory
-            if max(image.size) > max_dimension:
-                ratio = max_dimension / max(image.size)
-                new_size = tuple(int(dim * ratio) for dim in image.size)
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-
-            # Save image temporarily for processing
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                image.save(tmp_path)
+        return self.engine.ocr_image(image, max_new_tokens=max_new_tokens)
 
-            try:
-                # Prepare the prompt and messages
-                prompt = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format if present. Return the equations in LaTeX representation if present."""
-
-                messages = [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": [
-                        {"type": "image", "image": f"file://{tmp_path}"},
-                        {"type": "text", "text": prompt},
-                    ]},
-                ]
-
-                # Apply chat template
-                text = self.processor.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-
-                # Process inputs
-                inputs = self.processor(
-                    text=[text],
-                    images=[image],
-                    padding=True,
-                    return_tensors="pt"
-                )
-                inputs = inputs.to(self.model.device)
-
-                # Generate OCR output
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    do_sample=False
-                )
-
-                # Decode output
-                generated_ids = [
-                    output_ids[len(input_ids):]
-                    for input_ids, output_ids in zip(inputs.input_ids, output_ids)
-                ]
-
-                output_text = self.processor.batch_decode(
-                    generated_ids,
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True
-                )
-
-                result = output_text[0]
-
-            finally:
-                # Clean up temp file
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
-
-            # Clear GPU cache after each image
-            if self.device == "cuda":
-                torch.cuda.empty_cache()
-
-            return result
+    def ocr_batch(self, images: List[Image.Image], max_new_tokens: int = 2048) -> List[str]:
+        """Perform OCR on several images in one generate call, one result per image"""
+        return self.engine.ocr_batch(images, max_new_tokens=max_new_tokens)
 
     def detect_document_boundary(self, current_result: str, previous_result: str = None) -> bool:
         """
@@ -190,20 +104,9 @@ class NanonetsOCRProcessor:
 
     def format_as_markdown(self, pages_data: List[Tuple[int, str]], document_num: int) -> str:
         """Format OCR results as markdown"""
-        md_content = f"# Document {document_num}\n\n"
-        md_content += f"Pages: {pages_data[0][0] + 1}"
-        if len(pages_data) > 1:
-            md_content += f" - {pages_data[-1][0] + 1}"
-        md_content += f" ({len(pages_data)} page{'s' if len(pages_data) > 1 else ''})\n\n"
-        md_content += "---\n\n"
-
-        for page_num, result in pages_data:
-            text = self.extract_text_from_result(result)
-            md_content += f"## Page {page_num + 1}\n\n"
-            md_content += text + "\n\n"
-            md_content += "---\n\n"
-
-        return md_content
+        parts = [markdown_header(document_num, pages_data[0][0], pages_data[-1][0], len(pages_data))]
+        parts.extend(markdown_page(page_num, self.extract_text_from_result(result)) for page_num, result in pages_data)
+        return "".join(parts)
 
     def process_pdf(self, pdf_path: str) -> None:
         """Process a single PDF file"""
@@ -216,8 +119,21 @@ class NanonetsOCRProcessor:
         pdf_output_dir = self.output_base_dir / pdf_path.stem
         pdf_output_dir.mkdir(exist_ok=True)
 
-        # Convert PDF to images
-        images = self.pdf_to_images(str(pdf_path))
+        # OCR cache counters for this PDF only
+        cache_start = self.engine.cache_stats()
+
+        # Stage timings of this PDF, one JSON record per page in _metrics.jsonl
+        timings_start = self.engine.timer.snapshot()
+        metrics = PageMetricsLog(pdf_output_dir / "_metrics.jsonl", pdf_path.stem)
+
+        num_pages = get_pdf_page_count(str(pdf_path))
+        print(f"PDF has {num_pages} pages")
+        # Stream PDF pages as images, rendered and resized ahead of the OCR loop
+        pages = prefetch_pages(
+            self.pdf_to_images(str(pdf_path), num_pages=num_pages),
+            depth=self.prefetch_depth,
+            transform=self.engine.prepare_image
+        )
 
         # Process pages and detect document boundaries
         all_results = []
@@ -225,32 +141,43 @@ class NanonetsOCRProcessor:
         document_num = 1
         previous_result = None
 
-        for page_num, image in enumerate(images):
-            print(f"Processing page {page_num + 1}/{len(images)}...")
+        for batch in iter_batches(pages, self.engine.batch_size):
+            page_nums = [page_num for page_num, _ in batch]
+            for page_num in page_nums:
+                print(f"Processing page {page_num + 1}/{num_pages}...")
 
             # Perform OCR
-            result = self.ocr_image(image)
-            all_results.append((page_num, result))
-
-            # Check if this page starts a new document
-            is_new_doc = self.detect_document_boundary(result, previous_result)
-
-            if is_new_doc and current_document_pages:
-                # Save previous document
-                self.save_document(
-                    pdf_output_dir,
-                    current_document_pages,
-                    document_num,
-                    pdf_path.stem
-                )
-                document_num += 1
-                current_document_pages = []
-
-            current_document_pages.append((page_num, result))
-            previous_result = result
+            with self.engine.timer.capture() as batch_stages:
+                results = self.ocr_batch([image for _, image in batch])
+
+            for (page_num, image), result in zip(batch, results):
+                all_results.append((page_num, result))
+                page_stages = page_stage_times(image, batch_stages, len(batch))
+
+                with self.engine.timer.capture() as own_stages:
+                    # Check if this page starts a new document
+                    with self.engine.timer.stage("boundary"):
+                        is_new_doc = self.detect_document_boundary(result, previous_result)
+
+                    if is_new_doc and current_document_pages:
+                        # Save previous document
+                        self.save_document(
+                            pdf_output_dir,
+                            current_document_pages,
+                            document_num,
+                            pdf_path.stem
+                        )
+                        document_num += 1
+                        current_document_pages = []
+
+                page_stages.update(own_stages)
+                metrics.record_page(page_num, page_stages, chars=len(result))
+
+                current_document_pages.append((page_num, result))
+                previous_result = result
 
             # Clear memory
-            del image
+            del batch
             gc.collect()
 
         # Save the last document
@@ -263,24 +190,35 @@ class NanonetsOCRProcessor:
             )
 
         # Save summary
-        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, len(images))
+        cache_stats = None
+        if self.engine.cache:
+            cache_end = self.engine.cache_stats()
+            cache_stats = {key: cache_end[key] - cache_start[key] for key in cache_end}
+        timings = {
+            "stages_s": self.engine.timer.totals_since(timings_start),
+            "page_latency": metrics.latency_summary(),
+        }
+        metrics.close()
+        self.save_summary(pdf_output_dir, pdf_path.stem, document_num, num_pages, cache_stats, timings)
 
-        print(f"\nCompleted! Found {document_num} document(s) in {len(images)} pages")
+        print(f"\nCompleted! Found {document_num} document(s) in {num_pages} pages")
         print(f"Output saved to: {pdf_output_dir}")
 
     def save_document(self, output_dir: Path, pages_data: List[Tuple[int, str]],
                      doc_num: int, pdf_name: str) -> None:
         """Save a single document as markdown"""
-        md_content = self.format_as_markdown(pages_data, doc_num)
+        with self.engine.timer.stage("write", count=len(pages_data)):
+            md_content = self.format_as_markdown(pages_data, doc_num)
 
-        output_file = output_dir / f"{pdf_name}_doc{doc_num:02d}.md"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(md_content)
+            output_file = output_dir / f"{pdf_name}_doc{doc_num:02d}.md"
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(md_content)
 
         print(f"  → Saved document {doc_num} ({len(pages_data)} pages) to {output_file.name}")
 
     def save_summary(self, output_dir: Path, pdf_name: str,
-                    num_docs: int, num_pages: int) -> None:
+                    num_docs: int, num_pages: int, cache_stats: Dict = None,
+                    timings: Dict = None) -> None:
         """Save processing summary"""
         summary = {
             "pdf_name": pdf_name,
@@ -289,9 +227,16 @@ class NanonetsOCRProcessor:
             "output_directory": str(output_dir)
         }
 
+        if cache_stats is not None:
+            summary["ocr_cache"] = cache_stats
+
+        if timings is not None:
+            summary["timings"] = timings
+
         summary_file = output_dir / "_summary.json"
         with open(summary_file, 'w', encoding='utf-8') as f:
             json.dump(summary, f, indent=2)
+        self.index.record_summary(output_dir, summary)
 
     def process_directory(self, input_dir: str, pattern: str = "*.pdf") -> None:
         """Process all PDFs in a directory"""
@@ -309,9 +254,7 @@ class NanonetsOCRProcessor:
                 continue
 
             # Clear GPU memory between PDFs
-            if self.device == "cuda":
-                torch.cuda.empty_cache()
-                gc.collect()
+            self.engine.release_memory()
 
         print(f"\n{'='*60}")
         print(f"All processing complete! Processed {len(pdf_files)} PDFs")
@@ -332,11 +275,35 @@ def main():
                        help="DPI for PDF to image conversion (default: 150, lower = less memory)")
     parser.add_argument("--single-pdf", type=str, default=None,
                        help="Process a single PDF file instead of directory")
+    parser.add_argument("--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                       help=f"Pages rendered ahead of OCR in background (default: {DEFAULT_PREFETCH_DEPTH}, 0 = off)")
+    add_engine_arguments(parser)
+    add_worker_arguments(parser)
 
     args = parser.parse_args()
 
+    if args.workers > 1 and not args.single_pdf:
+        # One model per worker process, this process only hands out PDFs
+        pdf_files = pending_pdfs(args.input_dir, args.output_dir, skip_processed=False)
+        print(f"Found {len(pdf_files)} PDF files, {args.workers} workers")
+        run_worker_pool(
+            "ocr_processor",
+            pdf_files,
+            args,
+            args.workers,
+            engine_options={"max_dimension": 1600, "offload": False},
+            processor_kwargs={"output_base_dir": args.output_dir, "prefetch_depth": args.prefetch_depth},
+            devices=args.devices,
+            threads_per_worker=args.threads_per_worker
+        )
+        return
+
     # Initialize processor
-    processor = NanonetsOCRProcessor(output_base_dir=args.output_dir)
+    processor = NanonetsOCRProcessor(
+        output_base_dir=args.output_dir,
+        prefetch_depth=args.prefetch_depth,
+        engine=engine_from_args(args, max_dimension=1600, offload=False)
+    )
 
     # Process PDFs
     if args.single_pdf:
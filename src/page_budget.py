@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Adaptive per-page OCR budget: timeout and max_new_tokens
+- Cheap features of the prepared page image: ink density and an estimate of
+  the number of text lines (row projection of a downscaled grayscale copy)
+- Learns from completed pages how many characters a text line yields in this
+  corpus and how long generating a character takes (_budget_stats.json in the
+  output folder, so later runs start warm)
+- Dense pages get more time than --ocr-timeout (up to --max-ocr-timeout),
+  sparse and blank pages fewer tokens; until enough pages are observed the
+  fixed defaults apply
+"""
+
+import json
+import math
+import os
+from collections import deque
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+
+DEFAULT_MAX_NEW_TOKENS = 2048
+BUDGET_STATS_NAME = "_budget_stats.json"
+
+# Markdown OCR output averages 3.5-4 characters per token: stay on the safe side
+CHARS_PER_TOKEN = 3.0
+
+# Learned rates are a high quantile of the observed ones, times a safety margin
+MIN_OBSERVATIONS = 8
+HISTORY_SIZE = 500
+QUANTILE = 0.9
+MARGIN = 1.5
+
+# Pages with (almost) no ink only get a few tokens: enough for a page number
+# or a stamp, not for a repetition loop
+BLANK_INK = 0.002
+BLANK_MAX_NEW_TOKENS = 128
+MIN_MAX_NEW_TOKENS = 256
+MIN_TIMEOUT_S = 30
+
+# Pages with fewer dark pixels than the blank threshold (scanner margins
+# excluded) are blank. Off by default: a page holding only a faint line, a page
+# number or a light stamp can fall under it and would get no OCR at all
+DEFAULT_BLANK_THRESHOLD = 0.0
+SUGGESTED_BLANK_THRESHOLD = 0.001
+BLANK_MARGIN = 0.05
+
+
+def ink_ratio(image: Image.Image, margin: float = BLANK_MARGIN) -> float:
+    """
+    Fraction of dark pixels of a page, without its outer margins (scanner
+    shadows and punch holes); a half-size grayscale histogram, a few ms per page
+    """
+    gray = image.convert("L")
+    if min(gray.size) >= 4:
+        gray = gray.reduce(2)
+    width, height = gray.size
+    dx, dy = int(width * margin), int(height * margin)
+    gray = gray.crop((dx, dy, width - dx, height - dy))
+    histogram = gray.histogram()
+    return sum(histogram[:128]) / max(1, sum(histogram))
+
+
+def page_features(image: Image.Image) -> Dict:
+    """
+    Ink density (fraction of dark pixels) and estimated text line count of a page
+    Computed on a half-size grayscale copy: a few milliseconds per page
+    """
+    gray = image.convert("L")
+    if min(gray.size) >= 4:
+        gray = gray.reduce(2)
+    width, height = gray.size
+
+    dark = gray.point(lambda value: 255 if value < 128 else 0)
+    ink = dark.histogram()[255] / (width * height)
+
+    # Averaging each row (BOX resampling to a single column) gives its ink
+    # profile; text lines are runs of inked rows separated by blank ones
+    rows = [value / 255 for value in dark.resize((1, height), Image.BOX).getdata()]
+    threshold = max(0.01, 0.15 * max(rows, default=0))
+    lines = 0
+    run = 0
+    for value in rows + [0.0]:
+        if value > threshold:
+            run += 1
+            continue
+        if run >= 2:
+            lines += 1
+        run = 0
+
+    return {"ink": round(ink, 4), "lines": lines}
+
+
+def quantile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class PageBudget:
+    def __init__(self, ocr_timeout: float, max_timeout: float = None,
+                 max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS, adaptive: bool = True,
+                 stats_path: Path = None):
+        """
+        ocr_timeout: timeout of a page while nothing is learned (and when not adaptive)
+        max_timeout: upper bound of an adaptive timeout (default: ocr_timeout)
+        max_new_tokens: upper bound of the token budget
+        stats_path: JSON file the observations are loaded from and saved to
+        """
+        self.ocr_timeout = ocr_timeout
+        self.max_timeout = max(max_timeout or ocr_timeout, ocr_timeout)
+        self.max_new_tokens = max_new_tokens
+        self.adaptive = adaptive
+        self.stats_path = Path(stats_path) if stats_path else None
+        # (text lines, output characters, generate seconds) of completed pages
+        self.observations = deque(maxlen=HISTORY_SIZE)
+
+        if self.adaptive and self.stats_path and self.stats_path.exists():
+            try:
+                with open(self.stats_path, 'r', encoding='utf-8') as f:
+                    self.observations.extend(tuple(obs) for obs in json.load(f)["observations"])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: Could not load {self.stats_path.name}: {e}")
+
+    def rates(self) -> Dict:
+        """Learned characters per text line and generate seconds per character (None while warming up)"""
+        per_line = [chars / lines for lines, chars, _ in self.observations if lines > 0]
+        per_char = [seconds / chars for _, chars, seconds in self.observations if chars > 0 and seconds > 0]
+        if len(per_line) < MIN_OBSERVATIONS or len(per_char) < MIN_OBSERVATIONS:
+            return {"chars_per_line": None, "seconds_per_char": None}
+        return {"chars_per_line": quantile(per_line, QUANTILE), "seconds_per_char": quantile(per_char, QUANTILE)}
+
+    def plan(self, image: Image.Image) -> Dict:
+        """Budget of a page: timeout_s and max_new_tokens, plus the features it comes from"""
+        if not self.adaptive:
+            return {"timeout_s": self.ocr_timeout, "max_new_tokens": self.max_new_tokens}
+
+        features = page_features(image)
+        if features["ink"] < BLANK_INK or features["lines"] == 0:
+            return {"timeout_s": self.ocr_timeout, "max_new_tokens": BLANK_MAX_NEW_TOKENS, **features}
+
+        rates = self.rates()
+        if rates["chars_per_line"] is None:
+            return {"timeout_s": self.ocr_timeout, "max_new_tokens": self.max_new_tokens, **features}
+
+        expected_chars = rates["chars_per_line"] * features["lines"] * MARGIN
+        max_new_tokens = min(self.max_new_tokens,
+                             max(MIN_MAX_NEW_TOKENS, math.ceil(expected_chars / CHARS_PER_TOKEN)))
+        # Time to produce the whole token budget at the learned (slow-end) speed
+        timeout = rates["seconds_per_char"] * max_new_tokens * CHARS_PER_TOKEN
+        timeout = min(self.max_timeout, max(min(MIN_TIMEOUT_S, self.ocr_timeout), timeout))
+        return {"timeout_s": round(timeout, 1), "max_new_tokens": max_new_tokens, **features}
+
+    def observe(self, budget: Dict, chars: int, generate_s: float) -> None:
+        """Learn from a page OCR'd to the end (budget as returned by plan)"""
+        if not self.adaptive or "lines" not in budget:
+            return
+        self.observations.append((budget["lines"], chars, round(generate_s, 4)))
+
+    def summary(self) -> Dict:
+        """Learned state, for _summary.json"""
+        rates = self.rates()
+        return {
+            "pages_observed": len(self.observations),
+            "chars_per_line": round(rates["chars_per_line"], 1) if rates["chars_per_line"] else None,
+            "seconds_per_char": round(rates["seconds_per_char"], 5) if rates["seconds_per_char"] else None,
+        }
+
+    def save(self) -> None:
+        """Write the observations atomically (workers sharing the file: last writer wins)"""
+        if not self.adaptive or self.stats_path is None or not self.observations:
+            return
+        tmp_path = self.stats_path.with_name(f".{self.stats_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({**self.summary(), "observations": list(self.observations)}, f)
+        os.replace(tmp_path, self.stats_path)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Per-PDF checkpoint journal (_journal.jsonl in the PDF output folder)
+- One JSON line per page written to a markdown document: page number,
+  document number and file, byte offset and length of the page section, status
+- Append-only: resuming a PDF is one sequential read of this file instead of
+  re-reading every markdown file for "## Page N" markers
+- Lines are flushed as they are written, fsync'd every few records or seconds
+- A torn last line (crash during a write) is ignored when reading; later
+  records of a page (e.g. after a retry) replace earlier ones
+"""
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+JOURNAL_NAME = "_journal.jsonl"
+
+# fsync batching: a crash loses at most this many records / seconds of records
+FSYNC_EVERY = 32
+FSYNC_INTERVAL_S = 5.0
+
+PAGE_SECTION = re.compile(rb'^## Page (\d+)$', re.MULTILINE)
+SKIPPED_MARKER = re.compile(r'^\[SKIPPED: (.*)\]')
+ERROR_MARKER = re.compile(r'^\[ERROR: (.*)\]')
+TRUNCATED_MARKER = re.compile(r'^\[TRUNCATED: (.*)\]\n*')
+
+
+def doc_number(file_name: str) -> Optional[int]:
+    """Document number of a markdown file named like "name_doc05.md" """
+    match = re.search(r'_doc(\d+)\.md$', file_name)
+    return int(match.group(1)) if match else None
+
+
+def text_status(text: str) -> Dict:
+    """Status fields of a page from its markdown text: ok, or timeout/error with the marker's reason"""
+    truncated = TRUNCATED_MARKER.match(text)
+    if truncated:
+        # Timed out, but the text generated before the cut was kept
+        return {"status": "timeout", "chars": len(text) - truncated.end(),
+                "reason": truncated.group(1), "truncated": True}
+    skipped = SKIPPED_MARKER.match(text)
+    if skipped:
+        return {"status": "timeout", "chars": 0, "reason": skipped.group(1)}
+    error = ERROR_MARKER.match(text)
+    if error:
+        return {"status": "error", "chars": 0, "reason": error.group(1)}
+    return {"status": "ok", "chars": len(text)}
+
+
+def page_sections(data: bytes) -> List[Dict]:
+    """
+    Page sections of a markdown document, in file order
+    Each section runs from its "## Page N" line to the next one (or end of file)
+    """
+    matches = list(PAGE_SECTION.finditer(data))
+    sections = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(data)
+        text = data[match.end():end].decode('utf-8', errors='replace').strip()
+        if text.endswith("---"):
+            text = text[:-3].rstrip()
+        sections.append({"page": int(match.group(1)), "offset": match.start(),
+                         "length": end - match.start(), **text_status(text)})
+    return sections
+
+
+def scan_markdown_pages(pdf_output_dir: Path) -> List[Dict]:
+    """Journal records rebuilt from the markdown files (output written before the journal existed)"""
+    records = []
+    for md_file in sorted(Path(pdf_output_dir).glob("*.md")):
+        doc_num = doc_number(md_file.name)
+        if md_file.name.startswith("_") or doc_num is None:
+            continue
+        try:
+            data = md_file.read_bytes()
+        except OSError as e:
+            print(f"  Warning: Could not read {md_file.name}: {e}")
+            continue
+        for section in page_sections(data):
+            records.append({"doc": doc_num, "file": md_file.name, **section})
+    return sorted(records, key=lambda record: record["page"])
+
+
+def page_file_index(pdf_output_dir: Path) -> Dict[int, str]:
+    """
+    Markdown file holding each written page (1-indexed page -> file name)
+    From the journal when there is one (one sequential read), else by scanning
+    the markdown files
+    """
+    journal = PageJournal(Path(pdf_output_dir) / JOURNAL_NAME)
+    records = journal.read() if journal.exists() else scan_markdown_pages(pdf_output_dir)
+    # Pages of a document still being written (.part) are not in its markdown file yet
+    return {record["page"]: record["file"] for record in records if not record.get("part")}
+
+
+class PageJournal:
+    def __init__(self, path: Path, fsync_every: int = FSYNC_EVERY,
+                 fsync_interval_s: float = FSYNC_INTERVAL_S):
+        """Journal file of one PDF, opened for appending on the first record"""
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval_s = fsync_interval_s
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def read(self) -> List[Dict]:
+        """Latest record of every journaled page, in page order"""
+        latest = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash: everything before it is intact
+                        continue
+                    latest[record["page"]] = record
+        except FileNotFoundError:
+            pass
+        return [latest[page] for page in sorted(latest)]
+
+    def append(self, record: Dict) -> None:
+        if self.file is None:
+            # Terminate a torn last line so it doesn't swallow this record
+            torn = False
+            if self.exists() and self.path.stat().st_size:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+            self.file = open(self.path, 'a', encoding='utf-8')
+            if torn:
+                self.file.write("\n")
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.time() - self.last_sync >= self.fsync_interval_s:
+            self.sync()
+
+    def record_document(self, doc_num: int, file_name: str, data: bytes) -> None:
+        """Journal every page of a markdown document just written (data = file content)"""
+        for section in page_sections(data):
+            self.append({"doc": doc_num, "file": file_name, **section})
+
+    def sync(self) -> None:
+        """Force journaled records to disk"""
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
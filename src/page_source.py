@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Lazy page source for PDF rasterization
+- Renders pages in bounded chunks via first_page/last_page
+- Only a few pages are held in memory at once, whatever the PDF length
+- Optional background prefetch overlapping rasterization with OCR
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Tuple
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+
+from metrics import StageTimer
+
+
+# Pages rendered per poppler call: small enough to keep memory flat,
+# large enough to amortize the pdftoppm process startup
+DEFAULT_CHUNK_SIZE = 4
+
+# Pages rendered ahead of the OCR loop by the prefetch thread
+DEFAULT_PREFETCH_DEPTH = 2
+
+_END_OF_PAGES = object()
+
+
+def get_pdf_page_count(pdf_path: str) -> int:
+    """Return the number of pages of a PDF without rendering it"""
+    info = pdfinfo_from_path(str(pdf_path))
+    return int(info["Pages"])
+
+
+def page_chunks(pages: Iterable[int], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                max_gap: int = 0) -> List[Tuple[int, int]]:
+    """
+    Split 0-indexed page numbers into (first_page, last_page) poppler ranges,
+    1-indexed and inclusive: contiguous runs of at most chunk_size pages
+    max_gap: pages at most this many pages apart share a range (the pages in
+    between are rendered too), trading a little rendering for fewer poppler calls
+    """
+    chunks = []
+    for page_num in sorted(set(pages)):
+        first_page, last_page = chunks[-1] if chunks else (None, None)
+        if (last_page is not None and page_num - last_page <= max_gap
+                and page_num + 1 - first_page + 1 <= chunk_size):
+            chunks[-1] = (first_page, page_num + 1)
+        else:
+            chunks.append((page_num + 1, page_num + 1))
+    return chunks
+
+
+def iter_pdf_pages(pdf_path: str, dpi: int = 150, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   num_pages: int = None, timer: StageTimer = None,
+                   pages: Iterable[int] = None, max_gap: int = 0) -> Iterator[Tuple[int, Image.Image]]:
+    """
+    Yield (page_num, image) pairs for the pages of a PDF, page_num being 0-indexed
+
+    Pages are rendered `chunk_size` at a time and released as soon as the
+    consumer moves on, so peak memory is bounded by the chunk size.
+    `pages` restricts rendering to these page numbers (default: every page);
+    with `max_gap`, nearby pages share a poppler call (see page_chunks).
+    Rendering time is reported to `timer` as the "render" stage.
+    """
+    if pages is None:
+        if num_pages is None:
+            num_pages = get_pdf_page_count(pdf_path)
+        pages = range(num_pages)
+    if timer is None:
+        timer = StageTimer()
+    wanted = set(pages)
+
+    for first_page, last_page in page_chunks(wanted, chunk_size, max_gap):
+        start = time.perf_counter()
+        chunk = convert_from_path(str(pdf_path), dpi=dpi,
+                                  first_page=first_page, last_page=last_page)
+        elapsed = time.perf_counter() - start
+        timer.add("render", elapsed, count=len(chunk))
+
+        page_num = first_page - 1
+        # Pop pages off the chunk so each image can be freed once consumed
+        while chunk:
+            image = chunk.pop(0)
+            # Carried through resizes (PIL copies info), used in OCR cache keys
+            image.info["render_dpi"] = dpi
+            image.info["render_s"] = elapsed / (last_page - first_page + 1)
+            if page_num in wanted:
+                yield page_num, image
+            del image
+            page_num += 1
+
+
+def prefetch_pages(pages: Iterator[Tuple[int, Image.Image]], depth: int = DEFAULT_PREFETCH_DEPTH,
+                   transform: Callable[[Image.Image], Image.Image] = None) -> Iterator[Tuple[int, Image.Image]]:
+    """
+    Render and transform pages in a background thread, `depth` pages ahead
+
+    The producer thread drives the page iterator (poppler runs in its own
+    process, PIL resizing releases the GIL) and feeds a bounded queue, so
+    rasterization of pages N+1..N+depth overlaps with OCR of page N.
+    A depth of 0 disables prefetching and processes pages inline.
+    """
+    if depth <= 0:
+        for page_num, image in pages:
+            yield page_num, transform(image) if transform is not None else image
+        return
+
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Bounded put that gives up as soon as the consumer goes away
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for page_num, image in pages:
+                if transform is not None:
+                    image = transform(image)
+                if not put((page_num, image, None)):
+                    return
+        except Exception as e:
+            put((None, None, e))
+            return
+        put((_END_OF_PAGES, None, None))
+
+    thread = threading.Thread(target=producer, name="page-prefetch", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            page_num, image, error = buffer.get()
+            if error is not None:
+                raise error
+            if page_num is _END_OF_PAGES:
+                break
+            yield page_num, image
+            del image
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+
+def iter_batches(pages: Iterator[Tuple[int, Image.Image]],
+                 batch_size: int) -> Iterator[List[Tuple[int, Image.Image]]]:
+    """Group consecutive (page_num, image) pairs into lists of at most batch_size"""
+    batch = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,378 +1,600 @@
 #!/usr/bin/env python3
 """
 Script pour retraiter les pages avortées avec un timeout augmenté à 5 minutes
-- Trie les PDFs par nombre de pages avortées (du plus petit au plus grand)
-- Affiche des métriques en temps réel
-- Met à jour les fichiers markdown et _summary.json au fur et à mesure
+- Pages avortées lues dans l'index du corpus (_corpus_index.sqlite)
+- File de priorité globale de toutes les pages avortées, classées par chance
+  de succès par seconde (durée des tentatives passées, texte déjà obtenu,
+  longueur des pages du même PDF, nombre de lignes de la page)
+- Pages voisines d'un même PDF regroupées: un seul appel poppler et un seul
+  generate par groupe
+- Mêmes workers que le traitement principal (--workers), un verrou par PDF
+  protège les mises à jour du markdown et du _summary.json
+- Met à jour les fichiers markdown et _summary.json au fur et à mesure, une
+  réécriture atomique par fichier et par groupe de pages
 """
 
-import os
 import json
-import torch
+import fcntl
+import heapq
+import statistics
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from pdf2image import convert_from_path
 from PIL import Image
-from transformers import AutoModelForImageTextToText, AutoTokenizer, AutoProcessor
 import gc
 from typing import List, Dict, Tuple
 import re
-import tempfile
-import signal
-from contextlib import contextmanager
 from datetime import datetime
 
-
-class TimeoutException(Exception):
-    """Exception levée quand un timeout se produit"""
-    pass
+from ocr_engine import OCREngine, OCRTimeout, TransformersBackend, add_engine_arguments, engine_from_args
+from page_journal import TRUNCATED_MARKER, page_file_index, page_sections
+from page_source import iter_pdf_pages
+from document_writer import (PAGE_END, REPETITION_REASON, patch_pages, repetition_page_entry,
+                             repetition_page_text, timeout_page_text, skipped_page_entry, write_atomic)
+from worker_pool import add_worker_arguments, run_worker_pool
+from corpus_index import CorpusIndex
+
+
+RETRY_LOCK_NAME = ".retry.lock"
+
+# Pages d'un même PDF à moins de RENDER_WINDOW pages de la page la mieux classée
+# partagent une tâche; celles à au plus RENDER_GAP pages d'écart partagent un
+# appel poppler (les pages entre elles sont rendues puis ignorées)
+RENDER_WINDOW = 8
+RENDER_GAP = 2
+DEFAULT_GROUP_SIZE = 4
+
+# Estimations sans historique: longueur d'une page et vitesse de génération
+DEFAULT_PAGE_CHARS = 2000
+DEFAULT_SECONDS_PER_CHAR = 0.05
+
+TIMEOUT_REASON = re.compile(r'OCR timeout after ([\d.]+)')
+
+
+def scan_aborted_pages(ocr_output_dir: Path) -> List[Dict]:
+    """
+    Liste des pages avortées de tous les PDFs, triée par nombre de pages
+    avortées (croissant), lue dans l'index du corpus (les _summary.json que
+    l'index ne connaît pas encore y sont ajoutés d'abord)
+    """
+    index = CorpusIndex(ocr_output_dir)
+    index.sync()
+    aborted_data = index.aborted()
+    index.close()
+    return aborted_data
+
+
+def pdf_retry_stats(pdf_dir: Path) -> Dict:
+    """
+    Statistiques d'un PDF tirées de son _metrics.jsonl: dernier enregistrement
+    de chaque page, longueur médiane, secondes de génération par caractère et
+    caractères par ligne de texte des pages réussies
+    """
+    pages = {}
+    try:
+        with open(Path(pdf_dir) / "_metrics.jsonl", 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                pages[record["page"]] = record
+    except OSError:
+        pass
+
+    ok = [record for record in pages.values() if record.get("status") == "ok" and record.get("chars")]
+    per_char = [record["stages"]["generate"] / record["chars"] for record in ok
+                if record.get("stages", {}).get("generate")]
+    per_line = [record["chars"] / record["budget"]["lines"] for record in ok
+                if (record.get("budget") or {}).get("lines")]
+    return {
+        "pages": pages,
+        "median_chars": statistics.median(record["chars"] for record in ok) if ok else None,
+        "seconds_per_char": statistics.median(per_char) if per_char else None,
+        "chars_per_line": statistics.median(per_line) if per_line else None,
+    }
+
+
+def estimate_retry(entry: Dict, record: Dict, stats: Dict, timeout: float) -> Dict:
+    """
+    Durée attendue d'une nouvelle tentative sur une page et chance de succès
+    entry: entrée skipped_pages du _summary.json, record: dernier enregistrement
+    _metrics.jsonl de la page (ou None), stats: pdf_retry_stats de son PDF
+    score: chance de succès par seconde de tentative, la clé de la file de priorité
+    """
+    record = record or {}
+    partial = entry.get("partial_chars", 0)
+
+    # Longueur attendue: lignes de la page x caractères par ligne du PDF,
+    # sinon longueur médiane des pages du PDF
+    lines = (record.get("budget") or {}).get("lines")
+    if lines and stats["chars_per_line"]:
+        expected_chars = lines * stats["chars_per_line"]
+    else:
+        expected_chars = stats["median_chars"] or DEFAULT_PAGE_CHARS
+    remaining = max(expected_chars - partial, 0.1 * expected_chars)
+
+    # Vitesse de génération: celle mesurée sur cette page quand une tentative
+    # a produit du texte, sinon celle des pages réussies du PDF
+    reason = TIMEOUT_REASON.search(entry.get("reason", ""))
+    if entry.get("last_attempt_chars"):
+        seconds_per_char = entry["last_attempt_s"] / entry["last_attempt_chars"]
+    elif partial and "last_attempt_s" not in entry:
+        spent = record.get("stages", {}).get("generate") or (float(reason.group(1)) if reason else timeout)
+        seconds_per_char = spent / partial
+    else:
+        seconds_per_char = stats["seconds_per_char"] or DEFAULT_SECONDS_PER_CHAR
+
+    expected_s = remaining * seconds_per_char
+    # Chaque échec avec un timeout au moins égal rend la page moins prometteuse
+    success = min(1.0, timeout / max(expected_s, 1e-3)) / (1 + entry.get("attempts", 0))
+    return {"expected_s": round(expected_s, 1), "success": round(success, 3),
+            "score": success / max(min(expected_s, timeout), 1e-3)}
+
+
+def build_retry_schedule(aborted_data: List[Dict], timeout: float,
+                         group_size: int = DEFAULT_GROUP_SIZE) -> List[Dict]:
+    """
+    File de priorité globale des pages avortées de tous les PDFs
+    La page la mieux classée encore en file ouvre une tâche, complétée par les
+    pages les mieux classées de son PDF à moins de RENDER_WINDOW pages d'elle
+    (jusqu'à group_size pages); les tâches sortent par score décroissant
+    """
+    heap = []
+    queued = {}
+    for data in aborted_data:
+        stats = pdf_retry_stats(data["pdf_dir"])
+        queued[data["pdf_name"]] = {}
+        for entry in data["skipped_pages"]:
+            estimate = estimate_retry(entry, stats["pages"].get(entry["page"]), stats, timeout)
+            queued[data["pdf_name"]][entry["page"]] = (estimate, data)
+            heapq.heappush(heap, (-estimate["score"], data["pdf_name"], entry["page"]))
+
+    tasks = []
+    while heap:
+        _, pdf_name, page = heapq.heappop(heap)
+        pdf_pages = queued[pdf_name]
+        if page not in pdf_pages:
+            # Déjà retenue dans la tâche d'une page voisine
+            continue
+
+        neighbours = sorted((p for p in pdf_pages if p != page and abs(p - page) <= RENDER_WINDOW),
+                            key=lambda p: -pdf_pages[p][0]["score"])
+        pages = sorted([page] + neighbours[:group_size - 1])
+        data = pdf_pages[page][1]
+        estimates = [pdf_pages.pop(p)[0] for p in pages]
+        tasks.append({
+            "label": f"{pdf_name} p{','.join(str(p) for p in pages)}",
+            "pdf_name": pdf_name,
+            "pdf_dir": data["pdf_dir"],
+            "summary_file": data["summary_file"],
+            "pages": pages,
+            "expected_s": round(sum(estimate["expected_s"] for estimate in estimates), 1),
+            "success": round(statistics.mean(estimate["success"] for estimate in estimates), 3),
+        })
+    return tasks
 
 
 @contextmanager
-def timeout_context(seconds):
-    """Context manager pour ajouter un timeout à une opération"""
-    def timeout_handler(signum, frame):
-        raise TimeoutException(f"Operation timed out after {seconds} seconds")
-
-    old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(seconds)
-
-    try:
-        yield
-    finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old_handler)
+def pdf_lock(pdf_dir: Path):
+    """Verrou exclusif d'un dossier de PDF (workers qui retraitent des pages du même PDF)"""
+    with open(Path(pdf_dir) / RETRY_LOCK_NAME, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 
 class AbortedPagesRetry:
-    def __init__(self, ocr_output_dir: str = "../data/output/ocr_results", original_pdfs_dir: str = "../data/input"):
-        """Initialize the retry processor"""
+    def __init__(self, ocr_output_dir: str = "../data/output/ocr_results", original_pdfs_dir: str = "../data/input",
+                 engine: OCREngine = None):
+        """Initialize the retry processor (Nanonets model unless another engine is given)"""
         self.ocr_output_dir = Path(ocr_output_dir)
         self.original_pdfs_dir = Path(original_pdfs_dir)
 
-        print("Loading Nanonets-OCR2-3B model...")
-        model_path = 'nanonets/Nanonets-OCR2-3B'
-
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="balanced",
-            low_cpu_mem_usage=True,
-            offload_folder="offload",
-            offload_state_dict=True,
-        )
-
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.processor = AutoProcessor.from_pretrained(model_path)
-        self.model.eval()
-
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        # Même moteur que le traitement principal (offload CPU, pages à 1400px)
+        # Taille de lot automatique selon la mémoire disponible
+        if engine is None:
+            engine = OCREngine(TransformersBackend(offload=True), max_dimension=1400)
+        self.engine = engine
+        self.batch_size = engine.batch_size
+        self.index = CorpusIndex(self.ocr_output_dir)
 
-        print("✓ Model loaded successfully!\n")
+        print("✓ Moteur OCR prêt!\n")
 
     def get_aborted_pages_list(self) -> List[Dict]:
         """
-        Parcourt tous les _summary.json et retourne la liste des pages avortées
-        triée par nombre de pages avortées (croissant)
+        Liste des pages avortées de l'index du corpus, triée par nombre de
+        pages avortées (croissant)
         """
-        aborted_data = []
-
-        for pdf_dir in sorted(self.ocr_output_dir.iterdir()):
-            if not pdf_dir.is_dir():
-                continue
-
-            summary_file = pdf_dir / "_summary.json"
-            if not summary_file.exists():
-                continue
-
-            try:
-                with open(summary_file, 'r', encoding='utf-8') as f:
-                    summary = json.load(f)
-
-                if "skipped_pages" in summary and summary["skipped_pages"]:
-                    aborted_data.append({
-                        "pdf_name": summary["pdf_name"],
-                        "pdf_dir": pdf_dir,
-                        "summary_file": summary_file,
-                        "skipped_pages": summary["skipped_pages"],
-                        "count": len(summary["skipped_pages"])
-                    })
-            except Exception as e:
-                print(f"⚠️ Erreur lors de la lecture de {summary_file}: {e}")
-
-        # Trier par nombre de pages avortées (croissant)
-        aborted_data.sort(key=lambda x: x["count"])
-
-        return aborted_data
-
-    def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048) -> str:
-        """Perform OCR on a single image"""
-        with torch.no_grad():
-            max_dimension = 1400
-            if max(image.size) > max_dimension:
-                ratio = max_dimension / max(image.size)
-                new_size = tuple(int(dim * ratio) for dim in image.size)
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-                image.save(tmp_path)
-
-            try:
-                prompt = """Extract the text from the above document as if you were reading it naturally. Return the tables in html format if present. Return the equations in LaTeX representation if present."""
-
-                messages = [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": [
-                        {"type": "image", "image": f"file://{tmp_path}"},
-                        {"type": "text", "text": prompt},
-                    ]},
-                ]
-
-                text = self.processor.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-
-                inputs = self.processor(
-                    text=[text],
-                    images=[image],
-                    padding=True,
-                    return_tensors="pt"
-                )
-
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_new_tokens,
-                    do_sample=False,
-                    num_beams=1,
-                )
-
-                generated_ids = [
-                    output_ids[len(input_ids):]
-                    for input_ids, output_ids in zip(inputs['input_ids'], output_ids)
-                ]
-
-                output_text = self.processor.batch_decode(
-                    generated_ids,
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True
-                )
-
-                result = output_text[0]
+        self.index.sync()
+        return self.index.aborted()
 
-            finally:
-                if os.path.exists(tmp_path):
-                    os.remove(tmp_path)
+    def ocr_image(self, image: Image.Image, max_new_tokens: int = 2048, timeout_s: float = None,
+                  prefix: str = None) -> str:
+        """Perform OCR on a single image (OCRTimeout if it takes longer than timeout_s)"""
+        return self.engine.ocr_image(image, max_new_tokens=max_new_tokens, timeout_s=timeout_s, prefix=prefix)
 
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            gc.collect()
-
-            return result
+    def ocr_batch(self, images: List[Image.Image], max_new_tokens: int = 2048,
+                  timeout_s: float = None, prefixes: List[str] = None) -> List[str]:
+        """Perform OCR on several images in one generate call, one result per image"""
+        return self.engine.ocr_batch(images, max_new_tokens=max_new_tokens, timeout_s=timeout_s,
+                                     prefixes=prefixes)
 
-    def find_and_update_markdown(self, pdf_dir: Path, page_num: int, ocr_text: str, pdf_name: str) -> bool:
+    def get_partial_texts(self, pdf_dir: Path, page_nums: List[int], index: Dict[int, str]) -> List[str]:
         """
-        Trouve le fichier markdown qui contient cette page et le met à jour
-        Returns True si succès, False sinon
+        Texte conservé des pages tronquées par un timeout ("" pour une page sautée)
+        index: page -> fichier markdown (page_file_index), chaque fichier est lu une fois
         """
-        # Chercher tous les fichiers markdown
-        md_files = [f for f in pdf_dir.glob("*.md") if not f.name.startswith("_")]
-
-        for md_file in md_files:
+        texts = {}
+        for file_name in sorted({index[page_num] for page_num in page_nums if page_num in index}):
             try:
-                with open(md_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-                # Chercher si cette page est dans ce fichier
-                # Format: ## Page X ou [SKIPPED: OCR timeout...]
-                page_marker = f"## Page {page_num}"
-
-                if page_marker in content:
-                    # Trouver la section de cette page
-                    lines = content.split('\n')
-                    new_lines = []
-                    in_target_page = False
-                    replaced = False
-
-                    for i, line in enumerate(lines):
-                        if line.strip() == page_marker:
-                            in_target_page = True
-                            new_lines.append(line)
-                            # Chercher la ligne suivante qui contient SKIPPED ou le contenu
-                            if i + 1 < len(lines):
-                                next_line = lines[i + 1]
-                                if '[SKIPPED:' in next_line or '[ERROR:' in next_line:
-                                    # Remplacer par le nouveau texte OCR
-                                    new_lines.append(ocr_text)
-                                    replaced = True
-                                    # Sauter la ligne SKIPPED
-                                    continue
-                        elif in_target_page and line.startswith('## Page '):
-                            # Nouvelle page, on n'est plus dans la page cible
-                            in_target_page = False
-                            new_lines.append(line)
-                        elif not (in_target_page and '[SKIPPED:' in line):
-                            new_lines.append(line)
-
-                    if replaced:
-                        # Écrire le fichier modifié
-                        with open(md_file, 'w', encoding='utf-8') as f:
-                            f.write('\n'.join(new_lines))
-                        return True
-
-            except Exception as e:
-                print(f"    ⚠️ Erreur lors de la mise à jour de {md_file.name}: {e}")
+                data = (pdf_dir / file_name).read_bytes()
+            except OSError as e:
+                print(f"    ⚠️ Erreur lors de la lecture de {file_name}: {e}")
+                continue
+            for section in page_sections(data):
+                if section["page"] not in page_nums or not section.get("truncated"):
+                    continue
+                text = data[section["offset"]:section["offset"] + section["length"]].decode('utf-8')
+                # Retirer le titre "## Page N", le marqueur [TRUNCATED] et le séparateur final,
+                # sans toucher au texte: la génération reprend exactement après lui
+                text = text.split("\n", 1)[1].lstrip("\n")
+                if text.endswith(PAGE_END):
+                    text = text[:-len(PAGE_END)]
+                else:
+                    text = text.rstrip()
+                    if text.endswith("---"):
+                        text = text[:-3].rstrip()
+                texts[section["page"]] = text[TRUNCATED_MARKER.match(text).end():]
+        return [texts.get(page_num, "") for page_num in page_nums]
 
-        return False
+    def update_markdown(self, pdf_dir: Path, texts: Dict[int, str], index: Dict[int, str] = None) -> List[int]:
+        """
+        Remplace les sections des pages (sautées, tronquées ou en erreur) par leur
+        nouveau texte: une lecture et une réécriture atomique par fichier concerné
+        Returns les pages remplacées
+        """
+        if not texts:
+            return []
+        try:
+            return patch_pages(pdf_dir, texts, index)
+        except Exception as e:
+            print(f"    ⚠️ Erreur lors de la mise à jour des markdown de {pdf_dir.name}: {e}")
+            return []
 
-    def update_summary_json(self, summary_file: Path, page_num: int):
-        """Retire la page du champ skipped_pages dans le _summary.json"""
+    def update_summary_json(self, summary_file: Path, entries: Dict[int, Dict]) -> bool:
+        """
+        Met à jour le champ skipped_pages du _summary.json en une seule écriture atomique
+        entries: page -> nouvelle entrée (page encore tronquée), ou None pour la retirer
+        """
         try:
             with open(summary_file, 'r', encoding='utf-8') as f:
                 summary = json.load(f)
 
             if "skipped_pages" in summary:
-                # Filtrer pour retirer cette page
                 summary["skipped_pages"] = [
-                    p for p in summary["skipped_pages"]
-                    if p["page"] != page_num
+                    entries[p["page"]] if p["page"] in entries else p
+                    for p in summary["skipped_pages"]
                 ]
+                summary["skipped_pages"] = [p for p in summary["skipped_pages"] if p is not None]
 
                 # Si plus de pages skipped, retirer la clé
                 if not summary["skipped_pages"]:
                     del summary["skipped_pages"]
 
-            with open(summary_file, 'w', encoding='utf-8') as f:
-                json.dump(summary, f, indent=2)
+            # Pages qui bouclaient, réussies cette fois
+            if "repetition_pages" in summary:
+                summary["repetition_pages"] = [p for p in summary["repetition_pages"]
+                                               if not (p in entries and entries[p] is None)]
+                if not summary["repetition_pages"]:
+                    del summary["repetition_pages"]
 
+            write_atomic(summary_file, json.dumps(summary, indent=2).encode('utf-8'))
+            self.index.record_summary(summary_file.parent, summary)
             return True
         except Exception as e:
             print(f"    ⚠️ Erreur lors de la mise à jour de {summary_file}: {e}")
             return False
 
-    def retry_single_page(self, pdf_path: Path, page_num: int, timeout: int = 300) -> Tuple[bool, str]:
+    def retry_result(self, text: str, stop: str) -> Tuple[bool, str]:
         """
-        Retente l'OCR sur une seule page avec un timeout augmenté
-        Returns: (success, ocr_text)
+        (success, ocr_text) d'une page générée jusqu'au bout: une page qui boucle
+        encore reste un échec, marquée [TRUNCATED] comme à son premier passage
         """
-        try:
-            # Convertir uniquement la page spécifique (page_num est 1-indexed)
-            images = convert_from_path(str(pdf_path), dpi=150, first_page=page_num, last_page=page_num)
-
-            if not images:
-                return False, f"[ERROR: Could not extract page {page_num}]"
-
-            image = images[0]
-
-            # Tenter l'OCR avec timeout
-            try:
-                with timeout_context(timeout):
-                    result = self.ocr_image(image)
-                    return True, result
-            except TimeoutException:
-                return False, f"[SKIPPED: OCR timeout after {timeout}s]"
-            except Exception as e:
-                return False, f"[ERROR: {e}]"
-            finally:
-                del image
-                gc.collect()
+        if stop == "repetition":
+            return False, repetition_page_text(text)
+        return True, text.strip()
 
+    def retry_image(self, image: Image.Image, timeout: int = 300, prefix: str = "",
+                    remaining: float = None) -> Tuple[bool, str]:
+        """
+        Retente l'OCR d'une page déjà rendue, seule, avec un timeout augmenté
+        remaining: ce qui reste du timeout de la page (défaut: tout le timeout)
+        Returns: (success, ocr_text), ocr_text étant la page [TRUNCATED] si le
+        timeout (ou une boucle de répétition) coupe à nouveau la génération
+        """
+        if remaining is None:
+            remaining = timeout
+        if remaining <= 0:
+            return False, timeout_page_text(timeout, prefix)
+        try:
+            text = self.ocr_image(image, timeout_s=remaining, prefix=prefix)
+            return self.retry_result(text, self.engine.last_stop_reasons[0])
+        except OCRTimeout as e:
+            return False, timeout_page_text(timeout, e.partial[0] or prefix)
         except Exception as e:
             return False, f"[ERROR: {e}]"
 
-    def process_all_aborted_pages(self, timeout: int = 300):
+    def retry_single_page(self, pdf_path: Path, page_num: int, timeout: int = 300,
+                          prefix: str = "") -> Tuple[bool, str]:
         """
-        Traite toutes les pages avortées avec le nouveau timeout
+        Retente l'OCR sur une seule page avec un timeout augmenté
+        prefix: texte déjà obtenu avant un timeout, la génération reprend après lui
+        Returns: (success, ocr_text)
         """
-        aborted_data = self.get_aborted_pages_list()
+        return self.retry_page_batch(pdf_path, [page_num], timeout, [prefix])[0]
 
-        if not aborted_data:
-            print("✅ Aucune page avortée à retraiter!")
-            return
-
-        # Calculer le total de pages à traiter
-        total_pages = sum(data["count"] for data in aborted_data)
+    def retry_page_batch(self, pdf_path: Path, page_nums: List[int], timeout: int = 300,
+                         prefixes: List[str] = None) -> List[Tuple[bool, str]]:
+        """
+        Retente l'OCR sur plusieurs pages d'un même PDF en un seul appel generate
+        Les pages proches sont rendues ensemble (un appel poppler par plage).
+        Le lot a le timeout d'une page. S'il échoue, ou pour les pages qu'il coupe,
+        chaque page est retentée individuellement avec ce qui reste de son timeout,
+        en reprenant après le texte obtenu jusque-là
+        Returns: [(success, ocr_text)] dans l'ordre de page_nums
+        """
+        prefixes = list(prefixes or [""] * len(page_nums))
+        try:
+            # page_nums est 1-indexed, iter_pdf_pages 0-indexed
+            rendered = dict(iter_pdf_pages(pdf_path, dpi=150, chunk_size=2 * RENDER_WINDOW + 1,
+                                           pages=[page_num - 1 for page_num in page_nums],
+                                           max_gap=RENDER_GAP, timer=self.engine.timer))
+            missing = [page_num for page_num in page_nums if page_num - 1 not in rendered]
+            if missing:
+                raise ValueError(f"Could not extract page(s) {missing}")
+        except Exception as e:
+            return [(False, f"[ERROR: {e}]")] * len(page_nums)
+        images = [rendered.pop(page_num - 1) for page_num in page_nums]
 
-        print("="*80)
-        print(f"📊 RETRAITEMENT DES PAGES AVORTÉES")
-        print("="*80)
-        print(f"PDFs à traiter: {len(aborted_data)}")
-        print(f"Pages à retraiter: {total_pages}")
-        print(f"Timeout: {timeout}s ({timeout//60} minutes)")
-        print("="*80)
-        print()
+        try:
+            if len(images) == 1:
+                return [self.retry_image(images[0], timeout, prefixes[0])]
+            batch_start = time.monotonic()
+            try:
+                results = self.ocr_batch(images, timeout_s=timeout, prefixes=prefixes)
+                return [self.retry_result(result, stop)
+                        for result, stop in zip(results, self.engine.last_stop_reasons)]
+
+            except OCRTimeout as e:
+                # Les pages terminées dans le budget du lot sont conservées, les autres
+                # repartent du texte généré avant la coupure
+                results = e.results
+                stops = list(self.engine.last_stop_reasons)
+                prefixes = [partial or prefix for partial, prefix in zip(e.partial, prefixes)]
+                print(f"\n   ⚠️ {results.count(None)} page(s) du lot hors délai, reprise page par page", end='')
 
-        processed_count = 0
-        success_count = 0
-        failed_count = 0
+            except Exception as e:
+                results = stops = [None] * len(page_nums)
+                print(f"\n   ⚠️ Échec du lot de {len(page_nums)} pages ({e}), reprise page par page", end='')
 
-        for pdf_idx, data in enumerate(aborted_data, 1):
-            pdf_name = data["pdf_name"]
-            pdf_dir = data["pdf_dir"]
-            summary_file = data["summary_file"]
-            skipped_pages = data["skipped_pages"]
+            # Aucune page ne dépasse son timeout: la reprise n'a que ce que le lot a laissé
+            remaining = timeout - (time.monotonic() - batch_start)
+            return [self.retry_result(result, stop) if result is not None
+                    else self.retry_image(image, timeout, prefix, remaining)
+                    for image, result, stop, prefix in zip(images, results, stops, prefixes)]
 
-            # Trouver le PDF original
-            pdf_path = self.original_pdfs_dir / f"{pdf_name}.pdf"
+        finally:
+            del images
+            gc.collect()
 
-            if not pdf_path.exists():
-                print(f"❌ [{pdf_idx}/{len(aborted_data)}] PDF non trouvé: {pdf_path}")
-                failed_count += len(skipped_pages)
-                processed_count += len(skipped_pages)
+    def retry_task(self, task: Dict, timeout: int = 300) -> List[bool]:
+        """
+        Retraite un groupe de pages d'un même PDF (tâche de build_retry_schedule)
+        Les fichiers du PDF sont mis à jour sous son verrou
+        Returns: succès de chaque page de la tâche
+        """
+        pdf_name = task["pdf_name"]
+        pdf_dir = Path(task["pdf_dir"])
+        summary_file = Path(task["summary_file"])
+        page_nums = task["pages"]
+
+        print(f"\n{'─'*80}")
+        print(f"📄 {pdf_name} - pages {page_nums} (≈{task['expected_s']:.0f}s, succès estimé {task['success']:.0%})")
+
+        # Trouver le PDF original
+        pdf_path = self.original_pdfs_dir / f"{pdf_name}.pdf"
+        if not pdf_path.exists():
+            print(f"❌ PDF non trouvé: {pdf_path}")
+            return [False] * len(page_nums)
+
+        with open(summary_file, 'r', encoding='utf-8') as f:
+            entries = {entry["page"]: entry for entry in json.load(f).get("skipped_pages", [])}
+
+        # Les pages tronquées reprennent après le texte déjà conservé
+        index = page_file_index(pdf_dir)
+        prefixes = self.get_partial_texts(pdf_dir, page_nums, index)
+        # Une page qui bouclait repart de zéro: reprendre après la boucle la prolongerait
+        prefixes = ["" if entries.get(page_num, {}).get("reason") == REPETITION_REASON else prefix
+                    for page_num, prefix in zip(page_nums, prefixes)]
+
+        start_time = datetime.now()
+        if len(page_nums) > 1:
+            print(f"\n   Lot de {len(page_nums)} pages: {page_nums}", end='', flush=True)
+        outcomes = self.retry_page_batch(pdf_path, page_nums, timeout, prefixes)
+
+        # Durée moyenne par page du lot
+        elapsed = (datetime.now() - start_time).total_seconds() / len(page_nums)
+
+        # Nouveau texte des pages réussies, et des pages encore coupées dont le
+        # texte partiel a progressé depuis la dernière tentative
+        partials = {}
+        texts = {}
+        for page_num, prefix, (success, ocr_text) in zip(page_nums, prefixes, outcomes):
+            truncated = TRUNCATED_MARKER.match(ocr_text)
+            partials[page_num] = ocr_text[truncated.end():] if truncated and not success else ""
+            if success or len(partials[page_num]) > len(prefix):
+                texts[page_num] = ocr_text
+
+        with pdf_lock(pdf_dir):
+            # Tout le lot en une passe: une réécriture par fichier markdown, une du summary
+            patched = set(self.update_markdown(pdf_dir, texts, index))
+            summary_entries = {}
+            for page_num, prefix, (success, ocr_text) in zip(page_nums, prefixes, outcomes):
+                if success:
+                    summary_entries[page_num] = None
+                    continue
+                partial = partials[page_num]
+                entry = entries.get(page_num, {"page": page_num})
+                if page_num in patched and TRUNCATED_MARKER.match(ocr_text).group(1) == REPETITION_REASON:
+                    entry = repetition_page_entry(page_num, partial)
+                elif page_num in patched:
+                    entry = skipped_page_entry(page_num, timeout, partial)
+                # Historique des tentatives, pris en compte par le classement de la prochaine passe
+                entry.update({"attempts": entries.get(page_num, {}).get("attempts", 0) + 1,
+                              "last_attempt_s": round(elapsed, 1),
+                              "last_attempt_chars": max(0, len(partial) - len(prefix))})
+                summary_entries[page_num] = entry
+            summary_updated = self.update_summary_json(summary_file, summary_entries)
+
+        for page_num, prefix, (success, ocr_text) in zip(page_nums, prefixes, outcomes):
+            print(f"\n   Page {page_num} ({pdf_name})... ", end='', flush=True)
+
+            if success:
+                print(f"✓ OK ({elapsed:.1f}s)")
+                print(f"      Extracted {len(ocr_text)} characters")
+                if page_num in patched:
+                    print(f"      ✓ Markdown mis à jour")
+                if summary_updated:
+                    print(f"      ✓ Summary JSON mis à jour")
                 continue
 
-            print(f"\n{'─'*80}")
-            print(f"📄 [{pdf_idx}/{len(aborted_data)}] {pdf_name}")
-            print(f"   Pages à retraiter: {len(skipped_pages)}")
-            print(f"{'─'*80}")
+            print(f"✗ ÉCHEC ({elapsed:.1f}s)")
+            print(f"      Raison: {ocr_text.splitlines()[0]}")
+            if page_num in patched:
+                print(f"      ✓ Texte partiel conservé ({len(prefix)} → {len(partials[page_num])} caractères)")
 
-            for page_idx, skipped_info in enumerate(skipped_pages, 1):
-                page_num = skipped_info["page"]
-                processed_count += 1
+        # Libérer la mémoire
+        self.engine.release_memory()
+        return [success for success, _ in outcomes]
 
-                start_time = datetime.now()
-                print(f"\n   [{processed_count}/{total_pages}] Page {page_num}/{page_idx} sur {len(skipped_pages)}... ", end='', flush=True)
+    def process_all_aborted_pages(self, timeout: int = 300, group_size: int = None):
+        """
+        Traite toutes les pages avortées avec le nouveau timeout, dans l'ordre
+        de la file de priorité (group_size: pages par tâche, défaut: taille de lot)
+        """
+        aborted_data = self.get_aborted_pages_list()
 
-                success, ocr_text = self.retry_single_page(pdf_path, page_num, timeout)
+        if not aborted_data:
+            print("✅ Aucune page avortée à retraiter!")
+            return
 
-                elapsed = (datetime.now() - start_time).total_seconds()
+        tasks = build_retry_schedule(aborted_data, timeout, group_size or self.batch_size)
+        total_pages = print_retry_plan(aborted_data, tasks, timeout)
 
-                if success:
-                    print(f"✓ OK ({elapsed:.1f}s)")
-                    print(f"      Extracted {len(ocr_text)} characters")
+        success_count = 0
+        for task_idx, task in enumerate(tasks, 1):
+            print(f"\n[{task_idx}/{len(tasks)}]", end='')
+            success_count += sum(self.retry_task(task, timeout))
+
+        print_retry_summary(success_count, total_pages)
+
+        # Temps cumulé par étape du pipeline (rendu, préparation, génération, décodage...)
+        stages = self.engine.timer.snapshot()
+        if stages:
+            print("⏱️  Temps par étape:")
+            for stage, values in stages.items():
+                print(f"   {stage:<11} {values['total_s']:8.1f}s ({values['count']} pages)")
+        print("="*80)
 
-                    # Mettre à jour le markdown
-                    if self.find_and_update_markdown(pdf_dir, page_num, ocr_text, pdf_name):
-                        print(f"      ✓ Markdown mis à jour")
 
-                    # Mettre à jour le summary.json
-                    if self.update_summary_json(summary_file, page_num):
-                        print(f"      ✓ Summary JSON mis à jour")
+def print_retry_plan(aborted_data: List[Dict], tasks: List[Dict], timeout: int) -> int:
+    """Affiche le plan de retraitement, retourne le nombre de pages à traiter"""
+    total_pages = sum(data["count"] for data in aborted_data)
+
+    print("="*80)
+    print(f"📊 RETRAITEMENT DES PAGES AVORTÉES")
+    print("="*80)
+    print(f"PDFs à traiter: {len(aborted_data)}")
+    print(f"Pages à retraiter: {total_pages} en {len(tasks)} tâches")
+    print(f"Durée estimée: {sum(task['expected_s'] for task in tasks) / 60:.0f} min de génération")
+    print(f"Timeout: {timeout}s ({timeout//60} minutes)")
+    print("Premières tâches de la file:")
+    for task in tasks[:5]:
+        print(f"   {task['label']} (≈{task['expected_s']:.0f}s, succès estimé {task['success']:.0%})")
+    print("="*80)
+    print()
+    return total_pages
+
+
+def print_retry_summary(success_count: int, total_pages: int) -> None:
+    """Résumé final du retraitement"""
+    print("\n" + "="*80)
+    print("📊 RÉSUMÉ FINAL")
+    print("="*80)
+    print(f"✓ Pages réussies: {success_count}/{total_pages}")
+    print(f"✗ Pages échouées: {total_pages - success_count}/{total_pages}")
+    print(f"📈 Taux de succès: {success_count/total_pages*100:.1f}%")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Retraitement des pages avortées (timeout augmenté)")
+    parser.add_argument("--output-dir", default="../data/output/ocr_results",
+                        help="Dossier des résultats OCR (un sous-dossier par PDF)")
+    parser.add_argument("--input-dir", default="../data/input",
+                        help="Dossier des PDFs originaux")
+    parser.add_argument("--timeout", type=int, default=300,
+                        help="Timeout par page en secondes (défaut: 300 = 5 minutes)")
+    parser.add_argument("--group-size", type=int, default=0,
+                        help="Pages voisines d'un même PDF par tâche (défaut: 0 = taille de lot, "
+                             f"{DEFAULT_GROUP_SIZE} avec --workers)")
+    add_engine_arguments(parser)
+    add_worker_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Un modèle par worker, ce processus ne fait que distribuer les tâches
+        aborted_data = scan_aborted_pages(args.output_dir)
+        if not aborted_data:
+            print("✅ Aucune page avortée à retraiter!")
+            return
 
-                    success_count += 1
-                else:
-                    print(f"✗ ÉCHEC ({elapsed:.1f}s)")
-                    print(f"      Raison: {ocr_text}")
-                    failed_count += 1
-
-                # Libérer la mémoire
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                gc.collect()
-
-        # Résumé final
-        print("\n" + "="*80)
-        print("📊 RÉSUMÉ FINAL")
-        print("="*80)
-        print(f"✓ Pages réussies: {success_count}/{total_pages}")
-        print(f"✗ Pages échouées: {failed_count}/{total_pages}")
-        print(f"📈 Taux de succès: {success_count/total_pages*100:.1f}%")
+        tasks = build_retry_schedule(aborted_data, args.timeout,
+                                     args.group_size or args.batch_size or DEFAULT_GROUP_SIZE)
+        total_pages = print_retry_plan(aborted_data, tasks, args.timeout)
+
+        run_worker_pool(
+            "retry_aborted_pages",
+            tasks,
+            args,
+            args.workers,
+            engine_options={"max_dimension": 1400, "offload": True},
+            processor_kwargs={"ocr_output_dir": args.output_dir, "original_pdfs_dir": args.input_dir},
+            method="retry_task",
+            process_kwargs={"timeout": args.timeout},
+            devices=args.devices,
+            threads_per_worker=args.threads_per_worker,
+            processor_class="AbortedPagesRetry"
+        )
+
+        # Pages encore avortées après le passage des workers
+        remaining = sum(data["count"] for data in scan_aborted_pages(args.output_dir))
+        print_retry_summary(total_pages - remaining, total_pages)
         print("="*80)
+        return
+
+    processor = AbortedPagesRetry(
+        ocr_output_dir=args.output_dir,
+        original_pdfs_dir=args.input_dir,
+        engine=engine_from_args(args, max_dimension=1400, offload=True)
+    )
+    processor.process_all_aborted_pages(timeout=args.timeout, group_size=args.group_size or None)
 
 
 if __name__ == "__main__":
-    processor = AbortedPagesRetry()
-    processor.process_all_aborted_pages(timeout=300)  # 5 minutes
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Multi-process worker pool for process_directory
+- N worker processes, each loading its own model replica
+- One CUDA device per worker (--devices) or pinned CPU thread counts
+- The parent hands out tasks (PDFs, or any picklable work item) one at a
+  time, in order; a task lost with a crashed worker is handed to another worker
+- Per-worker progress lines and final report; page counters forwarded
+  to the parent's metrics endpoint
+"""
+
+import importlib
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from corpus_index import CorpusIndex
+from metrics_server import PipelineMetrics
+
+
+# A PDF whose worker died is retried this many times on other workers
+MAX_PDF_ATTEMPTS = 2
+
+
+def add_worker_arguments(parser) -> None:
+    """CLI options of the worker pool"""
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Worker processes, each with its own model (default: 1 = in-process)")
+    parser.add_argument("--devices", type=str, default=None,
+                       help="Comma-separated CUDA devices assigned round-robin to workers, e.g. 0,1")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                       help="CPU threads per worker (default: 0 = library default)")
+
+
+def task_label(task) -> str:
+    """Short name of a task for logs: a PDF file name, or the "label" of a dict task"""
+    if isinstance(task, dict):
+        return task["label"]
+    return Path(task).name
+
+
+def pending_pdfs(input_dir: str, output_dir: str, pattern: str = "*.pdf",
+                 skip_processed: bool = True) -> List[Path]:
+    """PDFs of input_dir, without those that already have a _summary.json (corpus index)"""
+    pdf_files = sorted(Path(input_dir).glob(pattern))
+    if not skip_processed or not Path(output_dir).is_dir():
+        return pdf_files
+    index = CorpusIndex(output_dir)
+    index.sync()
+    processed = index.processed()
+    index.close()
+    return [pdf for pdf in pdf_files if pdf.stem not in processed]
+
+
+class _PrefixedStream:
+    """Prefix every line a worker prints with its id, so logs stay readable"""
+
+    def __init__(self, stream, prefix: str):
+        self.stream = stream
+        self.prefix = prefix
+        self.at_line_start = True
+
+    def write(self, text: str) -> int:
+        for chunk in text.splitlines(keepends=True):
+            if self.at_line_start:
+                self.stream.write(self.prefix)
+            self.stream.write(chunk)
+            self.at_line_start = chunk.endswith("\n")
+        # Flush whole lines right away so workers don't interleave mid-line
+        self.stream.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class _ForwardedMetrics(PipelineMetrics):
+    """Worker-side counters, also sent to the parent process"""
+
+    def __init__(self, events, worker_id: int, engine=None):
+        super().__init__(engine)
+        self.events = events
+        self.worker_id = worker_id
+
+    def start_pdf(self, pdf_name: str, num_pages: int, pages_done: int = 0) -> None:
+        super().start_pdf(pdf_name, num_pages, pages_done)
+        self.events.put(("pdf", self.worker_id, (pdf_name, num_pages, pages_done)))
+
+    def page_done(self, status: str, latency_s: float) -> None:
+        super().page_done(status, latency_s)
+        self.events.put(("page", self.worker_id, (status, latency_s)))
+
+    def pdf_done(self) -> None:
+        super().pdf_done()
+        self.events.put(("pdf_done", self.worker_id, None))
+
+
+def _worker_main(worker_id: int, module_name: str, processor_class: str, processor_kwargs: Dict, engine_args,
+                 engine_options: Dict, method: str, process_kwargs: Dict, device: Optional[str],
+                 threads: int, tasks, events) -> None:
+    """Worker process: load a model, then run processor.<method>(task) for each task handed out"""
+    # CUDA reads the variable at its first call, before any model is loaded
+    if device is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        os.environ["MKL_NUM_THREADS"] = str(threads)
+
+    sys.stdout = _PrefixedStream(sys.stdout, f"[w{worker_id}] ")
+    sys.stderr = _PrefixedStream(sys.stderr, f"[w{worker_id}] ")
+
+    import ocr_engine
+    if threads and ocr_engine.torch is not None:
+        ocr_engine.torch.set_num_threads(threads)
+
+    module = importlib.import_module(module_name)
+    engine = ocr_engine.engine_from_args(engine_args, **engine_options)
+    processor = getattr(module, processor_class)(engine=engine, **processor_kwargs)
+    if hasattr(processor, "metrics"):
+        processor.metrics = _ForwardedMetrics(events, worker_id, engine)
+
+    events.put(("ready", worker_id, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        start = time.time()
+        error = None
+        try:
+            getattr(processor, method)(task, **process_kwargs)
+        except Exception as e:
+            print(f"ERROR processing {task_label(task)}: {e}")
+            error = str(e)
+        engine.release_memory()
+        events.put(("done", worker_id, (task, time.time() - start, error)))
+
+
+def run_worker_pool(module_name: str, pdf_files: List, engine_args, num_workers: int,
+                    engine_options: Dict = None, processor_kwargs: Dict = None,
+                    method: str = "process_pdf", process_kwargs: Dict = None, devices: str = None,
+                    threads_per_worker: int = 0, metrics: PipelineMetrics = None,
+                    processor_class: str = "NanonetsOCRProcessor") -> Dict[int, Dict]:
+    """
+    Process pdf_files with num_workers processes running module_name's processor_class
+    engine_args: argparse namespace read by engine_from_args (backend, batch size, cache...)
+    method: processor method called with each task (process_queue takes the input directory,
+    retry_task a dict of pages to retry); tasks are handed out in list order
+    Returns per-worker stats: {worker_id: {"done": n, "failed": n, "seconds": s}}
+    """
+    engine_options = engine_options or {}
+    processor_kwargs = processor_kwargs or {}
+    process_kwargs = process_kwargs or {}
+    device_list = [d.strip() for d in devices.split(",") if d.strip()] if devices else []
+
+    # spawn: each worker starts a fresh interpreter (required with CUDA)
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    workers = {}
+    for worker_id in range(1, num_workers + 1):
+        device = device_list[(worker_id - 1) % len(device_list)] if device_list else None
+        tasks = context.Queue()
+        process = context.Process(
+            target=_worker_main,
+            name=f"ocr-worker-{worker_id}",
+            args=(worker_id, module_name, processor_class, processor_kwargs, engine_args, engine_options,
+                  method, process_kwargs, device, threads_per_worker, tasks, events),
+            daemon=True
+        )
+        process.start()
+        workers[worker_id] = {"process": process, "tasks": tasks, "device": device, "current": None}
+        print(f"Started worker {worker_id} (pid {process.pid}"
+              f"{f', CUDA device {device}' if device is not None else ''})")
+
+    pending = deque(task if isinstance(task, dict) else str(task) for task in pdf_files)
+    total = len(pending)
+    attempts = defaultdict(int)
+    stats = {worker_id: {"done": 0, "failed": 0, "seconds": 0.0} for worker_id in workers}
+    finished = 0
+    alive = set(workers)
+
+    def dispatch(worker_id: int) -> None:
+        # Next PDF for an idle worker, or the stop sentinel
+        worker = workers[worker_id]
+        if pending:
+            worker["current"] = pending.popleft()
+            attempts[task_label(worker["current"])] += 1
+            worker["tasks"].put(worker["current"])
+        else:
+            worker["current"] = None
+            worker["tasks"].put(None)
+
+    def reap_dead_workers() -> None:
+        # Workers that died (OOM, crash) give their PDF back to the pool
+        nonlocal finished
+        for worker_id in list(alive):
+            worker = workers[worker_id]
+            if worker["process"].is_alive():
+                continue
+            alive.discard(worker_id)
+            lost = worker["current"]
+            print(f"[pool] Worker {worker_id} exited (code {worker['process'].exitcode})")
+            if lost is None:
+                continue
+            if attempts[task_label(lost)] < MAX_PDF_ATTEMPTS and alive:
+                print(f"[pool] Requeuing {task_label(lost)}")
+                pending.appendleft(lost)
+            else:
+                stats[worker_id]["failed"] += 1
+                finished += 1
+
+    last_check = time.time()
+    while alive:
+        if time.time() - last_check > 5:
+            reap_dead_workers()
+            last_check = time.time()
+            if not alive:
+                break
+
+        try:
+            kind, worker_id, payload = events.get(timeout=5)
+        except queue.Empty:
+            continue
+
+        if kind == "ready":
+            dispatch(worker_id)
+        elif kind == "done":
+            pdf_path, seconds, error = payload
+            finished += 1
+            stats[worker_id]["seconds"] += seconds
+            if error is None:
+                stats[worker_id]["done"] += 1
+                status = f"✓ {task_label(pdf_path)} ({seconds:.0f}s)"
+            else:
+                stats[worker_id]["failed"] += 1
+                status = f"✗ {task_label(pdf_path)}: {error}"
+            print(f"[pool] w{worker_id} {status} - {finished}/{total} tasks")
+            dispatch(worker_id)
+            if workers[worker_id]["current"] is None:
+                alive.discard(worker_id)
+        elif kind == "pdf" and metrics is not None:
+            metrics.start_pdf(*payload)
+        elif kind == "page" and metrics is not None:
+            metrics.page_done(*payload)
+        elif kind == "pdf_done" and metrics is not None:
+            metrics.pdf_done()
+
+    for worker in workers.values():
+        worker["process"].join(timeout=30)
+
+    print(f"\n{'='*60}")
+    print("Worker pool summary")
+    for worker_id, worker_stats in stats.items():
+        print(f"  w{worker_id}: {worker_stats['done']} tasks done, {worker_stats['failed']} failed, "
+              f"{worker_stats['seconds'] / 60:.1f} min busy")
+    if pending:
+        print(f"  {len(pending)} tasks not processed (no worker left)")
+    print(f"{'='*60}")
+
+    return stats
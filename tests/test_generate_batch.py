@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ocr_engine import stop_reasons_of
+
+
+EOS = 0
+
+
+def test_padded_looping_row_is_a_repetition():
+    # Row 1 was stopped by the repetition guard, then padded with EOS while row 0 went on
+    rows = [[5, 6, 7, EOS], [1, 2, 3, 4, EOS, EOS, EOS]]
+    assert stop_reasons_of(rows, [EOS], {1: 4}, deadline_fired=False) == ["eos", "repetition"]
+
+
+def test_rows_without_eos():
+    rows = [[5, 6, 7], [1, 2, 3]]
+    assert stop_reasons_of(rows, [EOS], {}, deadline_fired=True) == ["deadline", "deadline"]
+    assert stop_reasons_of(rows, [EOS], {}, deadline_fired=False) == ["length", "length"]
+
+
+class ScriptedModel:
+    """
+    Greedy decoding stand-in: each row emits its scripted tokens, then EOS;
+    rows that are done (EOS or a stopping criterion) are padded with the pad
+    token like model.generate() does, here the EOS id as for Qwen2-VL
+    """
+
+    def __init__(self, scripts):
+        self.scripts = scripts
+        self.generation_config = SimpleNamespace(eos_token_id=EOS, pad_token_id=EOS)
+
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=2048, stopping_criteria=None, **kwargs):
+        import torch
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool)
+        for step in range(max_new_tokens):
+            tokens = torch.tensor([script[step] if step < len(script) else EOS for script in self.scripts])
+            tokens = torch.where(done, torch.full_like(tokens, EOS), tokens)
+            input_ids = torch.cat([input_ids, tokens[:, None]], dim=1)
+            done |= tokens == EOS
+            done |= stopping_criteria(input_ids, None)
+            if done.all():
+                break
+        return input_ids
+
+
+class FakePromptCache:
+    def __init__(self):
+        self.processor = SimpleNamespace(
+            batch_decode=lambda rows, **kwargs: [" ".join(str(token) for token in row if token != EOS)
+                                                 for row in rows])
+
+    def build_inputs(self, images, timer=None, prefixes=None):
+        import torch
+        return {"input_ids": torch.ones((len(images), 3), dtype=torch.long),
+                "attention_mask": torch.ones((len(images), 3), dtype=torch.long)}
+
+
+def test_generate_batch_reports_a_looping_row_in_a_batch():
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from ocr_engine import generate_batch
+
+    text_row = list(range(100, 1600))
+    looping_row = [1, 2, 3, 4] * 500
+    model = ScriptedModel([text_row, looping_row])
+
+    (text, text_stop), (loop, loop_stop) = generate_batch(model, FakePromptCache(), [None, None])
+
+    assert text_stop == "eos"
+    assert text == " ".join(str(token) for token in text_row)
+    assert loop_stop == "repetition"
+    assert loop.startswith("1 2 3 4")